@@ -46,7 +46,9 @@ class Settings(BaseSettings):
     # File Upload
     UPLOAD_DIR: str = "uploads"
     MAX_FILE_SIZE: int = 10 * 1024 * 1024  # 10MB
-    ALLOWED_EXTENSIONS: List[str] = ["jpg", "jpeg", "png", "pdf"]
+    MAX_UPLOAD_SIZE: int = int(os.getenv("MAX_UPLOAD_SIZE", "10"))  # MB, enforced while streaming
+    ALLOWED_EXTENSIONS: List[str] = ["jpg", "jpeg", "png", "pdf", "xml"]
+    ALLOWED_FILE_TYPES: List[str] = ALLOWED_EXTENSIONS
     
     # Logging
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
@@ -4,10 +4,15 @@ Groq sử dụng các hàm này để thao tác với database
 """
 
 import json
+import inspect
 from typing import Dict, Any, List, Optional
 from decimal import Decimal
 from datetime import datetime, date
 
+from utils.tool_cache import invoice_data_version, tool_result_cache
+from utils.tool_result_formatter import compact_tool_result
+from services.invoice_search_service import get_invoice_search_service
+
 class DecimalEncoder(json.JSONEncoder):
     """JSON encoder that handles Decimal and datetime objects"""
     def default(self, obj):
@@ -19,12 +24,151 @@ class DecimalEncoder(json.JSONEncoder):
             return obj.isoformat()
         return super().default(obj)
 
+# Tool schema for Groq function calling - built once at import time
+TOOLS_DESCRIPTION: List[Dict[str, Any]] = [
+    {
+        "name": "get_all_invoices",
+        "description": "Lấy danh sách tất cả hóa đơn từ database",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "limit": {"type": "integer", "description": "Số hóa đơn tối đa (default: 20)"},
+                "user_id": {"type": "string", "description": "Lọc theo user (optional)"}
+            }
+        }
+    },
+    {
+        "name": "search_invoices",
+        "description": "Tìm kiếm hóa đơn theo keyword (code, buyer, amount)",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "Keyword tìm kiếm"},
+                "limit": {"type": "integer", "description": "Số kết quả tối đa"}
+            },
+            "required": ["query"]
+        }
+    },
+    {
+        "name": "semantic_search_invoices",
+        "description": "Tìm hóa đơn theo ý nghĩa câu hỏi tự nhiên (vd: 'hóa đơn tiền điện EVN khoảng 300k'), trả về các hóa đơn liên quan nhất",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "Mô tả hóa đơn cần tìm"},
+                "top_k": {"type": "integer", "description": "Số kết quả tối đa (default: 5)"}
+            },
+            "required": ["query"]
+        }
+    },
+    {
+        "name": "get_invoice_by_id",
+        "description": "Lấy chi tiết một hóa đơn cụ thể",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "invoice_id": {"type": "integer", "description": "ID của hóa đơn"}
+            },
+            "required": ["invoice_id"]
+        }
+    },
+    {
+        "name": "get_statistics",
+        "description": "Lấy thống kê tổng quát về hóa đơn",
+        "parameters": {
+            "type": "object",
+            "properties": {}
+        }
+    },
+    {
+        "name": "filter_by_date",
+        "description": "Lọc hóa đơn theo khoảng thời gian (kèm tổng số lượng và tổng tiền)",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "start_date": {"type": "string", "description": "Ngày bắt đầu (YYYY-MM-DD)"},
+                "end_date": {"type": "string", "description": "Ngày kết thúc (YYYY-MM-DD)"},
+                "limit": {"type": "integer", "description": "Số hóa đơn tối đa trả về (default: 50)"}
+            },
+            "required": ["start_date", "end_date"]
+        }
+    },
+    {
+        "name": "get_invoices_by_type",
+        "description": "Lấy hóa đơn theo loại (electricity, water, sale, service), kèm tổng số lượng và tổng tiền",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "invoice_type": {"type": "string", "description": "Loại hóa đơn"},
+                "limit": {"type": "integer", "description": "Số hóa đơn tối đa trả về (default: 50)"}
+            },
+            "required": ["invoice_type"]
+        }
+    },
+    {
+        "name": "save_invoice_from_ocr",
+        "description": "Lưu hóa đơn từ dữ liệu OCR đã extract vào database",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "ocr_data": {
+                    "type": "object",
+                    "description": "Dữ liệu OCR đã extract từ extract_invoice_fields()",
+                    "properties": {
+                        "filename": {"type": "string", "description": "Tên file ảnh"},
+                        "invoice_code": {"type": "string", "description": "Mã hóa đơn"},
+                        "invoice_type": {"type": "string", "description": "Loại hóa đơn"},
+                        "buyer_name": {"type": "string", "description": "Tên người mua"},
+                        "seller_name": {"type": "string", "description": "Tên người bán"},
+                        "total_amount": {"type": "string", "description": "Tổng tiền"},
+                        "date": {"type": "string", "description": "Ngày hóa đơn"},
+                        "confidence_score": {"type": "number", "description": "Độ tin cậy"},
+                        "raw_text": {"type": "string", "description": "Văn bản OCR gốc"}
+                    },
+                    "required": ["invoice_code"]
+                }
+            },
+            "required": ["ocr_data"]
+        }
+    },
+    {
+        "name": "export_to_excel",
+        "description": "Xuất danh sách hóa đơn ra file Excel với các tùy chọn filter",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "filter_type": {
+                    "type": "string", 
+                    "description": "Loại filter: 'all' (tất cả), 'today' (hôm nay), 'date_range' (khoảng thời gian), 'type' (theo loại)",
+                    "enum": ["all", "today", "date_range", "type"]
+                },
+                "start_date": {"type": "string", "description": "Ngày bắt đầu (YYYY-MM-DD) - chỉ dùng với date_range"},
+                "end_date": {"type": "string", "description": "Ngày kết thúc (YYYY-MM-DD) - chỉ dùng với date_range"},
+                "invoice_type": {"type": "string", "description": "Loại hóa đơn - chỉ dùng với type filter"}
+            },
+            "required": ["filter_type"]
+        }
+    }
+]
+
+# Read-only tools whose serialized results are cached until invoice data changes
+CACHEABLE_TOOLS = {
+    "get_all_invoices",
+    "search_invoices",
+    "semantic_search_invoices",
+    "get_invoice_by_id",
+    "get_statistics",
+    "filter_by_date",
+    "get_invoices_by_type",
+}
+
 class GroqDatabaseTools:
     """Tools for Groq to interact with database via API"""
     
     def __init__(self, db_tools):
         """Initialize with database tools"""
         self.db_tools = db_tools
+        self._groq_tools_format = None
     
     def get_all_invoices(self, limit: int = 20, user_id: Optional[str] = None) -> Dict[str, Any]:
         """
@@ -75,6 +219,25 @@ class GroqDatabaseTools:
                 "error": str(e)
             }
     
+    def semantic_search_invoices(self, query: str, top_k: int = 5) -> Dict[str, Any]:
+        """
+        Tìm hóa đơn theo ngữ nghĩa (embedding của các trường chính + raw_text)
+        
+        Args:
+            query: Câu mô tả hóa đơn cần tìm
+            top_k: Số kết quả tối đa
+        
+        Returns:
+            Most relevant invoices with similarity scores
+        """
+        try:
+            return get_invoice_search_service(self.db_tools).search(query, top_k=top_k)
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e)
+            }
+    
     def get_invoice_by_id(self, invoice_id: int) -> Dict[str, Any]:
         """
         Lấy chi tiết một hóa đơn
@@ -122,31 +285,29 @@ class GroqDatabaseTools:
                 "error": str(e)
             }
     
-    def filter_by_date(self, start_date: str, end_date: str) -> Dict[str, Any]:
+    def filter_by_date(self, start_date: str, end_date: str, limit: int = 50) -> Dict[str, Any]:
         """
-        Lọc hóa đơn theo khoảng thời gian
+        Lọc hóa đơn theo khoảng thời gian (truy vấn SQL có index)
         
         Args:
             start_date: Ngày bắt đầu (YYYY-MM-DD)
             end_date: Ngày kết thúc (YYYY-MM-DD)
+            limit: Số hóa đơn tối đa trả về (count/tổng tiền tính trên tất cả)
         
         Returns:
-            Filtered invoices
+            Count, total amount and compact list of matching invoices
         """
         try:
-            invoices = self.db_tools.get_all_invoices(limit=1000)
-            filtered = []
-            for inv in invoices:
-                created_at = str(inv.get('created_at', '')).split('T')[0]
-                if start_date <= created_at <= end_date:
-                    filtered.append(inv)
+            filtered = self.db_tools.get_invoices_by_date_range(start_date, end_date, limit=limit)
             
             return {
                 "success": True,
                 "start_date": start_date,
                 "end_date": end_date,
-                "count": len(filtered),
-                "invoices": filtered
+                "count": filtered["count"],
+                "total_amount_sum": filtered["total_amount_sum"],
+                "returned": len(filtered["invoices"]),
+                "invoices": filtered["invoices"]
             }
         except Exception as e:
             return {
@@ -154,25 +315,27 @@ class GroqDatabaseTools:
                 "error": str(e)
             }
     
-    def get_invoices_by_type(self, invoice_type: str) -> Dict[str, Any]:
+    def get_invoices_by_type(self, invoice_type: str, limit: int = 50) -> Dict[str, Any]:
         """
-        Lấy hóa đơn theo loại (electricity, water, sale, service)
+        Lấy hóa đơn theo loại (electricity, water, sale, service) - truy vấn SQL có index
         
         Args:
             invoice_type: Loại hóa đơn
+            limit: Số hóa đơn tối đa trả về (count/tổng tiền tính trên tất cả)
         
         Returns:
-            Invoices of that type
+            Count, total amount and compact list of invoices of that type
         """
         try:
-            invoices = self.db_tools.get_all_invoices(limit=1000)
-            filtered = [inv for inv in invoices if inv.get('invoice_type') == invoice_type]
+            filtered = self.db_tools.get_invoices_by_type(invoice_type, limit=limit)
             
             return {
                 "success": True,
                 "type": invoice_type,
-                "count": len(filtered),
-                "invoices": filtered
+                "count": filtered["count"],
+                "total_amount_sum": filtered["total_amount_sum"],
+                "returned": len(filtered["invoices"]),
+                "invoices": filtered["invoices"]
             }
         except Exception as e:
             return {
@@ -287,117 +450,80 @@ class GroqDatabaseTools:
         Returns:
             List of tools descriptions
         """
-        return [
-            {
-                "name": "get_all_invoices",
-                "description": "Lấy danh sách tất cả hóa đơn từ database",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "limit": {"type": "integer", "description": "Số hóa đơn tối đa (default: 20)"},
-                        "user_id": {"type": "string", "description": "Lọc theo user (optional)"}
+        return TOOLS_DESCRIPTION
+    
+    def get_groq_tools_format(self) -> List[Dict[str, Any]]:
+        """
+        Tools ở định dạng {"type": "function", "function": ...} cho Groq API
+        Được tạo một lần và dùng lại cho mọi request
+        
+        Returns:
+            List of tools in Groq format
+        """
+        if self._groq_tools_format is None:
+            self._groq_tools_format = [
+                {
+                    "type": "function",
+                    "function": {
+                        "name": tool['name'],
+                        "description": tool['description'],
+                        "parameters": tool['parameters']
                     }
                 }
-            },
-            {
-                "name": "search_invoices",
-                "description": "Tìm kiếm hóa đơn theo keyword (code, buyer, amount)",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {"type": "string", "description": "Keyword tìm kiếm"},
-                        "limit": {"type": "integer", "description": "Số kết quả tối đa"}
-                    },
-                    "required": ["query"]
-                }
-            },
-            {
-                "name": "get_invoice_by_id",
-                "description": "Lấy chi tiết một hóa đơn cụ thể",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "invoice_id": {"type": "integer", "description": "ID của hóa đơn"}
-                    },
-                    "required": ["invoice_id"]
-                }
-            },
-            {
-                "name": "get_statistics",
-                "description": "Lấy thống kê tổng quát về hóa đơn",
-                "parameters": {
-                    "type": "object",
-                    "properties": {}
-                }
-            },
-            {
-                "name": "filter_by_date",
-                "description": "Lọc hóa đơn theo khoảng thời gian",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "start_date": {"type": "string", "description": "Ngày bắt đầu (YYYY-MM-DD)"},
-                        "end_date": {"type": "string", "description": "Ngày kết thúc (YYYY-MM-DD)"}
-                    },
-                    "required": ["start_date", "end_date"]
-                }
-            },
-            {
-                "name": "get_invoices_by_type",
-                "description": "Lấy hóa đơn theo loại (electricity, water, sale, service)",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "invoice_type": {"type": "string", "description": "Loại hóa đơn"}
-                    },
-                    "required": ["invoice_type"]
-                }
-            },
-            {
-                "name": "save_invoice_from_ocr",
-                "description": "Lưu hóa đơn từ dữ liệu OCR đã extract vào database",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "ocr_data": {
-                            "type": "object",
-                            "description": "Dữ liệu OCR đã extract từ extract_invoice_fields()",
-                            "properties": {
-                                "filename": {"type": "string", "description": "Tên file ảnh"},
-                                "invoice_code": {"type": "string", "description": "Mã hóa đơn"},
-                                "invoice_type": {"type": "string", "description": "Loại hóa đơn"},
-                                "buyer_name": {"type": "string", "description": "Tên người mua"},
-                                "seller_name": {"type": "string", "description": "Tên người bán"},
-                                "total_amount": {"type": "string", "description": "Tổng tiền"},
-                                "date": {"type": "string", "description": "Ngày hóa đơn"},
-                                "confidence_score": {"type": "number", "description": "Độ tin cậy"},
-                                "raw_text": {"type": "string", "description": "Văn bản OCR gốc"}
-                            },
-                            "required": ["invoice_code"]
-                        }
-                    },
-                    "required": ["ocr_data"]
-                }
-            },
-            {
-                "name": "export_to_excel",
-                "description": "Xuất danh sách hóa đơn ra file Excel với các tùy chọn filter",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "filter_type": {
-                            "type": "string", 
-                            "description": "Loại filter: 'all' (tất cả), 'today' (hôm nay), 'date_range' (khoảng thời gian), 'type' (theo loại)",
-                            "enum": ["all", "today", "date_range", "type"]
-                        },
-                        "start_date": {"type": "string", "description": "Ngày bắt đầu (YYYY-MM-DD) - chỉ dùng với date_range"},
-                        "end_date": {"type": "string", "description": "Ngày kết thúc (YYYY-MM-DD) - chỉ dùng với date_range"},
-                        "invoice_type": {"type": "string", "description": "Loại hóa đơn - chỉ dùng với type filter"}
-                    },
-                    "required": ["filter_type"]
-                }
-            }
-        ]
+                for tool in TOOLS_DESCRIPTION
+            ]
+        return self._groq_tools_format
+    
+    def _normalize_args(self, tool_name: str, kwargs: Dict[str, Any]) -> str:
+        """Canonical JSON of tool args (defaults applied, strings stripped) for cache keys"""
+        args = dict(kwargs)
+        method = getattr(self, tool_name, None)
+        if method is not None:
+            try:
+                bound = inspect.signature(method).bind(**kwargs)
+                bound.apply_defaults()
+                args = dict(bound.arguments)
+            except TypeError:
+                pass
+        args = {k: v.strip() if isinstance(v, str) else v for k, v in args.items()}
+        return json.dumps(args, sort_keys=True, cls=DecimalEncoder)
+    
+    def call_tool_serialized(self, tool_name: str, max_tokens: Optional[int] = None, **kwargs) -> str:
+        """
+        Gọi một tool và trả về kết quả đã serialize (JSON)
+        
+        Kết quả của tools chỉ đọc được cache theo (tool, args đã chuẩn hóa,
+        ngân sách token, version dữ liệu hóa đơn) nên câu hỏi lặp lại không cần truy vấn DB.
+        
+        Args:
+            tool_name: Tên của tool
+            max_tokens: Nếu có, rút gọn kết quả cho LLM trong ngân sách token này
+            **kwargs: Tham số của tool
+        
+        Returns:
+            JSON string của kết quả
+        """
+        if tool_name not in CACHEABLE_TOOLS:
+            return self._serialize(self.call_tool(tool_name, **kwargs), max_tokens)
+        
+        # Read the version before querying: a concurrent bump leaves this entry unreachable
+        key = (tool_name, self._normalize_args(tool_name, kwargs), max_tokens, invoice_data_version.current)
+        cached = tool_result_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        result = self.call_tool(tool_name, **kwargs)
+        serialized = self._serialize(result, max_tokens)
+        if result.get("success"):
+            tool_result_cache.set(key, serialized)
+        return serialized
+    
+    @staticmethod
+    def _serialize(result: Dict[str, Any], max_tokens: Optional[int]) -> str:
+        """Full JSON, or compact token-budgeted JSON when max_tokens is given"""
+        if max_tokens is None:
+            return json.dumps(result, cls=DecimalEncoder)
+        return compact_tool_result(result, max_tokens, encoder=DecimalEncoder)
     
     def call_tool(self, tool_name: str, **kwargs) -> Dict[str, Any]:
         """
@@ -414,6 +540,8 @@ class GroqDatabaseTools:
             return self.get_all_invoices(**kwargs)
         elif tool_name == "search_invoices":
             return self.search_invoices(**kwargs)
+        elif tool_name == "semantic_search_invoices":
+            return self.semantic_search_invoices(**kwargs)
         elif tool_name == "get_invoice_by_id":
             return self.get_invoice_by_id(**kwargs)
         elif tool_name == "get_statistics":
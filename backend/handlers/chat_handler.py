@@ -1,18 +1,146 @@
 import random
 import re
-import requests
 import os
 from datetime import datetime
 from typing import Dict, List, Any, Optional
 from config.settings import settings
+from utils.session_store import get_session_store
+from utils.intent_classifier import IntentClassifier
+from utils.response_cache import response_cache
+from utils.text_processor import TextProcessor
+from services.invoice_service import InvoiceService
+from services.db_context_service import get_db_context_service
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Patterns cho nhận diện intent - Cải thiện để nhận diện tốt hơn
+# Đặt camera_control lên đầu để ưu tiên
+INTENT_PATTERNS = {
+    'camera_control': [
+        r'(mở camera|bật camera|open camera)',
+        r'(mở camere|mở camara|mở cammera)',  # ⭐ Lỗi chính tả phổ biến
+        r'(mở máy ảnh|bật máy ảnh|máy ảnh)',  # ⭐ Từ đồng nghĩa
+        r'(chụp ảnh|take photo|capture|chụp)',
+        r'(tắt camera|đóng camera|close camera|đóng|tắt)',  # ⭐ Thêm "đóng", "tắt" đơn giản
+        r'camera|camere|camara',  # ⭐ Bao gồm cả lỗi chính tả
+        r'(chụp hóa đơn|scan invoice)'
+    ],
+    'list_invoices': [  # ⭐ Đặt lên đầu để ưu tiên
+        r'(danh sách.*hóa đơn|hóa đơn.*danh sách)',
+        r'(xem.*danh sách.*hóa đơn|danh sách.*hóa đơn.*đã.*lưu)',
+        r'(hóa đơn.*đã.*lưu|hóa đơn.*đã.*upload)',
+        r'(liệt kê.*hóa đơn|show.*all.*invoice)',
+        r'(xem.*tất cả.*hóa đơn|all.*invoice)',
+        r'(list.*invoice|saved.*invoice)',
+        r'(tìm.*hóa đơn.*ngày|xem.*hóa đơn.*hôm|hóa đơn.*theo.*ngày)',  # ⭐ Tìm theo ngày
+        r'(hóa đơn.*hôm nay|hóa đơn.*hôm qua|hóa đơn.*tuần này)',  # ⭐ Theo thời gian
+        r'\b(xem.*danh sách|danh sách)\b',  # ⭐ NEW: "xem danh sách" hoặc chỉ "danh sách"
+        r'\b(ds.*hóa đơn|ds hd)\b',  # ⭐ NEW: Viết tắt
+    ],
+    'invoice_detail': [  # ⭐ NEW: Xem chi tiết hóa đơn
+        r'(xem.*hóa đơn|chi tiết.*hóa đơn|thông tin.*hóa đơn)',
+        r'(xem.*mã|chi tiết.*mã|thông tin.*mã)',
+        r'(invoice.*detail|view.*invoice)',
+        r'(hóa đơn.*số|hóa đơn.*mã)',
+    ],
+    'greeting': [
+        r'\b(xin chào|chào|hello|hi|hey|chao)\b',
+        r'\b(good morning|good afternoon|good evening)\b',
+        r'\b(chào buổi sáng|chào buổi chiều|chào buổi tối)\b',
+        r'^(chào|hello|hi)$'
+    ],
+    'invoice_query': [
+        r'(hóa đơn|invoice|bill)',
+        r'(mã số thuế|tax code)',
+        r'(thanh toán|payment)',
+        r'(VAT|thuế giá trị gia tăng)',
+        r'(tạo hóa đơn|làm thế nào.*tạo)',
+        r'(xuất hóa đơn|in hóa đơn)'
+    ],
+    'data_query': [
+        r'(xem dữ liệu.*hóa đơn|dữ liệu.*hóa đơn)',  # Match "xem dữ liệu hóa đơn" specifically
+        r'(xem.*hóa đơn.*đã.*upload|xem.*hóa đơn.*đã.*lưu)',  # Match "xem hóa đơn đã upload/lưu"
+        r'(xem.*ho[aá].*[dđ].*n|xem.*c[aá]c.*ho[aá])',  # Flexible for typos: xem hoa don, xem cac hoa
+        r'(ho[aá].*[dđ].*n.*[dđ][aă].*l[ưu]u)',  # hoa don da luu with typos
+        r'(xem dữ liệu|dữ liệu hiện tại|data)',
+        r'(xem giá|giá cả|price)',
+        r'(thống kê|báo cáo|report)',
+        r'(danh sách|list)',
+        r'(tìm kiếm thông tin|search|tìm kiếm)',
+        r'(hiển thị|show|display)',
+        r'(có bao nhiêu|bao nhiêu|tổng số|đếm|count|số lượng)',
+        r'(xem số|xem tổng|xem toàn bộ)',
+        r'(hóa đơn|hoá đơn|ho[aá]\s*[dđ].*n|invoice)',  # Flexible invoice matching
+    ],
+    'invoice_analysis': [
+        r'(phân tích|analyze|extract)',
+        r'(đọc hóa đơn|read invoice)',
+        r'(nhận dạng|recognize|identify)',
+        r'(thông tin hóa đơn|invoice information)'
+    ],
+    'template_help': [
+        r'(mẫu hóa đơn|template)',
+        r'(tạo mẫu|create template)',
+        r'(thiết kế hóa đơn|design invoice)'
+    ],
+    'help': [
+        r'(help|hỗ trợ|giúp đỡ)',
+        r'(hướng dẫn|guide|instruction)',
+        r'(làm sao|how to|cách)',
+        r'(tôi cần|i need|cần)'
+    ],
+    'upload_image': [
+        r'(upload ảnh|tải ảnh|up ảnh)',
+        r'(gửi ảnh|send image)',
+        r'(ảnh từ máy|file ảnh)',
+        r'(chọn file|select file)'
+    ],
+    'file_analysis': [
+        r'(\.jpg|\.png|\.jpeg|\.pdf)',
+        r'(xem file|phân tích file)',
+        r'(file.*dữ liệu|dữ liệu.*file)',
+        r'(kết quả.*file|file.*kết quả)',
+        r'(đọc dữ liệu từ ảnh|read data from image)',
+        r'(đọc ảnh|read image)',
+        r'(xử lý ảnh|process image)',
+        r'(phân tích ảnh|analyze image)',
+        r'(mau-hoa-don|template)',
+        r'(\.jpg|\.png|\.jpeg|\.pdf).*',
+        r'.*\.(jpg|png|jpeg|pdf)',
+        r'(trả ảnh|show image)',
+        r'(xem ảnh|view image)',
+        r'(ảnh.*gì|what.*image)'
+    ],
+    'goodbye': [
+        r'(tạm biệt|goodbye|bye|see you)',
+        r'(cảm ơn|thank you|thanks)',
+        r'(kết thúc|end|finish)'
+    ]
+}
+
+# Checked before INTENT_PATTERNS: file names and image keywords always mean file_analysis
+FILE_ANALYSIS_OVERRIDES = [
+    r'[a-zA-Z0-9\-_\.]+\.(jpg|jpeg|png|pdf|gif)',
+    r'(mau-hoa-don|template|đọc dữ liệu từ ảnh|phân tích ảnh|xem ảnh|đọc ảnh|trả ảnh|xem file)',
+    r'(dữ liệu từ ảnh)',
+]
+
+# All intent patterns compiled once (priority = order above)
+INTENT_CLASSIFIER = IntentClassifier([('file_analysis', FILE_ANALYSIS_OVERRIDES), *INTENT_PATTERNS.items()])
+
+
 class ChatHandler:
-    def __init__(self):
+    def __init__(self, invoice_service: Optional[InvoiceService] = None):
         self.config = settings  # Use settings instance directly
-        self.conversation_history = {}
+        self.session_store = get_session_store()
+        
+        # Invoice data is read in-process (no loopback HTTP calls to our own API),
+        # through the process-wide database tools shared with main.py
+        if invoice_service is None:
+            from utils.database_tools_sqlite import get_database_tools
+            invoice_service = InvoiceService(get_database_tools())
+        self.invoice_service = invoice_service
         
         # Rasa integration - DISABLED
         self.rasa_url = None
@@ -58,110 +186,8 @@ class ChatHandler:
         # Rasa disabled - using pattern-based system
         logger.info("Using pattern-based intent detection (Rasa disabled)")
         
-        # Patterns cho nhận diện intent - Cải thiện để nhận diện tốt hơn
-        # Đặt camera_control lên đầu để ưu tiên
-        self.patterns = {
-            'camera_control': [
-                r'(mở camera|bật camera|open camera)',
-                r'(mở camere|mở camara|mở cammera)',  # ⭐ Lỗi chính tả phổ biến
-                r'(mở máy ảnh|bật máy ảnh|máy ảnh)',  # ⭐ Từ đồng nghĩa
-                r'(chụp ảnh|take photo|capture|chụp)',
-                r'(tắt camera|đóng camera|close camera|đóng|tắt)',  # ⭐ Thêm "đóng", "tắt" đơn giản
-                r'camera|camere|camara',  # ⭐ Bao gồm cả lỗi chính tả
-                r'(chụp hóa đơn|scan invoice)'
-            ],
-            'list_invoices': [  # ⭐ Đặt lên đầu để ưu tiên
-                r'(danh sách.*hóa đơn|hóa đơn.*danh sách)',
-                r'(xem.*danh sách.*hóa đơn|danh sách.*hóa đơn.*đã.*lưu)',
-                r'(hóa đơn.*đã.*lưu|hóa đơn.*đã.*upload)',
-                r'(liệt kê.*hóa đơn|show.*all.*invoice)',
-                r'(xem.*tất cả.*hóa đơn|all.*invoice)',
-                r'(list.*invoice|saved.*invoice)',
-                r'(tìm.*hóa đơn.*ngày|xem.*hóa đơn.*hôm|hóa đơn.*theo.*ngày)',  # ⭐ Tìm theo ngày
-                r'(hóa đơn.*hôm nay|hóa đơn.*hôm qua|hóa đơn.*tuần này)',  # ⭐ Theo thời gian
-                r'\b(xem.*danh sách|danh sách)\b',  # ⭐ NEW: "xem danh sách" hoặc chỉ "danh sách"
-                r'\b(ds.*hóa đơn|ds hd)\b',  # ⭐ NEW: Viết tắt
-            ],
-            'invoice_detail': [  # ⭐ NEW: Xem chi tiết hóa đơn
-                r'(xem.*hóa đơn|chi tiết.*hóa đơn|thông tin.*hóa đơn)',
-                r'(xem.*mã|chi tiết.*mã|thông tin.*mã)',
-                r'(invoice.*detail|view.*invoice)',
-                r'(hóa đơn.*số|hóa đơn.*mã)',
-            ],
-            'greeting': [
-                r'\b(xin chào|chào|hello|hi|hey|chao)\b',
-                r'\b(good morning|good afternoon|good evening)\b',
-                r'\b(chào buổi sáng|chào buổi chiều|chào buổi tối)\b',
-                r'^(chào|hello|hi)$'
-            ],
-            'invoice_query': [
-                r'(hóa đơn|invoice|bill)',
-                r'(mã số thuế|tax code)',
-                r'(thanh toán|payment)',
-                r'(VAT|thuế giá trị gia tăng)',
-                r'(tạo hóa đơn|làm thế nào.*tạo)',
-                r'(xuất hóa đơn|in hóa đơn)'
-            ],
-            'data_query': [
-                r'(xem dữ liệu.*hóa đơn|dữ liệu.*hóa đơn)',  # Match "xem dữ liệu hóa đơn" specifically
-                r'(xem.*hóa đơn.*đã.*upload|xem.*hóa đơn.*đã.*lưu)',  # Match "xem hóa đơn đã upload/lưu"
-                r'(xem.*ho[aá].*[dđ].*n|xem.*c[aá]c.*ho[aá])',  # Flexible for typos: xem hoa don, xem cac hoa
-                r'(ho[aá].*[dđ].*n.*[dđ][aă].*l[ưu]u)',  # hoa don da luu with typos
-                r'(xem dữ liệu|dữ liệu hiện tại|data)',
-                r'(xem giá|giá cả|price)',
-                r'(thống kê|báo cáo|report)',
-                r'(danh sách|list)',
-                r'(tìm kiếm thông tin|search|tìm kiếm)',
-                r'(hiển thị|show|display)',
-                r'(có bao nhiêu|bao nhiêu|tổng số|đếm|count|số lượng)',
-                r'(xem số|xem tổng|xem toàn bộ)',
-                r'(hóa đơn|hoá đơn|ho[aá]\s*[dđ].*n|invoice)',  # Flexible invoice matching
-            ],
-            'invoice_analysis': [
-                r'(phân tích|analyze|extract)',
-                r'(đọc hóa đơn|read invoice)',
-                r'(nhận dạng|recognize|identify)',
-                r'(thông tin hóa đơn|invoice information)'
-            ],
-            'template_help': [
-                r'(mẫu hóa đơn|template)',
-                r'(tạo mẫu|create template)',
-                r'(thiết kế hóa đơn|design invoice)'
-            ],
-            'help': [
-                r'(help|hỗ trợ|giúp đỡ)',
-                r'(hướng dẫn|guide|instruction)',
-                r'(làm sao|how to|cách)',
-                r'(tôi cần|i need|cần)'
-            ],
-            'upload_image': [
-                r'(upload ảnh|tải ảnh|up ảnh)',
-                r'(gửi ảnh|send image)',
-                r'(ảnh từ máy|file ảnh)',
-                r'(chọn file|select file)'
-            ],
-            'file_analysis': [
-                r'(\.jpg|\.png|\.jpeg|\.pdf)',
-                r'(xem file|phân tích file)',
-                r'(file.*dữ liệu|dữ liệu.*file)',
-                r'(kết quả.*file|file.*kết quả)',
-                r'(đọc dữ liệu từ ảnh|read data from image)',
-                r'(đọc ảnh|read image)',
-                r'(xử lý ảnh|process image)',
-                r'(phân tích ảnh|analyze image)',
-                r'(mau-hoa-don|template)',
-                r'(\.jpg|\.png|\.jpeg|\.pdf).*',
-                r'.*\.(jpg|png|jpeg|pdf)',
-                r'(trả ảnh|show image)',
-                r'(xem ảnh|view image)',
-                r'(ảnh.*gì|what.*image)'
-            ],
-            'goodbye': [
-                r'(tạm biệt|goodbye|bye|see you)',
-                r'(cảm ơn|thank you|thanks)',
-                r'(kết thúc|end|finish)'
-            ]
-        }
+        self.text_processor = TextProcessor()
+        self.patterns = INTENT_PATTERNS
 
     async def process_message(self, message: str, user_id: str = 'anonymous') -> Dict[str, Any]:
         """Xử lý tin nhắn từ user với pattern-based system"""
@@ -175,8 +201,11 @@ class ChatHandler:
             # Nhận diện intent
             intent = self.detect_intent(message)
             
-            # Xử lý theo intent
-            response = self.handle_intent(intent, message, context)
+            # Xử lý theo intent (câu trả lời tĩnh lấy từ cache nếu có)
+            response = response_cache.get("chat", intent, message)
+            if response is None:
+                response = self.handle_intent(intent, message, context)
+                response_cache.set("chat", intent, message, response)
             
             # Cập nhật lịch sử hội thoại
             self.update_conversation_history(user_id, message, response)
@@ -193,41 +222,13 @@ class ChatHandler:
             }
     
     def detect_intent(self, message: str) -> str:
-        """Phát hiện intent từ tin nhắn"""
-        message_clean = self.text_processor.normalize(message.lower())
+        """Phát hiện intent từ tin nhắn (rules đã compile sẵn, theo thứ tự ưu tiên)"""
         message_lower = message.lower()
-        logger.info(f"Original message: '{message}'")
-        logger.info(f"Cleaned message: '{message_clean}'")
-        
-        # Check for filename pattern first (highest priority)
-        import re
-        filename_pattern = r'[a-zA-Z0-9\-_\.]+\.(jpg|jpeg|png|pdf|gif)'
-        if re.search(filename_pattern, message_lower, re.IGNORECASE):
-            logger.info(f"Filename pattern found, returning 'file_analysis'")
-            return 'file_analysis'
-        
-        # Check for file extensions or image-related keywords
-        file_keywords = ['mau-hoa-don', 'template', 'đọc dữ liệu từ ảnh', 'phân tích ảnh', 'xem ảnh', 'đọc ảnh', 'trả ảnh', 'xem file']
-        if any(keyword in message_lower for keyword in file_keywords):
-            logger.info(f"File-related keyword '{[k for k in file_keywords if k in message_lower]}' found, returning 'file_analysis'")
-            return 'file_analysis'
-            
-        # Check for "xem dữ liệu từ ảnh" specifically
-        if 'xem dữ liệu từ ảnh' in message_lower or 'dữ liệu từ ảnh' in message_lower or 'trả ảnh' in message_lower:
-            logger.info(f"'xem dữ liệu từ ảnh' or 'trả ảnh' pattern found, returning 'file_analysis'")
-            return 'file_analysis'
+        message_clean = self.text_processor.normalize(message_lower)
         
-        for intent, patterns in self.patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, message_clean, re.IGNORECASE):
-                    logger.info(f"Matched intent '{intent}' with pattern '{pattern}'")
-                    return intent
-                elif re.search(pattern, message.lower(), re.IGNORECASE):
-                    logger.info(f"Matched intent '{intent}' with pattern '{pattern}' (original message)")
-                    return intent
-        
-        logger.info(f"No intent matched, defaulting to 'general'")
-        return 'general'
+        intent = INTENT_CLASSIFIER.classify(message_clean, message_lower) or 'general'
+        logger.debug(f"Detected intent '{intent}' for message: '{message}'")
+        return intent
     
     def handle_intent(self, intent: str, message: str, context: Dict) -> Dict[str, Any]:
         """Xử lý intent và trả về response"""
@@ -541,19 +542,13 @@ Bạn muốn upload ảnh bây giờ không?''',
             
             # Gọi backend OCR hoặc trả về kết quả đã lưu
             try:
-                import requests
                 import json
                 
                 # Thử lấy OCR result từ database trước
                 try:
-                    backend_response = requests.get(
-                        f"http://localhost:8000/api/ocr/saved-invoices",
-                        params={'limit': 50},
-                        timeout=5
-                    )
+                    saved_invoices = self._get_saved_invoices(limit=50)
                     
-                    if backend_response.status_code == 200:
-                        saved_invoices = backend_response.json()
+                    if saved_invoices is not None:
                         # Tìm invoice với filename tương ứng
                         matching_invoice = None
                         for invoice in saved_invoices:
@@ -756,14 +751,10 @@ Bạn muốn phân tích file nào?''',
             
             search_code = code_match.group(1)
             
-            # Get all invoices and search
-            response = requests.get(
-                f"{self.config.BACKEND_URL}/api/ocr/saved-invoices",
-                params={'limit': 100}
-            )
+            # Get recent invoices and search
+            invoices = self._get_saved_invoices(limit=100)
             
-            if response.status_code == 200:
-                invoices = response.json()
+            if invoices is not None:
                 
                 # Find invoice by code
                 found_invoice = None
@@ -882,7 +873,7 @@ Bạn muốn phân tích file nào?''',
             
             else:
                 return {
-                    'message': f'❌ Lỗi khi truy vấn dữ liệu: {response.status_code}',
+                    'message': '❌ Lỗi khi truy vấn dữ liệu hóa đơn',
                     'type': 'text'
                 }
                 
@@ -1072,32 +1063,24 @@ Bạn muốn thử upload hóa đơn để training không?''',
     
     def get_conversation_context(self, user_id: str) -> Dict:
         """Lấy ngữ cảnh cuộc hội thoại"""
-        return self.conversation_history.get(user_id, {
+        return self.session_store.get("chat_context", user_id) or {
             'messages': [],
-            'started_at': datetime.now(),
+            'started_at': datetime.now().isoformat(),
             'last_intent': None
-        })
+        }
     
     def update_conversation_history(self, user_id: str, user_message: str, bot_response: Dict):
         """Cập nhật lịch sử hội thoại"""
-        if user_id not in self.conversation_history:
-            self.conversation_history[user_id] = {
-                'messages': [],
-                'started_at': datetime.now(),
-                'last_intent': None
-            }
+        context = self.get_conversation_context(user_id)
         
-        self.conversation_history[user_id]['messages'].append({
+        # Giữ chỉ 50 tin nhắn gần nhất
+        context['messages'] = (context['messages'] + [{
             'user': user_message,
             'bot': bot_response['message'],
-            'timestamp': datetime.now(),
+            'timestamp': datetime.now().isoformat(),
             'type': bot_response.get('type', 'text')
-        })
-        
-        # Giữ chỉ 50 tin nhắn gần nhất
-        if len(self.conversation_history[user_id]['messages']) > 50:
-            self.conversation_history[user_id]['messages'] = \
-                self.conversation_history[user_id]['messages'][-50:]
+        }])[-50:]
+        self.session_store.set("chat_context", user_id, context)
     
     # === RASA REMOVED - Using Pattern-Based System Only ===
     
@@ -1232,31 +1215,18 @@ Bạn muốn thử upload hóa đơn để training không?''',
                     target_date = now_vn - timedelta(days=1)
                     date_str = f" (Hôm qua - {(now_vn - timedelta(days=1)).strftime('%d/%m/%Y')})"
             
-            # Call backend API to get saved invoices
-            response = requests.get(
-                f"{self.config.BACKEND_URL}/api/invoices",
-                params={'limit': 100}  # Get more for filtering
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                invoices = result.get('invoices', [])
-                
-                # ⭐ Filter by date if specified
+            # Get saved invoices in-process; the date filter runs in SQL
+            try:
                 if target_date:
-                    filtered_invoices = []
-                    for inv in invoices:
-                        created_at = inv.get('created_at', '')
-                        if created_at:
-                            try:
-                                inv_date = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                                # Compare only date (ignore time)
-                                if inv_date.date() == target_date.date():
-                                    filtered_invoices.append(inv)
-                            except:
-                                pass
-                    invoices = filtered_invoices
-                
+                    result = self.invoice_service.get_invoices_by_date(target_date.date(), limit=10)
+                else:
+                    result = self.invoice_service.get_invoice_list(limit=10)
+                invoices = result.get('data', [])
+            except Exception as e:
+                logger.error(f"Error getting invoices: {e}")
+                invoices = None
+            
+            if invoices is not None:
                 if not invoices:
                     if target_date:
                         return {
@@ -1286,7 +1256,7 @@ Bạn muốn thử upload hóa đơn để training không?''',
                     invoice_type = inv.get('invoice_type', 'general')
                     buyer_name = inv.get('buyer_name', 'N/A')
                     total_amount = inv.get('total_amount', 'N/A')
-                    created_at = inv.get('created_at', '')
+                    created_at = str(inv.get('created_at') or '')
                     filename = inv.get('filename', '')
                     
                     # ⭐ IMPROVED: Extract invoice code from ocr_results
@@ -1323,7 +1293,9 @@ Bạn muốn thử upload hóa đơn để training không?''',
                                     if code_match:
                                         invoice_code = code_match.group(1)
                     
-                    # Fallback to filename or ID
+                    # Invoice code column, then filename or ID
+                    if not invoice_code and inv.get('invoice_code') not in (None, '', 'UNKNOWN', 'N/A'):
+                        invoice_code = inv.get('invoice_code')
                     if not invoice_code or invoice_code == 'N/A':
                         if filename and filename != 'Unknown':
                             # Use first part of filename (max 15 chars for display)
@@ -1373,7 +1345,7 @@ Bạn muốn thử upload hóa đơn để training không?''',
             
             else:
                 return {
-                    'message': f'❌ Không thể lấy danh sách hóa đơn. Lỗi: {response.status_code}',
+                    'message': '❌ Không thể lấy danh sách hóa đơn.',
                     'type': 'error',
                     'suggestions': [
                         'Thử lại',
@@ -1383,8 +1355,8 @@ Bạn muốn thử upload hóa đơn để training không?''',
                     ]
                 }
                 
-        except requests.RequestException as e:
-            logger.error(f"Network error getting invoices: {str(e)}")
+        except Exception as e:
+            logger.error(f"Error listing invoices: {str(e)}")
             return {
                 'message': '❌ Lỗi kết nối khi lấy danh sách hóa đơn. Vui lòng thử lại.',
                 'type': 'error',
@@ -1394,48 +1366,30 @@ Bạn muốn thử upload hóa đơn để training không?''',
     def _get_database_context_for_ai(self) -> Dict:
         """Get database context for AI enhancement"""
         try:
-            # Get recent invoices from backend
-            response = requests.get(
-                "http://localhost:8000/api/ocr/saved-invoices",
-                params={'limit': 20},
-                timeout=5
-            )
+            # Cached snapshot - rebuilt only when invoice data changed
+            snapshot = get_db_context_service(self.invoice_service.db_tools).get_context()
             
-            if response.status_code == 200:
-                invoices = response.json()
-                
-                # Prepare context
-                context = {
-                    'total_invoices': len(invoices),
-                    'recent_invoices': invoices[:5],  # Most recent 5
-                    'invoice_types': list(set([inv.get('invoice_type', 'Unknown') for inv in invoices])),
-                    'date_range': self._get_date_range(invoices)
-                }
-                
-                return context
-            else:
-                return {'error': 'Could not fetch database context'}
+            # Prepare context
+            context = {
+                'total_invoices': snapshot['total_invoices'],
+                'recent_invoices': snapshot['recent_invoices'][:5],  # Most recent 5
+                'invoice_types': list(snapshot['invoice_types']),
+                'date_range': snapshot['date_range']
+            }
+            
+            return context
                 
         except Exception as e:
             logger.warning(f"Error getting database context: {e}")
             return {'error': str(e)}
     
-    def _get_date_range(self, invoices: List[Dict]) -> str:
-        """Get date range from invoices"""
-        if not invoices:
-            return "No data"
-            
-        dates = []
-        for inv in invoices:
-            created_at = inv.get('created_at')
-            if created_at:
-                dates.append(created_at[:10])  # Get date part
-        
-        if dates:
-            dates.sort()
-            return f"{dates[0]} to {dates[-1]}"
-        
-        return "Unknown range"
+    def _get_saved_invoices(self, limit: int = 20) -> Optional[List[Dict]]:
+        """Most recent saved invoices from the database, or None on error"""
+        try:
+            return self.invoice_service.get_invoice_list(limit=limit).get('data', [])
+        except Exception as e:
+            logger.warning(f"Could not load saved invoices: {e}")
+            return None
     
     def _format_invoice_info(self, extracted: Dict) -> str:
         """Format all non-empty invoice fields for display"""
@@ -3,78 +3,27 @@ Groq Chat Handler with Database API Integration
 Groq thao tác với database thông qua API tools
 """
 
+import asyncio
+import functools
 import json
 import logging
 import os
 from typing import Dict, List, Any, Optional
 from datetime import datetime, date
 from decimal import Decimal
-from groq import Groq
+from concurrent.futures import ThreadPoolExecutor
+from groq import AsyncGroq
 
-logger = logging.getLogger(__name__)
+from utils.token_counter import count_tokens, count_message_tokens
+from utils.session_store import get_session_store
+from utils.semantic_router import get_semantic_router
+from utils.response_cache import response_cache, GENERIC_INTENT_CLASSIFIER, normalize_message
 
-class DecimalEncoder(json.JSONEncoder):
-    """JSON encoder that handles Decimal and datetime objects"""
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return float(obj)
-        elif isinstance(obj, datetime):
-            return obj.isoformat()
-        elif isinstance(obj, date):
-            return obj.isoformat()
-        return super().default(obj)
+logger = logging.getLogger(__name__)
 
-class GroqChatHandler:
-    """
-    Groq Chat Handler với khả năng gọi API để thao tác database
-    
-    Flow:
-    1. User gửi message
-    2. Groq analyze intent + chọn tools cần thiết
-    3. Groq gọi API tools để lấy data từ database
-    4. Groq combine data + sinh response
-    """
-    
-    def __init__(self, db_tools=None, groq_tools=None):
-        """Initialize Groq handler with database tools"""
-        # Get API key from environment
-        api_key = os.getenv("GROQ_API_KEY")
-        if not api_key:
-            logger.warning("⚠️ GROQ_API_KEY not found in environment")
-            self.client = None
-        else:
-            self.client = Groq(api_key=api_key)
-        
-        self.db_tools = db_tools
-        self.groq_tools = groq_tools
-        self.conversation_history = {}
-        self.model = "llama-3.3-70b-versatile"
-        self.db_tools = db_tools
-        self.groq_tools = groq_tools
-        self.conversation_history = {}
-        self.model = "llama-3.3-70b-versatile"
-        
-        # Store recent OCR results for saving
-        self.recent_ocr_results = {}
-        
-        # Import services
-        try:
-            from utils.sentiment_service import sentiment_service
-            from utils.conversation_service import conversation_service
-            self.sentiment_service = sentiment_service
-            self.conversation_service = conversation_service
-        except ImportError:
-            self.sentiment_service = None
-            self.conversation_service = None
-        
-        # Build tools description for system prompt
-        tools_desc = ""
-        if groq_tools:
-            for tool in groq_tools.get_tools_description():
-                tools_desc += f"\n- {tool['name']}: {tool['description']}"
-        
-        # System prompt với tools
-        self.system_prompt = f"""Bạn là trợ lý AI thông minh cho hệ thống quản lý hóa đơn.
+# Static system prompt. Only {tools_desc} is filled in (once, at init); per-turn
+# parts go after it so the prefix stays identical across requests.
+SYSTEM_PROMPT_TEMPLATE = """Bạn là trợ lý AI thông minh cho hệ thống quản lý hóa đơn.
 
 Nhiệm vụ:
 1. Phân tích yêu cầu của người dùng
@@ -88,6 +37,7 @@ Quy tắc QUAN TRỌNG:
 - CHỈ KHI người dùng yêu cầu dữ liệu cụ thể: "xem hóa đơn", "lấy danh sách", "tìm kiếm", "thống kê" → mới dùng tools
 - Khi người dùng muốn LƯU HÓA ĐƠN từ OCR, hãy sử dụng tool save_invoice_from_ocr
 - Khi người dùng muốn XUẤT FILE EXCEL, hãy sử dụng tool export_to_excel
+- Khi người dùng MÔ TẢ hóa đơn cần tìm (nhà cung cấp, nội dung, số tiền gần đúng), hãy dùng semantic_search_invoices thay vì lấy toàn bộ danh sách
 - Sau khi gọi tool, phân tích kết quả và trả lời
 - Trả lời bằng Tiếng Việt
 - Luôn cung cấp dữ liệu thực từ database
@@ -128,6 +78,131 @@ CÁCH SỬ DỤNG: Khi bạn cần lấy dữ liệu, hãy nói rõ:
 3. Cung cấp URL download: "Bạn có thể tải file Excel tại: [download_url]"
 
 QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung chung!"""
+
+# Session store namespaces and per-user caps
+HISTORY_NAMESPACE = "groq_history"
+OCR_NAMESPACE = "groq_ocr"
+SUMMARY_NAMESPACE = "groq_summary"
+MAX_HISTORY_MESSAGES = 40  # last 20 exchanges
+MAX_RECENT_OCR_RESULTS = 5
+
+# Rolling summary: the prompt carries the stored summary plus at most HISTORY_WINDOW
+# raw messages; once history grows past the window, all but the last
+# SUMMARY_KEEP_MESSAGES are folded into the summary in the background
+HISTORY_WINDOW = int(os.getenv("GROQ_HISTORY_WINDOW", "10"))
+SUMMARY_KEEP_MESSAGES = int(os.getenv("GROQ_SUMMARY_KEEP", "6"))
+SUMMARY_MAX_TOKENS = 300
+SUMMARY_MODEL = os.getenv("GROQ_SUMMARY_MODEL", "llama-3.1-8b-instant")
+
+SUMMARY_PROMPT = """Bạn tóm tắt cuộc hội thoại giữa người dùng và trợ lý quản lý hóa đơn.
+Gộp tóm tắt hiện có với đoạn hội thoại mới thành MỘT bản tóm tắt ngắn gọn (tối đa 150 từ, tiếng Việt).
+Giữ lại: yêu cầu của người dùng, mã hóa đơn, số tiền, ngày tháng, kết quả quan trọng và việc còn dang dở.
+Bỏ qua lời chào và nội dung lặp lại. Chỉ trả về bản tóm tắt."""
+
+# Token budget for one tool result fed back to the LLM (compact table, well-formed JSON)
+TOOL_RESULT_MAX_TOKENS = int(os.getenv("GROQ_TOOL_RESULT_TOKENS", "1500"))
+
+# Timeout budget (seconds) per tool; DB tools are sync and run in a thread pool
+DEFAULT_TOOL_TIMEOUT = float(os.getenv("GROQ_TOOL_TIMEOUT", "10"))
+TOOL_TIMEOUTS = {
+    "export_to_excel": 30.0,
+    "save_invoice_from_ocr": 15.0,
+}
+
+# Semantic router intents answered by calling one tool directly: intent -> (tool, args)
+LOCAL_TOOL_INTENTS = {
+    "list_invoices": ("get_all_invoices", {"limit": 10}),
+    "get_statistics": ("get_statistics", {}),
+}
+
+# Per-turn suffixes appended after the static system prompt
+SENTIMENT_NOTES = {
+    'negative': "\n\nLƯU Ý: Người dùng có vẻ không hài lòng. Hãy trả lời một cách thông cảm, hữu ích và chủ động hỗ trợ.",
+    'positive': "\n\nLƯU Ý: Người dùng có vẻ hài lòng. Hãy duy trì thái độ tích cực và thân thiện.",
+}
+
+class DecimalEncoder(json.JSONEncoder):
+    """JSON encoder that handles Decimal and datetime objects"""
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return float(obj)
+        elif isinstance(obj, datetime):
+            return obj.isoformat()
+        elif isinstance(obj, date):
+            return obj.isoformat()
+        return super().default(obj)
+
+class GroqChatHandler:
+    """
+    Groq Chat Handler với khả năng gọi API để thao tác database
+    
+    Flow:
+    1. User gửi message
+    2. Groq analyze intent + chọn tools cần thiết
+    3. Groq gọi API tools để lấy data từ database
+    4. Groq combine data + sinh response
+    """
+    
+    def __init__(self, db_tools=None, groq_tools=None):
+        """Initialize Groq handler with database tools"""
+        # Per-request timeout (seconds) for Groq calls, covering the whole stream
+        self.request_timeout = float(os.getenv("GROQ_TIMEOUT", "30"))
+        
+        # Get API key from environment
+        api_key = os.getenv("GROQ_API_KEY")
+        if not api_key:
+            logger.warning("⚠️ GROQ_API_KEY not found in environment")
+            self.client = None
+        else:
+            # Async client: LLM calls never block the event loop
+            self.client = AsyncGroq(api_key=api_key, timeout=self.request_timeout)
+        
+        self.db_tools = db_tools
+        self.groq_tools = groq_tools
+        # Bounded, evicting per-user history/OCR results (shared backend when configured)
+        self.session_store = get_session_store()
+        self.model = "llama-3.3-70b-versatile"
+        
+        # Thread pool for sync database tools, so several tools of one turn run concurrently
+        self.tool_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("GROQ_TOOL_WORKERS", "4")),
+            thread_name_prefix="groq-tool"
+        )
+        
+        # Local embedding router: confident simple intents skip the Groq round-trip
+        # (model loads in the background; until then every message goes to Groq)
+        self.intent_router = get_semantic_router()
+        
+        # Background summary refreshes (keep task references, one in flight per user)
+        self._summary_tasks = set()
+        self._summarizing = set()
+        
+        # Import services
+        try:
+            from utils.sentiment_service import sentiment_service
+            from utils.conversation_service import conversation_service
+            self.sentiment_service = sentiment_service
+            self.conversation_service = conversation_service
+        except ImportError:
+            self.sentiment_service = None
+            self.conversation_service = None
+        
+        # Tool schema and system prompt are built once and reused for every turn.
+        # Keeping them byte-identical lets Groq's prompt caching hit the prefix.
+        if groq_tools:
+            self.tools_description = groq_tools.get_tools_description()
+            self.groq_tools_format = groq_tools.get_groq_tools_format()
+        else:
+            self.tools_description = []
+            self.groq_tools_format = []
+        
+        tools_desc = "".join(f"\n- {tool['name']}: {tool['description']}" for tool in self.tools_description)
+        self.system_prompt = SYSTEM_PROMPT_TEMPLATE.format(tools_desc=tools_desc)
+        
+        # Token sizes of the static parts, measured once
+        self.system_prompt_tokens = count_tokens(self.system_prompt)
+        self.tools_schema_tokens = count_tokens(json.dumps(self.groq_tools_format, ensure_ascii=False))
+        logger.info(f"📏 Groq static prompt: {self.system_prompt_tokens} tokens, tool schema: {self.tools_schema_tokens} tokens")
     
     async def chat(self, message: str, user_id: str = 'default') -> Dict[str, Any]:
         """
@@ -156,8 +231,9 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
                 sentiment, sentiment_confidence = self.sentiment_service.analyze_sentiment(message)
             
             # Get conversation history from database if user_id is numeric (authenticated user)
+            # (only needed when this process has no session for the user, e.g. after a restart)
             conversation_context = []
-            if user_id.isdigit() and self.conversation_service:
+            if user_id.isdigit() and self.conversation_service and not self._has_session_context(user_id):
                 try:
                     user_id_int = int(user_id)
                     # Generate session_id from user_id (simple approach)
@@ -166,62 +242,72 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
                 except Exception as e:
                     logger.warning(f"Could not load conversation history: {e}")
             
-            # Update conversation history
-            if user_id not in self.conversation_history:
-                self.conversation_history[user_id] = []
-            
             # Thêm user message vào history
-            self.conversation_history[user_id].append({
-                "role": "user",
-                "content": message
-            })
-            
-            # Get tools descriptions from Groq tools
-            if self.groq_tools:
-                tools_description = self.groq_tools.get_tools_description()
-            else:
-                tools_description = []
-            
-            # Simple intent detection - don't use tools for greetings or general questions
-            message_lower = message.lower().strip()
-            conversational_keywords = [
-                'hi', 'hello', 'chào', 'xin chào', 'chào bạn', 'hey', 'alo',
-                'bạn có thể', 'bạn làm gì', 'giúp gì', 'làm được gì', 'có thể làm gì',
-                'tôi cần', 'giúp tôi', 'hỗ trợ', 'thank', 'cảm ơn', 'thanks',
-                'tạm biệt', 'bye', 'goodbye', 'tại sao', 'sao', 'vì sao'
-            ]
-            
-            is_conversational = any(keyword in message_lower for keyword in conversational_keywords)
-            data_request_keywords = [
-                'xem', 'lấy', 'hiển thị', 'danh sách', 'list', 'tìm', 'search', 'thống kê',
-                'stats', 'báo cáo', 'lưu', 'save', 'xóa', 'delete', 'sửa', 'edit', 'update'
-            ]
-            is_data_request = any(keyword in message_lower for keyword in data_request_keywords)
-            
-            # Only use tools if it's clearly a data request AND not conversational
-            use_tools = is_data_request and not is_conversational
-            
-            logger.info(f"Intent detection: conversational={is_conversational}, data_request={is_data_request}, use_tools={use_tools}")
-            
-            # Tạo message cho Groq với tools (chỉ khi cần)
-            response = await self._groq_with_tools(
-                message=message,
-                user_id=user_id,
-                tools_description=tools_description if use_tools else [],
-                sentiment=sentiment,
-                conversation_context=conversation_context,
-                force_no_tools=not use_tools
-            )
+            self._append_history(user_id, {"role": "user", "content": message})
+            
+            tools_description = self.tools_description
+            
+            # Semantic routing: high-confidence simple intents are answered locally
+            response = await self._answer_routed_intent(message)
+            
+            # Generic questions (greeting/help/goodbye) share one cached Groq reply,
+            # generated without this user's history, sentiment or tools
+            generic_intent = None
+            if response is None:
+                generic_intent = GENERIC_INTENT_CLASSIFIER.classify(normalize_message(message))
+                if not response_cache.cacheable(generic_intent):
+                    generic_intent = None
+            if response is None and generic_intent:
+                response = response_cache.get("groq", generic_intent, message)
+                if response is None:
+                    response = await self._groq_with_tools(
+                        message=message,
+                        user_id=user_id,
+                        tools_description=[],
+                        force_no_tools=True,
+                        include_history=False
+                    )
+                    response_cache.set("groq", generic_intent, message, response)
+            
+            if response is None:
+                # Simple intent detection - don't use tools for greetings or general questions
+                message_lower = message.lower().strip()
+                conversational_keywords = [
+                    'hi', 'hello', 'chào', 'xin chào', 'chào bạn', 'hey', 'alo',
+                    'bạn có thể', 'bạn làm gì', 'giúp gì', 'làm được gì', 'có thể làm gì',
+                    'tôi cần', 'giúp tôi', 'hỗ trợ', 'thank', 'cảm ơn', 'thanks',
+                    'tạm biệt', 'bye', 'goodbye', 'tại sao', 'sao', 'vì sao'
+                ]
+                
+                is_conversational = any(keyword in message_lower for keyword in conversational_keywords)
+                data_request_keywords = [
+                    'xem', 'lấy', 'hiển thị', 'danh sách', 'list', 'tìm', 'search', 'thống kê',
+                    'stats', 'báo cáo', 'lưu', 'save', 'xóa', 'delete', 'sửa', 'edit', 'update'
+                ]
+                is_data_request = any(keyword in message_lower for keyword in data_request_keywords)
+                
+                # Only use tools if it's clearly a data request AND not conversational
+                use_tools = is_data_request and not is_conversational
+                
+                logger.info(f"Intent detection: conversational={is_conversational}, data_request={is_data_request}, use_tools={use_tools}")
+                
+                # Tạo message cho Groq với tools (chỉ khi cần)
+                response = await self._groq_with_tools(
+                    message=message,
+                    user_id=user_id,
+                    tools_description=tools_description if use_tools else [],
+                    sentiment=sentiment,
+                    conversation_context=conversation_context,
+                    force_no_tools=not use_tools
+                )
             
             # Adjust response based on sentiment
             if self.sentiment_service and sentiment == 'negative':
                 response['message'] = self.sentiment_service.adjust_response_based_on_sentiment(sentiment, response['message'])
             
             # Add bot response to history
-            self.conversation_history[user_id].append({
-                "role": "assistant",
-                "content": response['message']
-            })
+            self._append_history(user_id, {"role": "assistant", "content": response['message']})
+            self._schedule_summary(user_id)
             
             # Save to database if authenticated user
             if user_id.isdigit() and self.conversation_service:
@@ -244,10 +330,6 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
                 except Exception as e:
                     logger.warning(f"Could not save conversation to database: {e}")
             
-            # Keep only last 20 exchanges
-            if len(self.conversation_history[user_id]) > 40:
-                self.conversation_history[user_id] = self.conversation_history[user_id][-40:]
-            
             # Add sentiment info to response
             response['sentiment'] = sentiment
             response['sentiment_confidence'] = sentiment_confidence
@@ -258,6 +340,76 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
             logger.error(f"Error in Groq chat: {str(e)}")
             return self._error_response(str(e))
     
+    async def _answer_routed_intent(self, message: str) -> Optional[Dict[str, Any]]:
+        """
+        Trả lời intent đơn giản tại chỗ khi semantic router đủ tự tin
+        
+        Returns:
+            Response dict, or None to escalate the message to Groq
+        """
+        if not self.intent_router.available:
+            return None
+        
+        loop = asyncio.get_running_loop()
+        route = await loop.run_in_executor(self.tool_executor, self.intent_router.route, message)
+        if route is None:
+            return None
+        
+        if route.intent == "greeting":
+            text = ("👋 Xin chào! Tôi là trợ lý quản lý hóa đơn. Tôi có thể xem danh sách, tìm kiếm, "
+                    "thống kê hóa đơn và xuất file Excel. Bạn cần gì?")
+        elif route.intent == "goodbye":
+            text = "😊 Cảm ơn bạn! Khi cần tra cứu hóa đơn, cứ nhắn cho tôi nhé."
+        elif route.intent == "help":
+            text = "🛠️ Tôi có thể giúp bạn:" + "".join(
+                f"\n- {tool['name']}: {tool['description']}" for tool in self.tools_description
+            )
+        elif route.intent in LOCAL_TOOL_INTENTS and self.groq_tools:
+            tool_name, tool_args = LOCAL_TOOL_INTENTS[route.intent]
+            result = await loop.run_in_executor(
+                self.tool_executor, functools.partial(self.groq_tools.call_tool, tool_name, **tool_args)
+            )
+            if not result.get("success"):
+                # Let Groq explain failures (e.g. nothing to export)
+                return None
+            text = self._format_local_tool_result(tool_name, result)
+        else:
+            return None
+        
+        logger.info(f"⚡ Semantic router answered '{route.intent}' locally "
+                    f"(score={route.score:.2f}, {route.elapsed_ms:.1f}ms)")
+        return {
+            "message": text,
+            "type": "text",
+            "method": "semantic_router",
+            "intent": route.intent,
+            "intent_score": round(route.score, 3),
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    @staticmethod
+    def _format_local_tool_result(tool_name: str, result: Dict[str, Any]) -> str:
+        """Render a tool result as a short Vietnamese reply"""
+        if tool_name == "get_all_invoices":
+            invoices = result.get("invoices") or []
+            if not invoices:
+                return "📭 Hiện chưa có hóa đơn nào trong database."
+            lines = [f"📋 {len(invoices)} hóa đơn gần nhất:"]
+            for inv in invoices:
+                invoice_date = str(inv.get("invoice_date") or inv.get("created_at") or "N/A")[:10]
+                lines.append(f"- #{inv.get('id')} {inv.get('invoice_code') or 'N/A'} | "
+                             f"{inv.get('buyer_name') or 'N/A'} | {inv.get('total_amount') or 'N/A'} | {invoice_date}")
+            return "\n".join(lines)
+        
+        # get_statistics
+        stats = result.get("statistics") or {}
+        types = ", ".join(f"{t}: {c}" for t, c in (stats.get("invoice_types") or {}).items()) or "N/A"
+        return (f"📊 Thống kê hóa đơn:\n"
+                f"- Tổng số hóa đơn: {stats.get('total_invoices', 0)}\n"
+                f"- Theo loại: {types}\n"
+                f"- 7 ngày gần nhất: {stats.get('recent_7days', 0)}\n"
+                f"- Tổng tiền: {float(stats.get('total_amount_sum') or 0):,.0f} VND")
+    
     async def chat_stream(self, message: str, user_id: str = 'default'):
         """
         Stream chat response from Groq (real-time, word-by-word)
@@ -271,25 +423,12 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
             )
         """
         try:
-            # Update conversation history
-            if user_id not in self.conversation_history:
-                self.conversation_history[user_id] = []
-            
             # Add user message to history
-            self.conversation_history[user_id].append({
-                "role": "user",
-                "content": message
-            })
-            
-            # Get tools descriptions
-            if self.groq_tools:
-                tools_description = self.groq_tools.get_tools_description()
-            else:
-                tools_description = []
+            self._append_history(user_id, {"role": "user", "content": message})
             
             # Stream the response
             full_response = ""
-            async for chunk in self._groq_stream_with_tools(message, user_id, tools_description):
+            async for chunk in self._groq_stream_with_tools(message, user_id, self.tools_description):
                 full_response += chunk
                 # Yield as NDJSON (newline-delimited JSON)
                 yield json.dumps({
@@ -299,14 +438,8 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
                 }) + "\n"
             
             # Add final response to history
-            self.conversation_history[user_id].append({
-                "role": "assistant",
-                "content": full_response
-            })
-            
-            # Keep only last 20 exchanges
-            if len(self.conversation_history[user_id]) > 40:
-                self.conversation_history[user_id] = self.conversation_history[user_id][-40:]
+            self._append_history(user_id, {"role": "assistant", "content": full_response})
+            self._schedule_summary(user_id)
             
             # Yield completion signal
             yield json.dumps({
@@ -327,33 +460,45 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
         Internal streaming method - uses streaming API from Groq
         """
         try:
-            messages = self.conversation_history.get(user_id, []).copy()
+            messages = self._context_messages(user_id)
             max_iterations = 3
             iteration = 0
             
             while iteration < max_iterations:
                 iteration += 1
                 
+                request_messages = [
+                    {"role": "system", "content": self.system_prompt},
+                    *messages
+                ]
+                
                 # Use streaming API
-                stream = self.client.chat.completions.create(
+                stream = await self._create_completion(
                     model=self.model,
-                    messages=[
-                        {"role": "system", "content": self.system_prompt},
-                        *messages
-                    ],
+                    messages=request_messages,
                     temperature=0.7,
                     max_tokens=1000,
                     stream=True  # ← Enable streaming
                 )
                 
                 full_response = ""
+                estimated_tokens = self._estimate_prompt_tokens(request_messages)
+                usage_logged = False
                 
                 # Stream chunks from Groq
-                for chunk in stream:
-                    if chunk.choices[0].delta.content:
+                async for chunk in self._iter_stream(stream):
+                    if chunk.choices and chunk.choices[0].delta.content:
                         text = chunk.choices[0].delta.content
                         full_response += text
                         yield text
+                    # Groq reports usage on the final chunk under x_groq
+                    x_groq = getattr(chunk, 'x_groq', None)
+                    if x_groq is not None and getattr(x_groq, 'usage', None) is not None:
+                        self._log_usage(x_groq, estimated_tokens, iteration)
+                        usage_logged = True
+                
+                if not usage_logged:
+                    self._log_usage(None, estimated_tokens, iteration)
                 
                 logger.info(f"Groq stream iteration {iteration}: {full_response[:100]}")
                 
@@ -367,24 +512,14 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
                         
                         # Call tool based on name
                         if tool_name == "get_all_invoices":
-                            result = self.groq_tools.get_all_invoices(limit=10)
+                            tool_args = {"limit": 10}
                         elif tool_name == "search_invoices":
-                            result = self.groq_tools.search_invoices(message, limit=5)
-                        elif tool_name == "get_statistics":
-                            result = self.groq_tools.get_statistics()
-                        elif tool_name == "get_high_value_invoices":
-                            result = self.groq_tools.get_high_value_invoices(1000000)
-                        elif tool_name == "save_invoice_from_ocr":
-                            # Get OCR data from recent results for this user
-                            ocr_data = self.get_recent_ocr_result(user_id)
-                            if ocr_data:
-                                result = self.groq_tools.save_invoice_from_ocr(ocr_data=ocr_data)
-                            else:
-                                result = {"success": False, "error": "Không có dữ liệu OCR gần đây. Vui lòng upload ảnh hóa đơn trước."}
+                            tool_args = {"query": message, "limit": 5}
                         elif tool_name == "export_to_excel":
-                            result = self.groq_tools.export_to_excel(filter_type="all")
+                            tool_args = {"filter_type": "all"}
                         else:
-                            result = self.groq_tools.call_tool(tool_name)
+                            tool_args = {}
+                        result = await self._run_tool(tool_name, tool_args, user_id)
                         
                         # Add tool result to messages for next iteration
                         messages.append({
@@ -393,7 +528,7 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
                         })
                         messages.append({
                             "role": "user",
-                            "content": f"Kết quả từ tool {tool_name}: {json.dumps(result, cls=DecimalEncoder)[:500]}"
+                            "content": f"Kết quả từ tool {tool_name}: {result}"
                         })
                         
                         # Yield tool result notification
@@ -410,10 +545,13 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
     
     async def _groq_with_tools(self, message: str, user_id: str, tools_description: List[Dict], 
                               sentiment: str = 'neutral', conversation_context: List[Dict] = None, 
-                              force_no_tools: bool = False) -> Dict[str, Any]:
+                              force_no_tools: bool = False, include_history: bool = True) -> Dict[str, Any]:
         """
         Groq gọi tools thông qua Groq Function Calling
         
+        include_history=False sends only the system prompt and the message
+        (replies shared across users via the response cache).
+        
         Flow:
         1. Groq analyze message + tools -> decide tools cần gọi
         2. Groq return tool_calls JSON
@@ -421,68 +559,44 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
         4. Groq analyze results -> generate response
         """
         try:
-            messages = self.conversation_history.get(user_id, []).copy()
             max_iterations = 5
             iteration = 0
+            tools_format = self.groq_tools_format if tools_description and not force_no_tools else []
+            
+            # Build messages once: static system prompt first (cacheable prefix),
+            # then the per-turn sentiment note, DB history and in-memory history
+            messages = [{"role": "system", "content": self.system_prompt + SENTIMENT_NOTES.get(sentiment, "")}]
+            
+            # Add conversation history from database
+            if conversation_context and include_history:
+                for msg in conversation_context[-10:]:  # Last 10 messages for context
+                    role = 'user' if msg['message_type'] == 'user' else 'assistant'
+                    messages.append({
+                        "role": role,
+                        "content": msg['message_content']
+                    })
+            
+            # Add running summary + recent conversation from the session store
+            if include_history:
+                messages.extend(self._context_messages(user_id))
+            else:
+                messages.append({"role": "user", "content": message})
             
             while iteration < max_iterations:
                 iteration += 1
                 
-                # Convert tools_description to Groq format
-                groq_tools_format = []
-                for tool in tools_description:
-                    groq_tools_format.append({
-                        "type": "function",
-                        "function": {
-                            "name": tool['name'],
-                            "description": tool['description'],
-                            "parameters": tool['parameters']
-                        }
-                    })
-                
-                # Build messages with conversation context
-                messages = []
-                
-                # Add system prompt
-                system_content = self.system_prompt
-                if sentiment == 'negative':
-                    system_content += "\n\nLƯU Ý: Người dùng có vẻ không hài lòng. Hãy trả lời một cách thông cảm, hữu ích và chủ động hỗ trợ."
-                elif sentiment == 'positive':
-                    system_content += "\n\nLƯU Ý: Người dùng có vẻ hài lòng. Hãy duy trì thái độ tích cực và thân thiện."
-                
-                messages.append({"role": "system", "content": system_content})
-                
-                # Add conversation history from database
-                if conversation_context:
-                    for msg in conversation_context[-10:]:  # Last 10 messages for context
-                        role = 'user' if msg['message_type'] == 'user' else 'assistant'
-                        messages.append({
-                            "role": role,
-                            "content": msg['message_content']
-                        })
-                
-                # Add current conversation from memory
-                for msg in self.conversation_history.get(user_id, [])[-10:]:
-                    messages.append(msg)
-                
+                request_kwargs = {
+                    "model": self.model,
+                    "messages": messages,
+                    "temperature": 0.7,
+                    "max_tokens": 1000
+                }
                 # Call Groq with tools (only if not forced to skip tools)
-                if force_no_tools or not groq_tools_format:
-                    # Skip tools entirely
-                    response = self.client.chat.completions.create(
-                        model=self.model,
-                        messages=messages,
-                        temperature=0.7,
-                        max_tokens=1000
-                    )
-                else:
-                    # Use tools
-                    response = self.client.chat.completions.create(
-                        model=self.model,
-                        messages=messages,
-                        tools=groq_tools_format,
-                        temperature=0.7,
-                        max_tokens=1000
-                    )
+                if tools_format:
+                    request_kwargs["tools"] = tools_format
+                
+                response = await self._create_completion(**request_kwargs)
+                self._log_usage(response, self._estimate_prompt_tokens(messages, bool(tools_format)), iteration)
                 
                 # Get response
                 assistant_message = response.choices[0].message
@@ -490,64 +604,29 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
                 
                 logger.info(f"Groq iteration {iteration}: {groq_response_text[:100]}")
                 
-                # Add assistant response to messages
-                messages.append({
-                    "role": "assistant",
-                    "content": groq_response_text
-                })
-                
                 # Check if Groq wants to use tools (function calling) - only if tools are allowed
-                tool_calls = getattr(assistant_message, 'tool_calls', None) if not force_no_tools else None
+                tool_calls = getattr(assistant_message, 'tool_calls', None) if tools_format else None
                 
                 if tool_calls:
-                    # Groq called one or more tools
-                    for tool_call in tool_calls:
-                        tool_name = tool_call.function.name
-                        tool_args = json.loads(tool_call.function.arguments) if isinstance(tool_call.function.arguments, str) else tool_call.function.arguments
-                        
-                        # Fix parameter types - Groq sometimes returns strings instead of expected types
-                        if tool_name == "get_all_invoices":
-                            if "limit" in tool_args:
-                                try:
-                                    tool_args["limit"] = int(tool_args["limit"])
-                                except (ValueError, TypeError):
-                                    tool_args["limit"] = 20  # Default value
-                        elif tool_name == "search_invoices":
-                            if "limit" in tool_args:
-                                try:
-                                    tool_args["limit"] = int(tool_args["limit"])
-                                except (ValueError, TypeError):
-                                    tool_args["limit"] = 10  # Default value
-                        elif tool_name == "get_invoice_by_id":
-                            if "invoice_id" in tool_args:
-                                try:
-                                    tool_args["invoice_id"] = int(tool_args["invoice_id"])
-                                except (ValueError, TypeError):
-                                    logger.error(f"Invalid invoice_id: {tool_args['invoice_id']}")
-                                    continue
-                        
-                        logger.info(f"✅ Groq calling tool: {tool_name}({tool_args})")
-                        
-                        # Call the tool
-                        if tool_name == "save_invoice_from_ocr":
-                            # For save_invoice_from_ocr, get OCR data from recent results
-                            ocr_data = self.get_recent_ocr_result(user_id)
-                            if ocr_data:
-                                tool_args["ocr_data"] = ocr_data
-                                result = self.groq_tools.call_tool(tool_name, **tool_args)
-                            else:
-                                result = {"success": False, "error": "Không có dữ liệu OCR gần đây. Vui lòng upload ảnh hóa đơn trước."}
-                        else:
-                            result = self.groq_tools.call_tool(tool_name, **tool_args)
-                        
-                        logger.info(f"Tool result: {json.dumps(result, cls=DecimalEncoder)[:200]}")
-                        
-                        # Add tool result to messages
-                        messages.append({
-                            "role": "tool",
-                            "content": json.dumps(result, cls=DecimalEncoder),
-                            "tool_call_id": tool_call.id
-                        })
+                    # Assistant turn must carry its tool_calls so the tool results below are accepted
+                    messages.append({
+                        "role": "assistant",
+                        "content": groq_response_text,
+                        "tool_calls": [
+                            {
+                                "id": tool_call.id,
+                                "type": "function",
+                                "function": {
+                                    "name": tool_call.function.name,
+                                    "arguments": tool_call.function.arguments
+                                }
+                            }
+                            for tool_call in tool_calls
+                        ]
+                    })
+                    
+                    # Groq called one or more tools - run them concurrently
+                    messages.extend(await self._execute_tool_calls(tool_calls, user_id))
                     
                     # Continue loop to let Groq process tool results
                     continue
@@ -562,15 +641,14 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
                     }
             
             # After max iterations, return final response
-            final_response = self.client.chat.completions.create(
+            final_messages = [messages[0], *messages[1:][-6:]]  # System prompt + last 6 messages
+            final_response = await self._create_completion(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    *messages[-6:]  # Last 6 messages
-                ],
+                messages=final_messages,
                 temperature=0.7,
                 max_tokens=800
             )
+            self._log_usage(final_response, self._estimate_prompt_tokens(final_messages), iteration)
             final_message = final_response.choices[0].message.content
             
             return {
@@ -600,33 +678,28 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
                     "error": "GROQ_API_KEY not configured",
                     "timestamp": datetime.now().isoformat()
                 }
-            if user_id not in self.conversation_history:
-                self.conversation_history[user_id] = []
-            
             # Add to history
-            self.conversation_history[user_id].append({
-                "role": "user",
-                "content": message
-            })
+            self._append_history(user_id, {"role": "user", "content": message})
+            
+            request_messages = [
+                {"role": "system", "content": self.system_prompt},
+                *self._context_messages(user_id)
+            ]
             
             # Call Groq without tools
-            response = self.client.chat.completions.create(
+            response = await self._create_completion(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    *self.conversation_history[user_id]
-                ],
+                messages=request_messages,
                 temperature=0.7,
                 max_tokens=1000
             )
+            self._log_usage(response, self._estimate_prompt_tokens(request_messages))
             
             final_message = response.choices[0].message.content
             
             # Add to history
-            self.conversation_history[user_id].append({
-                "role": "assistant",
-                "content": final_message
-            })
+            self._append_history(user_id, {"role": "assistant", "content": final_message})
+            self._schedule_summary(user_id)
             
             return {
                 "message": final_message,
@@ -639,6 +712,187 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
             logger.error(f"Error in Groq simple chat: {str(e)}")
             return self._error_response(str(e))
     
+    def _prepare_tool_args(self, tool_name: str, raw_args) -> Dict[str, Any]:
+        """
+        Parse tool arguments from Groq and fix their types
+        
+        Raises:
+            ValueError: If a required argument has an unusable value
+        """
+        tool_args = json.loads(raw_args) if isinstance(raw_args, str) else dict(raw_args or {})
+        
+        # Fix parameter types - Groq sometimes returns strings instead of expected types
+        if tool_name == "get_all_invoices":
+            if "limit" in tool_args:
+                try:
+                    tool_args["limit"] = int(tool_args["limit"])
+                except (ValueError, TypeError):
+                    tool_args["limit"] = 20  # Default value
+        elif tool_name in ("search_invoices", "filter_by_date", "get_invoices_by_type"):
+            if "limit" in tool_args:
+                try:
+                    tool_args["limit"] = int(tool_args["limit"])
+                except (ValueError, TypeError):
+                    tool_args["limit"] = 10  # Default value
+        elif tool_name == "semantic_search_invoices":
+            if "top_k" in tool_args:
+                try:
+                    tool_args["top_k"] = int(tool_args["top_k"])
+                except (ValueError, TypeError):
+                    tool_args["top_k"] = 5  # Default value
+        elif tool_name == "get_invoice_by_id":
+            if "invoice_id" in tool_args:
+                try:
+                    tool_args["invoice_id"] = int(tool_args["invoice_id"])
+                except (ValueError, TypeError):
+                    raise ValueError(f"Invalid invoice_id: {tool_args['invoice_id']}")
+        
+        return tool_args
+    
+    async def _run_tool(self, tool_name: str, tool_args: Dict[str, Any], user_id: str) -> str:
+        """
+        Run one (sync) database tool in the tool thread pool with its timeout budget
+        
+        Returns:
+            Compact, token-budgeted tool result (possibly from the tool cache), or a serialized error
+        """
+        if tool_name == "save_invoice_from_ocr":
+            # For save_invoice_from_ocr, get OCR data from recent results
+            ocr_data = self.get_recent_ocr_result(user_id)
+            if not ocr_data:
+                return json.dumps({"success": False, "error": "Không có dữ liệu OCR gần đây. Vui lòng upload ảnh hóa đơn trước."})
+            tool_args = {**tool_args, "ocr_data": ocr_data}
+        
+        timeout = TOOL_TIMEOUTS.get(tool_name, DEFAULT_TOOL_TIMEOUT)
+        logger.info(f"✅ Groq calling tool: {tool_name}({tool_args})")
+        
+        loop = asyncio.get_running_loop()
+        try:
+            result = await asyncio.wait_for(
+                loop.run_in_executor(
+                    self.tool_executor,
+                    functools.partial(
+                        self.groq_tools.call_tool_serialized,
+                        tool_name,
+                        max_tokens=TOOL_RESULT_MAX_TOKENS,
+                        **tool_args
+                    )
+                ),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"⏱️ Tool {tool_name} timed out after {timeout}s")
+            result = json.dumps({"success": False, "error": f"Tool {tool_name} timed out after {timeout}s"})
+        except Exception as e:
+            logger.error(f"❌ Tool {tool_name} failed: {e}")
+            result = json.dumps({"success": False, "error": str(e)})
+        
+        logger.info(f"Tool result: {result[:200]}")
+        return result
+    
+    async def _execute_tool_calls(self, tool_calls, user_id: str) -> List[Dict[str, Any]]:
+        """
+        Execute all tool calls of one assistant turn concurrently
+        
+        Calls with the same tool name and arguments within the turn run once
+        and share the result.
+        
+        Returns:
+            Tool messages ({"role": "tool", ...}) in the order of tool_calls
+        """
+        tasks: Dict[str, asyncio.Task] = {}
+        call_keys = []  # per call: key into tasks, or a serialized error if rejected up front
+        
+        for tool_call in tool_calls:
+            tool_name = tool_call.function.name
+            try:
+                tool_args = self._prepare_tool_args(tool_name, tool_call.function.arguments)
+            except ValueError as e:
+                logger.error(str(e))
+                call_keys.append(json.dumps({"success": False, "error": str(e)}))
+                continue
+            
+            key = f"{tool_name}:{json.dumps(tool_args, sort_keys=True, cls=DecimalEncoder)}"
+            if key not in tasks:
+                tasks[key] = asyncio.ensure_future(self._run_tool(tool_name, tool_args, user_id))
+            else:
+                logger.info(f"♻️ Reusing result of duplicate tool call: {tool_name}")
+            call_keys.append(key)
+        
+        if tasks:
+            await asyncio.gather(*tasks.values())
+        
+        tool_messages = []
+        for tool_call, key in zip(tool_calls, call_keys):
+            tool_messages.append({
+                "role": "tool",
+                "content": tasks[key].result() if key in tasks else key,
+                "tool_call_id": tool_call.id
+            })
+        return tool_messages
+    
+    async def _create_completion(self, **kwargs):
+        """
+        Call Groq chat completions on the async client
+        
+        Bounded by request_timeout; cancelling the awaiting task (e.g. the
+        client disconnects) cancels the HTTP request as well.
+        """
+        return await asyncio.wait_for(
+            self.client.chat.completions.create(**kwargs),
+            timeout=self.request_timeout
+        )
+    
+    async def _iter_stream(self, stream):
+        """Iterate an async Groq stream, enforcing request_timeout over the whole stream"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.request_timeout
+        iterator = stream.__aiter__()
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError(f"Groq stream exceeded {self.request_timeout}s")
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), timeout=remaining)
+                except StopAsyncIteration:
+                    break
+                yield chunk
+        finally:
+            # Release the HTTP connection on completion, timeout or cancellation
+            response = getattr(stream, 'response', None)
+            if response is not None:
+                await response.aclose()
+    
+    def _estimate_prompt_tokens(self, messages: List[Dict], with_tools: bool = False) -> int:
+        """
+        Estimate prompt tokens for a request
+        
+        The system prompt and tool schema sizes are measured once at init;
+        only the per-turn messages are counted here.
+        """
+        tokens = self.system_prompt_tokens + count_message_tokens(messages[1:])
+        if messages and messages[0].get('role') == 'system':
+            tokens += count_tokens(messages[0]['content'][len(self.system_prompt):])
+        if with_tools:
+            tokens += self.tools_schema_tokens
+        return tokens
+    
+    def _log_usage(self, response, estimated_prompt_tokens: int, iteration: int = 1):
+        """Log prompt/completion token counts reported by Groq (estimate if missing)"""
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            logger.info(f"📏 Groq request #{iteration}: ~{estimated_prompt_tokens} prompt tokens (estimated)")
+            return
+        
+        prompt_details = getattr(usage, 'prompt_tokens_details', None)
+        cached_tokens = getattr(prompt_details, 'cached_tokens', None) or 0
+        logger.info(
+            f"📏 Groq request #{iteration}: prompt_tokens={usage.prompt_tokens} "
+            f"(cached={cached_tokens}, estimated={estimated_prompt_tokens}), "
+            f"completion_tokens={usage.completion_tokens}"
+        )
+    
     def _error_response(self, error: str) -> Dict[str, Any]:
         """Create error response"""
         return {
@@ -649,6 +903,71 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
             "timestamp": datetime.now().isoformat()
         }
     
+    def _append_history(self, user_id: str, *messages: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Append messages to the user's in-session history (last MAX_HISTORY_MESSAGES kept)"""
+        return self.session_store.append(HISTORY_NAMESPACE, user_id, *messages, max_items=MAX_HISTORY_MESSAGES)
+    
+    def _has_session_context(self, user_id: str) -> bool:
+        """Whether the session store already holds history or a summary for the user"""
+        return bool(self.session_store.get_list(HISTORY_NAMESPACE, user_id) or
+                    self.session_store.get(SUMMARY_NAMESPACE, user_id))
+    
+    def _context_messages(self, user_id: str) -> List[Dict[str, Any]]:
+        """Running summary (if any) plus the last HISTORY_WINDOW messages - bounded prompt history"""
+        messages = []
+        summary = self.session_store.get(SUMMARY_NAMESPACE, user_id)
+        if summary:
+            messages.append({"role": "system", "content": f"Tóm tắt cuộc hội thoại trước đó: {summary}"})
+        messages.extend(self.session_store.get_list(HISTORY_NAMESPACE, user_id)[-HISTORY_WINDOW:])
+        return messages
+    
+    def _schedule_summary(self, user_id: str):
+        """Refresh the running summary in the background once history outgrows the window"""
+        if not self.client or user_id in self._summarizing:
+            return
+        history = self.session_store.get_list(HISTORY_NAMESPACE, user_id)
+        if len(history) <= HISTORY_WINDOW:
+            return
+        
+        self._summarizing.add(user_id)
+        task = asyncio.ensure_future(self._refresh_summary(user_id, history[:-SUMMARY_KEEP_MESSAGES]))
+        self._summary_tasks.add(task)
+        
+        def _done(t):
+            self._summary_tasks.discard(t)
+            self._summarizing.discard(user_id)
+        task.add_done_callback(_done)
+    
+    async def _refresh_summary(self, user_id: str, older: List[Dict[str, Any]]):
+        """Fold `older` messages into the stored summary, then drop them from history"""
+        try:
+            previous = self.session_store.get(SUMMARY_NAMESPACE, user_id) or "(chưa có)"
+            transcript = "\n".join(
+                f"{'Người dùng' if msg['role'] == 'user' else 'Trợ lý'}: {msg['content']}"
+                for msg in older
+            )
+            response = await self._create_completion(
+                model=SUMMARY_MODEL,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": f"Tóm tắt hiện có:\n{previous}\n\nĐoạn hội thoại mới:\n{transcript}"}
+                ],
+                temperature=0.2,
+                max_tokens=SUMMARY_MAX_TOKENS
+            )
+            summary = (response.choices[0].message.content or "").strip()
+            if not summary:
+                return
+            self.session_store.set(SUMMARY_NAMESPACE, user_id, summary)
+            
+            # Drop the summarized prefix unless history changed underneath (e.g. evicted)
+            current = self.session_store.get_list(HISTORY_NAMESPACE, user_id)
+            if current[:len(older)] == older:
+                self.session_store.set(HISTORY_NAMESPACE, user_id, current[len(older):])
+            logger.info(f"📝 Summarized {len(older)} messages for user {user_id} ({count_tokens(summary)} tokens)")
+        except Exception as e:
+            logger.warning(f"Could not refresh conversation summary: {e}")
+    
     def store_ocr_result(self, user_id: str, ocr_data: dict):
         """
         Store recent OCR result for a user to be used by save_invoice_from_ocr tool
@@ -657,16 +976,9 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
             user_id: User identifier
             ocr_data: Extracted OCR data from extract_invoice_fields()
         """
-        if user_id not in self.recent_ocr_results:
-            self.recent_ocr_results[user_id] = []
-        
-        # Add timestamp and store
+        # Add timestamp and store (keeps only the last 5 OCR results per user)
         ocr_data['timestamp'] = datetime.now().isoformat()
-        self.recent_ocr_results[user_id].append(ocr_data)
-        
-        # Keep only last 5 OCR results per user
-        if len(self.recent_ocr_results[user_id]) > 5:
-            self.recent_ocr_results[user_id] = self.recent_ocr_results[user_id][-5:]
+        self.session_store.append(OCR_NAMESPACE, user_id, ocr_data, max_items=MAX_RECENT_OCR_RESULTS)
         
         logger.info(f"📄 Stored OCR result for user {user_id}: {ocr_data.get('invoice_code', 'UNKNOWN')}")
     
@@ -680,7 +992,8 @@ QUAN TRỌNG: Đừng gọi tools cho câu chào hỏi hoặc câu hỏi chung c
         Returns:
             Most recent OCR data or empty dict if none available
         """
-        if user_id in self.recent_ocr_results and self.recent_ocr_results[user_id]:
-            return self.recent_ocr_results[user_id][-1]  # Most recent
+        results = self.session_store.get_list(OCR_NAMESPACE, user_id)
+        if results:
+            return results[-1]  # Most recent
         return {}
 
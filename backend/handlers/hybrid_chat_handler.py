@@ -9,6 +9,7 @@ import logging
 from typing import Dict, List, Any, Optional
 from datetime import datetime
 from models.ai_model import AIModel
+from utils.session_store import get_session_store
 
 logger = logging.getLogger(__name__)
 
@@ -26,7 +27,7 @@ class HybridChatBot:
     def __init__(self):
         self.ai_model = AIModel()
         self.rasa_url = "http://localhost:5005"  # Rasa server
-        self.conversation_history = {}
+        self.session_store = get_session_store()
         
         # Intent routing configuration
         self.intent_routing = {
@@ -458,7 +459,7 @@ Context: {rasa_context}
         """
         Get formatted conversation history for OpenAI
         """
-        history = self.conversation_history.get(user_id, [])
+        history = self.session_store.get_list("hybrid_history", user_id)
         formatted = []
         
         for item in history[-6:]:  # Last 6 exchanges
@@ -471,18 +472,12 @@ Context: {rasa_context}
         """
         Update conversation history
         """
-        if user_id not in self.conversation_history:
-            self.conversation_history[user_id] = []
-        
-        self.conversation_history[user_id].append({
+        # Keep only last 50 exchanges
+        self.session_store.append("hybrid_history", user_id, {
             'user_message': message,
             'bot_response': response.get('message', ''),
             'intent': rasa_result.get('intent'),
             'confidence': rasa_result.get('confidence'),
             'method': response.get('method'),
             'timestamp': datetime.now().isoformat()
-        })
-        
-        # Keep only last 50 exchanges
-        if len(self.conversation_history[user_id]) > 50:
-            self.conversation_history[user_id] = self.conversation_history[user_id][-50:]
\ No newline at end of file
+        }, max_items=50)
\ No newline at end of file
@@ -19,6 +19,9 @@ from typing import Dict, List, Any, Optional
 from datetime import datetime
 import requests
 
+from utils.session_store import get_session_store
+from services.db_context_service import get_db_context_service
+
 logger = logging.getLogger(__name__)
 
 # Import database tools
@@ -40,7 +43,7 @@ class SmartChatHandler:
     def __init__(self):
         self.llm_provider = os.getenv("LLM_PROVIDER", "groq")  # groq, openai, ollama
         self.llm_api_key = os.getenv("LLM_API_KEY", "")
-        self.conversation_history = {}  # {user_id: [messages]}
+        self.session_store = get_session_store()  # bounded {user_id: [messages]}
         self.max_history = 10  # Keep last 10 messages
         
         logger.info(f"🤖 SmartChatHandler initialized with LLM: {self.llm_provider}")
@@ -154,42 +157,10 @@ Kiến thức:
 - Kế toán, báo cáo tài chính cơ bản
 - Luật thuế hiện hành Việt Nam"""
         
-        # 📊 QUERY DATABASE FOR REAL OCR DATA
+        # 📊 REAL OCR DATA - cached snapshot, re-queried only when invoice data changed
         if db_tools:
             try:
-                # Get all invoices from database
-                all_invoices = db_tools.get_all_invoices(limit=10)
-                
-                if all_invoices:
-                    base_prompt += f"\n\n📋 **DỮ LIỆU HÓA ĐƠN THỰC TỪ DATABASE ({len(all_invoices)} hóa đơn):**"
-                    
-                    for inv in all_invoices:
-                        base_prompt += f"\n- **{inv.get('filename', 'N/A')}**"
-                        base_prompt += f"\n  • Mã HĐ: {inv.get('invoice_code', 'N/A')}"
-                        base_prompt += f"\n  • Loại: {inv.get('invoice_type', 'N/A')}"
-                        base_prompt += f"\n  • Khách: {inv.get('buyer_name', 'N/A')}"
-                        base_prompt += f"\n  • Người bán: {inv.get('seller_name', 'N/A')}"
-                        base_prompt += f"\n  • Tổng: {inv.get('total_amount', 'N/A')}"
-                        
-                        # ✅ Convert confidence_score to float (stored as string in DB)
-                        try:
-                            confidence = float(inv.get('confidence_score', 0))
-                            if confidence < 1:
-                                confidence = confidence * 100
-                            confidence_str = f"{confidence:.1f}%"
-                        except (ValueError, TypeError):
-                            confidence_str = "N/A"
-                        base_prompt += f"\n  • Độ tin cậy: {confidence_str}"
-                        
-                        # Include raw OCR text if available
-                        if inv.get('raw_text'):
-                            raw_text = str(inv.get('raw_text', ''))[:200]
-                            base_prompt += f"\n  • Nội dung OCR: {raw_text}..."
-                    
-                    base_prompt += "\n\n⚠️ **Khi user hỏi về hóa đơn, hãy tham khảo dữ liệu THỰC này thay vì tạo dữ liệu giả**"
-                else:
-                    base_prompt += "\n\n📊 Hiện chưa có hóa đơn nào trong database."
-                    
+                base_prompt += "\n\n" + get_db_context_service(db_tools).get_prompt_fragment()
             except Exception as e:
                 logger.warning(f"⚠️ Could not load invoice data: {e}")
         
@@ -706,24 +677,16 @@ Kiến thức:
     
     def get_conversation_history(self, user_id: str) -> List[Dict]:
         """Lấy lịch sử conversation của user"""
-        if user_id not in self.conversation_history:
-            self.conversation_history[user_id] = []
-        return self.conversation_history[user_id]
+        return self.session_store.get_list("smart_history", user_id)
     
     def update_history(self, user_id: str, user_message: str, assistant_message: str):
         """Cập nhật lịch sử conversation"""
-        if user_id not in self.conversation_history:
-            self.conversation_history[user_id] = []
-        
-        self.conversation_history[user_id].append({
+        # Keep only last N messages to save memory
+        self.session_store.append("smart_history", user_id, {
             "user": user_message,
             "assistant": assistant_message,
             "timestamp": datetime.now().isoformat()
-        })
-        
-        # Keep only last N messages to save memory
-        if len(self.conversation_history[user_id]) > self.max_history:
-            self.conversation_history[user_id] = self.conversation_history[user_id][-self.max_history:]
+        }, max_items=self.max_history)
 
 
 # Global instance
@@ -15,7 +15,7 @@ Chạy: uvicorn main:app --host 0.0.0.0 --port 8000
 Hoặc: python main.py (uvicorn auto-run)
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query, WebSocket, Depends, status
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, Depends, status
 from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -56,6 +56,12 @@ except Exception as e:
     logger.warning(f"⚠️ Database tools not available: {e}")
     db_tools = None
 
+from utils.upload_storage import (
+    MAX_UPLOAD_SIZE, UploadError, UploadTooLarge, save_upload, save_stream,
+    extract_zip, is_allowed_file, is_zip_file, remove_file
+)
+from utils.e_invoice_xml import EInvoiceParseError
+
 # Import WebSocket manager
 try:
     from websocket_manager import websocket_manager
@@ -101,13 +107,12 @@ try:
     from services.ocr_service import OCRService
     from services.invoice_service import InvoiceService
     from services.ai_training_service import AITrainingService
-    from services.ocr_job_service import OCRJobService
+    from services.ocr_job_service import OCRJobService, JobNotFound
 
     # Initialize services
     ocr_service = OCRService(db_tools)
     invoice_service = InvoiceService(db_tools)
     ai_training_service = AITrainingService(db_tools)
-    ocr_job_service = OCRJobService(db_tools)
 
     logger.info("✅ Services initialized")
 except Exception as e:
@@ -115,7 +120,24 @@ except Exception as e:
     ocr_service = None
     invoice_service = None
     ai_training_service = None
-    ocr_job_service = None
+
+# OCR job queue: the ocr_jobs table lives in PostgreSQL and is drained by worker.py,
+# so it uses the PostgreSQL tools (same DATABASE_URL as the worker), not the SQLite
+# db_tools above. Without PostgreSQL there is no queue: uploads are OCRed inline and
+# the job endpoints answer 500 "OCR job service not available".
+ocr_job_service = None
+if ocr_service and os.getenv("DATABASE_URL", "").startswith("postgres"):
+    try:
+        from utils.database_tools import get_database_tools as get_job_queue_tools
+        ocr_job_service = OCRJobService(get_job_queue_tools())
+        if websocket_manager:
+            # Clients may only subscribe to (and replay) jobs they enqueued
+            websocket_manager.job_owner_lookup = ocr_job_service.get_job_owners
+        logger.info("✅ OCR job queue enabled (PostgreSQL)")
+    except Exception as e:
+        logger.warning(f"⚠️ OCR job queue not available: {e}")
+else:
+    logger.info("ℹ️ OCR job queue disabled (needs PostgreSQL DATABASE_URL + worker.py); OCR runs inline")
 
 # Import export service
 try:
@@ -170,6 +192,64 @@ if admin_router:
     app.include_router(admin_router)
     logger.info("✅ Admin router included at /api/admin")
 
+# Cross-process notifications: worker.py publishes OCR job updates on the bus,
+# every API process fans them out to its own WebSocket connections
+@app.on_event("startup")
+async def start_notification_bus():
+    """Subscribe the WebSocket manager and the job status waiters to the notification bus"""
+    try:
+        from utils.notification_bus import get_notification_bus
+        from utils.job_status_waiters import job_status_waiters
+        bus = get_notification_bus()
+        loop = asyncio.get_running_loop()
+        job_status_waiters.attach_notification_bus(bus, loop)
+        if websocket_manager:
+            websocket_manager.attach_notification_bus(bus, loop)
+    except Exception as e:
+        logger.warning(f"⚠️ Notification bus not available: {e}")
+
+@app.on_event("shutdown")
+async def stop_notification_bus():
+    """Stop the notification bus listener"""
+    try:
+        from utils.notification_bus import get_notification_bus
+        get_notification_bus().close()
+    except Exception as e:
+        logger.warning(f"⚠️ Notification bus shutdown failed: {e}")
+
+@app.on_event("shutdown")
+async def flush_chat_history():
+    """Write chat messages still queued in the write-behind buffer (atexit alone is not reliable under uvicorn)"""
+    module = sys.modules.get("utils.conversation_service")
+    if module is None:
+        return  # never imported by a handler: nothing queued
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, module.conversation_service.shutdown)
+    except Exception as e:
+        logger.warning(f"⚠️ Chat history flush on shutdown failed: {e}")
+
+# Semantic invoice search: the full embedding build runs in a background thread,
+# searches only catch up the newest invoices
+@app.on_event("startup")
+async def start_semantic_index():
+    """Build the semantic invoice index in the background"""
+    if not db_tools:
+        return
+    try:
+        from services.invoice_search_service import get_invoice_search_service
+        get_invoice_search_service(db_tools).start_background_indexing()
+    except Exception as e:
+        logger.warning(f"⚠️ Semantic invoice index not started: {e}")
+
+@app.on_event("shutdown")
+async def stop_semantic_index():
+    """Stop the semantic index rebuild thread"""
+    try:
+        from services.invoice_search_service import get_invoice_search_service
+        get_invoice_search_service().stop_background_indexing()
+    except Exception as e:
+        logger.warning(f"⚠️ Semantic index shutdown failed: {e}")
+
 # ===================== SIMPLE CHAT ENDPOINT =====================
 
 @app.post("/api/chat")
@@ -1217,6 +1297,34 @@ async def get_invoice_list_get(
         logger.error(f"❌ Invoice list GET error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/invoices/semantic-search")
+async def semantic_search_invoices(
+    q: str = Query(..., min_length=1),
+    top_k: int = Query(5, ge=1, le=50)
+):
+    """🧭 Tìm kiếm hóa đơn theo ngữ nghĩa (vector search trên các trường chính + raw_text)"""
+    try:
+        from services.invoice_search_service import get_invoice_search_service
+        search_service = get_invoice_search_service(db_tools)
+
+        # Embedding + index catch-up are CPU/DB bound: keep them off the event loop
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, lambda: search_service.search(q, top_k=top_k))
+        if not result.get("success"):
+            raise HTTPException(status_code=503, detail=result.get("error", "Semantic search unavailable"))
+
+        # Plain dict: FastAPI encodes datetime fields of the rows
+        return {
+            **result,
+            "timestamp": datetime.now().isoformat()
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Semantic search error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/invoices/{invoice_id}")
 async def get_invoice_detail(invoice_id: str):
     """
@@ -1282,35 +1390,68 @@ async def process_camera_ocr(
     confidence_threshold: float = 0.7,
     use_mock: Optional[bool] = Query(None),
     persist: Optional[bool] = Query(True),
-    user_id: Optional[str] = Query("anonymous")
+    user_id: Optional[str] = Query("anonymous"),
+    wait: bool = Query(False)
 ):
     """
     📷 Process uploaded invoice image with OCR using Tesseract
-    
+
     Alias: /api/upload (for frontend compatibility)
 
+    Mặc định: lưu file, enqueue OCR job và trả về 202 {job_id, status: "queued"};
+    kết quả qua WebSocket /ws/ocr, GET /api/ocr/job/{job_id}/wait hoặc .../events.
+
+    wait=true (hoặc use_mock / persist=false, hoặc không có job queue): chạy OCR
+    ngay trong process pool (không block event loop) và trả về kết quả.
+    Hóa đơn điện tử XML và PDF có text layer luôn xử lý ngay (không cần Tesseract).
+
     Extract: invoice_code, date, amount, buyer, seller, tax_code
     Returns: Extracted data with confidence score
     """
-    try:
-        # Read file content
-        content = await file.read()
+    if not ocr_service:
+        raise HTTPException(status_code=500, detail="OCR service not available")
 
-        if not content:
-            raise HTTPException(status_code=400, detail="File is empty")
-
-        if not ocr_service:
-            raise HTTPException(status_code=500, detail="OCR service not available")
+    # Stream to the upload store: bounded memory, size limit and SHA-256 while writing
+    try:
+        stored = await save_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    loop = asyncio.get_running_loop()
+    queued = False  # the worker owns the stored file once the job is enqueued
+    try:
+        # E-invoice XML and text-layer PDFs need no Tesseract: answer inline in milliseconds
+        fast_path = await loop.run_in_executor(None, ocr_service.has_text_fast_path, stored.path)
 
-        # Process OCR using service
-        ocr_result = ocr_service.process_ocr_from_file(
-            file_content=content,
+        if not wait and not fast_path and not use_mock and persist and ocr_job_service:
+            try:
+                job = await loop.run_in_executor(
+                    None, lambda: ocr_job_service.enqueue_job(stored.path, file.filename, uploader="upload", user_id=user_id)
+                )
+                queued = True
+                return JSONResponse({
+                    **job,
+                    "sha256": stored.sha256,
+                    "size": stored.size,
+                    "status_url": f"/api/ocr/job/{job['job_id']}",
+                    "wait_url": f"/api/ocr/job/{job['job_id']}/wait?status=queued",
+                    "events_url": f"/api/ocr/job/{job['job_id']}/events"
+                }, status_code=202)
+            except Exception as e:
+                # Queue database temporarily unreachable: OCR inline instead of failing the upload
+                logger.warning(f"⚠️ Could not enqueue OCR job, processing inline: {e}")
+
+        # Tesseract runs in the OCR process pool, never on the event loop
+        ocr_result = await ocr_service.process_ocr_from_path_async(
+            filepath=stored.path,
             filename=file.filename,
             confidence_threshold=confidence_threshold,
             use_mock=use_mock or False,
-            persist=persist,
-            user_id=user_id
+            persist=persist
         )
+        ocr_result["sha256"] = stored.sha256
 
         # Store OCR result in groq chat handler for later use
         if groq_chat_handler and user_id:
@@ -1323,9 +1464,60 @@ async def process_camera_ocr(
             "timestamp": datetime.now().isoformat()
         })
 
+    except EInvoiceParseError as e:
+        # Markup that is not a supported e-invoice (SVG/HTML, DTDs, malformed XML)
+        raise HTTPException(status_code=422, detail=f"Invalid e-invoice XML: {e}")
     except Exception as e:
         logger.error(f"❌ OCR error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"OCR failed: {str(e)}")
+    finally:
+        if not queued:
+            remove_file(stored.path)
+
+@app.post("/api/upload/stream", status_code=201)
+async def upload_stream(
+    request: Request,
+    filename: str = Query(..., min_length=1),
+    user_id: Optional[str] = Query("anonymous")
+):
+    """
+    ⬆️ Raw streaming upload (body = file bytes, không dùng multipart)
+
+    Content-Length vượt MAX_UPLOAD_SIZE bị từ chối (413) trước khi đọc body;
+    body được ghi theo chunk, tính SHA-256 trong lúc ghi, rồi enqueue OCR job.
+    Cần job queue (PostgreSQL + worker.py): không có queue → 503, file không được giữ lại.
+
+    Response: {filename, size, sha256, job_id, status}
+    """
+    if not is_allowed_file(filename):
+        raise HTTPException(status_code=400, detail="Unsupported file type")
+    if not ocr_job_service:
+        raise HTTPException(status_code=503, detail="OCR job queue not available; use /api/ocr/camera-ocr")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail=f"File exceeds {MAX_UPLOAD_SIZE // (1024 * 1024)}MB")
+
+    try:
+        stored = await save_stream(request.stream(), os.path.basename(filename))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        loop = asyncio.get_running_loop()
+        job = await loop.run_in_executor(
+            None, lambda: ocr_job_service.enqueue_job(stored.path, filename, uploader="stream", user_id=user_id)
+        )
+    except Exception as e:
+        # Nobody will process the file: do not leave it in UPLOAD_DIR
+        logger.error(f"❌ Could not enqueue OCR job for streamed upload: {e}")
+        remove_file(stored.path)
+        raise HTTPException(status_code=503, detail="Could not enqueue OCR job")
+
+    return JSONResponse({"success": True, "filename": filename, "size": stored.size, "sha256": stored.sha256,
+                         "job_id": job["job_id"], "status": job["status"]}, status_code=201)
 
 # ===================== ASYNC OCR ENDPOINTS =====================
 
@@ -1395,6 +1587,181 @@ async def get_ocr_job_status(job_id: str):
         logger.error(f"❌ Get job status error: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get job status: {str(e)}")
 
+async def _current_ocr_job_status(job_id: str) -> Dict[str, Any]:
+    """Latest job event seen by this process, falling back to one ocr_jobs query (404 for unknown jobs)"""
+    from utils.job_status_waiters import job_status_waiters
+
+    latest = job_status_waiters.latest(job_id)
+    if latest is not None:
+        return latest
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(None, ocr_job_service.get_job_status, job_id)
+    except JobNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.get("/api/ocr/job/{job_id}/wait")
+async def wait_ocr_job_status(
+    job_id: str,
+    known_status: Optional[str] = Query(None, alias="status"),
+    timeout: float = Query(25, ge=1, le=60)
+):
+    """
+    ⏳ Long-poll status of an OCR job
+
+    Query: ?status=<status client đang có>&timeout=25
+    Trả về ngay nếu status hiện tại khác status client gửi (hoặc không gửi status),
+    ngược lại chờ event tiếp theo của job tới tối đa timeout giây.
+
+    Response: job status/event + "changed" (false khi hết timeout)
+    """
+    from utils.job_status_waiters import job_status_waiters, TERMINAL_STATUSES
+
+    try:
+        if not ocr_job_service:
+            raise HTTPException(status_code=500, detail="OCR job service not available")
+
+        current = await _current_ocr_job_status(job_id)
+        current_status = current.get("status")
+        if known_status is None or current_status != known_status or current_status in TERMINAL_STATUSES:
+            return {"success": True, **current, "changed": known_status is not None and current_status != known_status}
+
+        event = await job_status_waiters.wait(job_id, known_status, timeout)
+        if event is None:
+            return {"success": True, "job_id": job_id, "status": known_status, "changed": False}
+        # Progress events can repeat the status the client already has
+        return {"success": True, **event, "changed": event.get("status") != known_status}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Wait job status error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get job status: {str(e)}")
+
+@app.get("/api/ocr/job/{job_id}/events")
+async def stream_ocr_job_status(job_id: str, request: Request):
+    """
+    📡 Server-sent events for an OCR job (cho client không giữ được WebSocket)
+
+    Gửi status hiện tại, sau đó mỗi lần status đổi một event "status";
+    stream đóng khi job done/failed. Comment keepalive mỗi SSE_KEEPALIVE giây.
+    """
+    from utils.job_status_waiters import job_status_waiters, TERMINAL_STATUSES
+
+    if not ocr_job_service:
+        raise HTTPException(status_code=500, detail="OCR job service not available")
+    try:
+        current = await _current_ocr_job_status(job_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Job status stream error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get job status: {str(e)}")
+
+    keepalive = float(os.getenv("SSE_KEEPALIVE", "15"))
+
+    def format_event(data: Dict[str, Any]) -> str:
+        event_id = f"id: {data['seq']}\n" if data.get("seq") is not None else ""
+        return f"{event_id}event: status\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+    async def event_stream():
+        yield format_event(current)
+        job_status = current.get("status")
+        while job_status not in TERMINAL_STATUSES:
+            if await request.is_disconnected():
+                break
+            event = await job_status_waiters.wait(job_id, job_status, keepalive)
+            if event is None:
+                yield ": keepalive\n\n"
+                continue
+            job_status = event.get("status")
+            yield format_event(event)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/ocr/batch", status_code=202)
+async def enqueue_ocr_batch(
+    files: List[UploadFile] = File(...),
+    user_id: Optional[str] = Query("anonymous"),
+    uploader: Optional[str] = Query("batch")
+):
+    """
+    📦 Batch upload: nhiều ảnh/PDF hóa đơn hoặc file .zip trong một request
+
+    File được ghi xuống UPLOAD_DIR theo chunk, toàn bộ job được insert vào
+    ocr_jobs bằng một câu lệnh và worker xử lý song song.
+    Tiến độ: WebSocket event {"type": "ocr_batch_progress", "batch_id", "total",
+    "done", "failed", ...} hoặc GET /api/ocr/batch/{batch_id}
+
+    Response (202): batch_id, total, jobs [{job_id, filename}], rejected [{filename, error}]
+    """
+    if not ocr_job_service:
+        raise HTTPException(status_code=500, detail="OCR job service not available")
+
+    max_files = int(os.getenv("BATCH_MAX_FILES", "500"))
+    loop = asyncio.get_running_loop()
+    stored = []
+    rejected = []
+    try:
+        for file in files:
+            if is_zip_file(file.filename):
+                extracted, skipped = await loop.run_in_executor(
+                    None, extract_zip, file.file, max_files - len(stored)
+                )
+                stored.extend(extracted)
+                rejected.extend({"filename": name, "error": "Unsupported, empty or too large"} for name in skipped)
+            elif not is_allowed_file(file.filename):
+                rejected.append({"filename": file.filename, "error": "Unsupported file type"})
+            else:
+                if len(stored) >= max_files:
+                    raise UploadError(f"Batch exceeds {max_files} files")
+                try:
+                    upload = await save_upload(file)
+                    stored.append((upload.path, file.filename))
+                except UploadError as e:
+                    rejected.append({"filename": file.filename, "error": str(e)})
+
+        if not stored:
+            raise UploadError("No invoice files to process")
+
+        result = await loop.run_in_executor(
+            None, lambda: ocr_job_service.enqueue_batch(stored, uploader=uploader, user_id=user_id)
+        )
+    except UploadError as e:
+        for filepath, _ in stored:
+            remove_file(filepath)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        for filepath, _ in stored:
+            remove_file(filepath)
+        logger.error(f"❌ Batch enqueue error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to enqueue batch: {str(e)}")
+
+    return JSONResponse({**result, "rejected": rejected}, status_code=202)
+
+@app.get("/api/ocr/batch/{batch_id}")
+async def get_ocr_batch_status(batch_id: str):
+    """📊 Aggregate progress of a batch: total, queued, processing, done, failed, progress (%)"""
+    try:
+        if not ocr_job_service:
+            raise HTTPException(status_code=500, detail="OCR job service not available")
+
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, ocr_job_service.get_batch_status, batch_id)
+        return JSONResponse(result)
+
+    except HTTPException:
+        raise
+    except JobNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"❌ Get batch status error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get batch status: {str(e)}")
+
 # ===================== EXPORT ENDPOINTS =====================
 
 @app.post("/api/export/by-date/excel")
@@ -1827,35 +2194,63 @@ def _generate_pattern_from_correction(original_text: str, corrected_amount: str)
 # ===================== TEST ENDPOINT =====================
 
 @app.websocket("/ws/ocr/{user_id}")
-async def websocket_ocr_notifications(websocket: WebSocket, user_id: str):
+async def websocket_ocr_notifications(websocket: WebSocket, user_id: str,
+                                      last_seq: Optional[int] = None, job_ids: Optional[str] = None):
     """
     🌐 WebSocket endpoint for real-time OCR job notifications
 
-    Frontend kết nối: ws://localhost:8000/ws/ocr/{user_id}
+    Frontend kết nối: ws://localhost:8000/ws/ocr/{user_id}?last_seq=<seq>&job_ids=<id1,id2>
 
     Nhận thông báo:
-    - Job status updates (queued → processing → done/failed)
+    - Job status updates (queued → processing → done/failed), mỗi event có "seq"
     - OCR completion notifications
     - Error messages
+    - Heartbeat {"type": "ping"}: client trả lời "pong" (hoặc gửi bất kỳ message nào),
+      im lặng quá WS_IDLE_TIMEOUT giây sẽ bị đóng kết nối
+
+    Reconnect: gửi lại last_seq (seq lớn nhất đã nhận) để replay các event bị lỡ,
+    kết thúc bằng {"type": "replay_complete"}. Client gửi
+    {"type": "subscribe", "job_ids": [...], "last_seq": N} để theo dõi thêm job.
     """
     if not websocket_manager:
         await websocket.close(code=1001)  # Going away
         return
 
-    await websocket_manager.connect(websocket, user_id)
+    if not await websocket_manager.connect(websocket, user_id):
+        return
 
     try:
+        subscribed = []
+        if job_ids:
+            subscribed = await websocket_manager.subscribe(websocket, user_id, job_ids.split(","))
+        if last_seq is not None:
+            await websocket_manager.replay(websocket, user_id, last_seq, job_ids=subscribed or None)
+
         while True:
-            # Keep connection alive and listen for client messages
             data = await websocket.receive_text()
-            # Client can send messages if needed (e.g., ping, subscribe to specific jobs)
-            logger.info(f"WebSocket message from {user_id}: {data}")
+            websocket_manager.touch(websocket, user_id)
+            await websocket_manager.handle_client_message(websocket, user_id, data)
 
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
         logger.error(f"WebSocket error for {user_id}: {e}")
     finally:
         websocket_manager.disconnect(websocket, user_id)
 
+@app.get("/api/ws/metrics")
+async def websocket_metrics():
+    """📈 WebSocket metrics: current counters plus connection/user counts over time"""
+    if not websocket_manager:
+        raise HTTPException(status_code=503, detail="WebSocket manager not available")
+
+    return {
+        "success": True,
+        "stats": websocket_manager.get_stats(),
+        "history": list(websocket_manager.metrics_history),
+        "timestamp": datetime.now().isoformat()
+    }
+
 # ===================== GROQ CHAT WITH DATABASE TOOLS =====================
 
 @app.options("/chat/groq")
@@ -5,6 +5,7 @@ from pathlib import Path
 from schemas.models import FileUploadResponse, OCRResult
 from services.file_upload_service import FileUploadService
 from core.logging import logger
+from utils.upload_storage import UploadError, UploadTooLarge, save_upload, remove_file
 
 router = APIRouter(prefix="/api/upload", tags=["file-upload"])
 
@@ -39,18 +40,31 @@ async def upload_file(
         
         logger.info(f"File upload started by user {user_id}: {file.filename}")
         
-        # Create temporary file path
-        temp_file = Path(f"/tmp/{file.filename}")
-        with open(temp_file, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        # Stream into the upload dir in chunks (size limit and SHA-256 checked while writing)
+        try:
+            stored = await save_upload(
+                file,
+                max_bytes=upload_service.settings.MAX_UPLOAD_SIZE * 1024 * 1024,
+                upload_dir=str(upload_service.upload_dir)
+            )
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+        except UploadError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
         
         # Upload and validate
-        response = await upload_service.upload_file(user_id, temp_file, file.filename)
-        
-        logger.info(f"File uploaded successfully: {file.filename} (ID: {response.file_id})")
+        try:
+            response = await upload_service.upload_file(user_id, Path(stored.path), Path(file.filename).name)
+        except Exception:
+            remove_file(stored.path)
+            raise
+        response.sha256 = stored.sha256
+        
+        logger.info(f"File uploaded successfully: {file.filename} (ID: {response.file_id}, sha256: {stored.sha256[:12]})")
         return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"File upload failed for user {user_id}: {str(e)}")
         raise HTTPException(
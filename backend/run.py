@@ -3,4 +3,6 @@
 import uvicorn
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=False)
+    # Protocol-level WebSocket ping/pong: dead TCP connections are closed by the server
+    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=False,
+                ws_ping_interval=20.0, ws_ping_timeout=20.0)
@@ -72,6 +72,7 @@ class FileUploadResponse(BaseModel):
     filename: str
     file_size: int
     upload_at: datetime
+    sha256: Optional[str] = None
 
 
 class OCRResult(BaseModel):
@@ -0,0 +1,146 @@
+"""
+DB Context Service - Snapshot of invoice data rendered into LLM prompts
+
+Keeps "total / count per type / date range / recent invoices" aggregates in
+memory, tagged with the invoice data version they were read at. An insert made
+through this process bumps the version, and the next read rebuilds the
+aggregates with one query outside the lock. The rendered prompt fragment is
+cached by data version, so chat turns between inserts reuse it without
+touching the database.
+"""
+import os
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional
+
+from utils.logger import get_logger
+from utils.tool_cache import invoice_data_version
+
+logger = get_logger(__name__)
+
+# Rebuild from the database at least this often - other processes (e.g. the
+# OCR worker) insert invoices without bumping this process' data version
+SNAPSHOT_MAX_AGE = float(os.getenv("DB_CONTEXT_MAX_AGE", "300"))
+
+
+class DBContextService:
+    """Service for the cached invoice context snapshot"""
+
+    def __init__(self, db_tools=None, recent_limit: int = 10, max_age: float = SNAPSHOT_MAX_AGE):
+        self.db_tools = db_tools
+        self.recent_limit = recent_limit
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()  # one snapshot query at a time, never under _lock
+        self._version: Optional[int] = None  # data version the aggregates reflect
+        self._loaded_at = 0.0
+        self._total = 0
+        self._by_type: Counter = Counter()
+        self._first_created_at: Optional[str] = None
+        self._last_created_at: Optional[str] = None
+        self._recent: deque = deque(maxlen=recent_limit)
+        self._fragment: Optional[str] = None
+
+    def get_context(self) -> Dict[str, Any]:
+        """
+        Get the invoice context snapshot
+
+        Returns:
+            Dict with total_invoices, invoice_types (type -> count),
+            date_range and recent_invoices (newest first)
+        """
+        self._refresh()
+        with self._lock:
+            return {
+                "total_invoices": self._total,
+                "invoice_types": dict(self._by_type),
+                "date_range": self._date_range(),
+                "recent_invoices": list(self._recent)
+            }
+
+    def get_prompt_fragment(self) -> str:
+        """Get the compact prompt fragment for the current data version (cached)"""
+        self._refresh()
+        with self._lock:
+            if self._fragment is None:
+                self._fragment = self._render()
+            return self._fragment
+
+    def invalidate(self):
+        """Force a rebuild from the database on next read"""
+        with self._lock:
+            self._version = None
+
+    def _is_fresh_locked(self, version: int) -> bool:
+        return self._version == version and time.monotonic() - self._loaded_at < self.max_age
+
+    def _refresh(self):
+        """Rebuild from the database when the version moved on or the snapshot is too old"""
+        with self._lock:
+            if self._is_fresh_locked(invoice_data_version.current):
+                return
+        if not self.db_tools:
+            return
+
+        with self._rebuild_lock:
+            # Read the version before querying: the snapshot is at least this new. A bump
+            # during the query leaves _version behind current, so the next read rebuilds again.
+            version = invoice_data_version.current
+            with self._lock:
+                if self._is_fresh_locked(version):
+                    return  # rebuilt by another thread while we waited
+
+            snapshot = self.db_tools.get_invoice_snapshot(recent_limit=self.recent_limit)
+            if snapshot is None:
+                return
+
+            with self._lock:
+                self._total = snapshot["total"] or 0
+                self._by_type = Counter(snapshot["by_type"])
+                self._first_created_at = str(snapshot["first_created_at"]) if snapshot["first_created_at"] else None
+                self._last_created_at = str(snapshot["last_created_at"]) if snapshot["last_created_at"] else None
+                self._recent = deque(snapshot["recent"], maxlen=self.recent_limit)
+                self._version = version
+                self._loaded_at = time.monotonic()
+                self._fragment = None
+        logger.info(f"📸 DB context snapshot rebuilt: {self._total} invoices (version {version})")
+
+    def _date_range(self) -> str:
+        if not self._first_created_at:
+            return "No data"
+        return f"{self._first_created_at[:10]} to {self._last_created_at[:10]}"
+
+    def _render(self) -> str:
+        """Render aggregates as a compact prompt fragment"""
+        if not self._total:
+            return "📊 Hiện chưa có hóa đơn nào trong database."
+
+        types = ", ".join(f"{invoice_type}: {count}" for invoice_type, count in self._by_type.most_common())
+        lines: List[str] = [
+            f"📋 **DỮ LIỆU HÓA ĐƠN THỰC TỪ DATABASE:** tổng {self._total} hóa đơn ({types}), "
+            f"ngày lưu {self._date_range()}.",
+            f"Gần nhất ({len(self._recent)}): id | mã HĐ | loại | khách | người bán | tổng | ngày"
+        ]
+        for inv in self._recent:
+            lines.append(" | ".join(str(inv.get(col) if inv.get(col) is not None else "N/A") for col in (
+                "id", "invoice_code", "invoice_type", "buyer_name", "seller_name", "total_amount"
+            )) + f" | {str(inv.get('invoice_date') or inv.get('created_at') or 'N/A')[:10]}")
+        lines.append("⚠️ **Khi user hỏi về hóa đơn, hãy tham khảo dữ liệu THỰC này thay vì tạo dữ liệu giả**")
+        return "\n".join(lines)
+
+
+_db_context_service: Optional[DBContextService] = None
+_db_context_service_lock = threading.Lock()
+
+
+def get_db_context_service(db_tools=None) -> DBContextService:
+    """Get or create the DBContextService singleton (db_tools is attached on first use)"""
+    global _db_context_service
+    with _db_context_service_lock:
+        if _db_context_service is None:
+            _db_context_service = DBContextService(db_tools)
+        elif _db_context_service.db_tools is None and db_tools is not None:
+            _db_context_service.db_tools = db_tools
+        return _db_context_service
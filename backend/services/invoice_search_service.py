@@ -0,0 +1,274 @@
+"""
+Invoice Search Service - Semantic vector search over invoices
+
+Each invoice is embedded from its key fields plus the start of its OCR
+raw_text. The whole table is embedded by a background thread (at startup,
+then every REBUILD_INTERVAL so deleted/edited invoices do not linger); the
+new index is swapped in when complete. Searches only catch up the tail by
+invoice id (rows newer than the last indexed id), so invoices saved by the
+OCR worker process are picked up without re-embedding the table.
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from utils.embeddings import get_embedding_model, embed_texts, embedding_dimension
+from utils.logger import get_logger
+from utils.tool_cache import invoice_data_version
+from utils.vector_index import VectorIndex
+
+logger = get_logger(__name__)
+
+# Fields returned with each hit (raw_text is only used for embedding)
+RESULT_COLUMNS = (
+    "id", "invoice_code", "invoice_type", "buyer_name", "seller_name",
+    "total_amount", "invoice_date", "created_at"
+)
+
+RAW_TEXT_CHARS = 1000
+SYNC_BATCH_SIZE = 256
+# Look for new invoices at most this often (sooner when this process bumped the data version)
+SYNC_INTERVAL = float(os.getenv("SEMANTIC_SEARCH_SYNC_INTERVAL", "10"))
+# Full rebuild interval, so deleted/edited invoices do not linger in the index
+REBUILD_INTERVAL = float(os.getenv("SEMANTIC_SEARCH_REBUILD_INTERVAL", "3600"))
+MIN_SCORE = float(os.getenv("SEMANTIC_SEARCH_MIN_SCORE", "0.25"))
+
+
+def invoice_document(invoice: Dict[str, Any]) -> str:
+    """Text embedded for one invoice: key fields, then the start of the OCR text"""
+    fields = [
+        f"Mã HĐ: {invoice.get('invoice_code') or ''}",
+        f"Loại: {invoice.get('invoice_type') or ''}",
+        f"Người bán: {invoice.get('seller_name') or ''}",
+        f"Người mua: {invoice.get('buyer_name') or ''}",
+        f"Tổng tiền: {invoice.get('total_amount') or ''}",
+        f"Ngày: {invoice.get('invoice_date') or ''}",
+    ]
+    raw_text = " ".join(str(invoice.get("raw_text") or "").split())[:RAW_TEXT_CHARS]
+    return " | ".join(fields) + ("\n" + raw_text if raw_text else "")
+
+
+class InvoiceSearchService:
+    """Service for semantic invoice search"""
+
+    def __init__(self, db_tools=None):
+        self.db_tools = db_tools
+        self.model = None
+        self.index: Optional[VectorIndex] = None
+        self._rows: Dict[int, Dict[str, Any]] = {}
+        self._last_id = 0
+        self._synced_version: Optional[int] = None
+        self._synced_at = 0.0
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+        self._init_lock = threading.Lock()
+        self._init_error: Optional[str] = None
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @property
+    def available(self) -> bool:
+        return self._ensure_model()
+
+    @property
+    def ready(self) -> bool:
+        """Whether the initial full build has completed"""
+        return self._built_at > 0
+
+    def start_background_indexing(self):
+        """Start the thread that builds the index and rebuilds it every REBUILD_INTERVAL (idempotent)"""
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._index_loop, name="invoice-search-index", daemon=True)
+            self._thread.start()
+
+    def stop_background_indexing(self):
+        """Stop the rebuild thread (it exits after the current build)"""
+        self._stop.set()
+
+    def _index_loop(self):
+        while not self._stop.is_set():
+            if not self._ensure_model():
+                logger.warning(f"⚠️ Semantic invoice index disabled: {self._init_error}")
+                return
+            if self.db_tools:
+                try:
+                    self.rebuild()
+                except Exception as e:
+                    logger.error(f"❌ Semantic index build failed: {e}")
+            # Retry soon until the first build succeeds, then rebuild periodically
+            self._stop.wait(REBUILD_INTERVAL if self.ready else SYNC_INTERVAL)
+
+    def rebuild(self) -> int:
+        """
+        Embed every invoice into a fresh index and swap it in
+
+        Runs without holding the search lock (searches keep using the current
+        index until the swap), so it belongs on the background thread.
+
+        Returns:
+            Number of indexed invoices
+        """
+        started = time.monotonic()
+        index = VectorIndex(self.index.dimension)
+        rows: Dict[int, Dict[str, Any]] = {}
+        last_id = 0
+        while True:
+            batch = self.db_tools.get_invoices_for_index(after_id=last_id, limit=SYNC_BATCH_SIZE)
+            if not batch:
+                break
+            last_id = max(last_id, self._add_rows(index, rows, batch))
+            if len(batch) < SYNC_BATCH_SIZE:
+                break
+
+        with self._lock:
+            self.index = index
+            self._rows = rows
+            self._last_id = last_id
+            self._built_at = time.monotonic()
+        logger.info(f"🧭 Semantic invoice index built: {len(rows)} invoices "
+                    f"({(time.monotonic() - started) * 1000:.0f}ms)")
+        return len(rows)
+
+    def _ensure_model(self) -> bool:
+        """Load the embedding model and create the index on first use"""
+        if self.index is not None:
+            return True
+        with self._init_lock:
+            if self.index is not None:
+                return True
+            if self._init_error:
+                return False
+            self.model = get_embedding_model()
+            if self.model is None:
+                self._init_error = "Embedding model not available (install sentence-transformers)"
+                return False
+            try:
+                self.index = VectorIndex(embedding_dimension(self.model))
+                logger.info(f"✅ Semantic invoice index created ({self.index.backend} backend)")
+                return True
+            except Exception as e:
+                self._init_error = str(e)
+                logger.error(f"❌ Could not create semantic index: {e}")
+                return False
+
+    def sync(self, force: bool = False) -> int:
+        """
+        Embed invoices added since the last sync (the tail after the last indexed id)
+
+        Does nothing until the background thread has built the index.
+
+        Args:
+            force: Sync even if the interval has not elapsed
+
+        Returns:
+            Number of newly indexed invoices
+        """
+        if not self.ready or not self.db_tools:
+            return 0
+
+        with self._lock:
+            now = time.monotonic()
+            version = invoice_data_version.current
+            if not force and version == self._synced_version and now - self._synced_at < SYNC_INTERVAL:
+                return 0
+
+            added = 0
+            while True:
+                rows = self.db_tools.get_invoices_for_index(after_id=self._last_id, limit=SYNC_BATCH_SIZE)
+                if not rows:
+                    break
+                self._last_id = max(self._last_id, self._add_rows(self.index, self._rows, rows))
+                added += len(rows)
+                if len(rows) < SYNC_BATCH_SIZE:
+                    break
+
+            self._synced_version = version
+            self._synced_at = now
+            if added:
+                logger.info(f"🧭 Indexed {added} invoices for semantic search ({len(self.index)} total, "
+                            f"{(time.monotonic() - now) * 1000:.0f}ms)")
+            return added
+
+    def search(self, query: str, top_k: int = 5, min_score: float = MIN_SCORE) -> Dict[str, Any]:
+        """
+        Find the invoices most similar to a natural-language query
+
+        Args:
+            query: e.g. "hóa đơn tiền điện EVN khoảng 300k"
+            top_k: Max results
+            min_score: Minimum cosine similarity of a hit
+
+        Returns:
+            Dict with success, count and results (invoice fields + score)
+        """
+        if not query or not query.strip():
+            return {"success": False, "error": "Query is required"}
+        if self._init_error:
+            return {"success": False, "error": self._init_error}
+        if not self.ready:
+            # Never embed the whole table inside a request
+            self.start_background_indexing()
+            return {"success": False, "error": "Semantic index is being built, please retry shortly",
+                    "indexing": True}
+
+        self.sync()
+        started = time.perf_counter()
+        vector = embed_texts(self.model, [query.strip()])[0]
+        with self._lock:
+            hits = self.index.search(vector, top_k)
+            results = [
+                {**self._rows[invoice_id], "score": round(score, 4)}
+                for invoice_id, score in hits
+                if score >= min_score and invoice_id in self._rows
+            ]
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        logger.info(f"🔎 Semantic search '{query[:50]}': {len(results)} hits in {elapsed_ms:.1f}ms")
+        return {
+            "success": True,
+            "query": query,
+            "count": len(results),
+            "results": results,
+            "elapsed_ms": round(elapsed_ms, 2)
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Index size and state"""
+        return {
+            "available": self.index is not None,
+            "backend": self.index.backend if self.index is not None else None,
+            "ready": self.ready,
+            "indexed": len(self.index) if self.index is not None else 0,
+            "last_id": self._last_id,
+            "error": self._init_error
+        }
+
+    def _add_rows(self, index: VectorIndex, results: Dict[int, Dict[str, Any]],
+                  rows: List[Dict[str, Any]]) -> int:
+        """Embed rows into an index and its result map; returns the highest invoice id"""
+        vectors = embed_texts(self.model, [invoice_document(row) for row in rows])
+        ids = [int(row["id"]) for row in rows]
+        index.add(ids, vectors)
+        for invoice_id, row in zip(ids, rows):
+            results[invoice_id] = {col: row.get(col) for col in RESULT_COLUMNS}
+        return max(ids)
+
+
+_invoice_search_service: Optional[InvoiceSearchService] = None
+_invoice_search_service_lock = threading.Lock()
+
+
+def get_invoice_search_service(db_tools=None) -> InvoiceSearchService:
+    """Get or create the InvoiceSearchService singleton (db_tools is attached on first use)"""
+    global _invoice_search_service
+    with _invoice_search_service_lock:
+        if _invoice_search_service is None:
+            _invoice_search_service = InvoiceSearchService(db_tools)
+        elif _invoice_search_service.db_tools is None and db_tools is not None:
+            _invoice_search_service.db_tools = db_tools
+        return _invoice_search_service
@@ -2,7 +2,7 @@
 Invoice Service - Handles all invoice-related business logic
 """
 from typing import List, Dict, Optional, Any
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 from utils.logger import get_logger
 
@@ -60,6 +60,33 @@ class InvoiceService:
             "count": len(invoices)
         }
 
+    def get_invoices_by_date(self, target_date: date, limit: int = 20) -> Dict[str, Any]:
+        """
+        Get invoices created on one day (filtered in SQL)
+
+        Args:
+            target_date: Day to list (compared with created_at)
+            limit: Maximum number of invoices to return
+
+        Returns:
+            Dict containing invoice list, returned count and total matching count
+        """
+        if not self.db_tools:
+            raise Exception("Database not available")
+
+        logger.info(f"📋 Getting invoices for {target_date}, limit: {limit}")
+
+        day = target_date.isoformat()
+        result = self.db_tools.get_invoices_by_date_range(day, day, limit=limit)
+
+        return {
+            "success": True,
+            "message": f"Tìm thấy {result['count']} hóa đơn",
+            "data": result["invoices"],
+            "count": len(result["invoices"]),
+            "total": result["count"]
+        }
+
     def get_invoice_detail(self, invoice_id: str) -> Dict[str, Any]:
         """
         Get detailed information for a specific invoice
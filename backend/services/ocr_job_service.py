@@ -2,14 +2,19 @@
 OCR Job Service - Handles async OCR job operations
 """
 import uuid
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
 from utils.logger import get_logger
+from utils.notification_bus import get_notification_bus
 
 logger = get_logger(__name__)
 
 
+class JobNotFound(Exception):
+    """No OCR job (or batch) with the given id"""
+
+
 class OCRJobService:
     """Service for handling OCR job operations"""
 
@@ -28,24 +33,43 @@ class OCRJobService:
         if not conn:
             raise Exception("Cannot connect to database")
 
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO ocr_jobs (id, filepath, filename, status, uploader, user_id, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                job_id,
-                filepath,
-                filename,
-                'queued',
-                uploader,
-                user_id,
-                datetime.now(),
-                datetime.now()
-            ))
-            conn.commit()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO ocr_jobs (id, filepath, filename, status, uploader, user_id, created_at, updated_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                """, (
+                    job_id,
+                    filepath,
+                    filename,
+                    'queued',
+                    uploader,
+                    user_id,
+                    datetime.now(),
+                    datetime.now()
+                ))
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._release(conn)
 
         logger.info(f"📋 OCR job enqueued: {job_id} for file {filename}")
 
+        # First event of the job, so a reconnecting client can replay it from the log
+        try:
+            get_notification_bus().publish(user_id or "anonymous", {
+                "type": "ocr_job_update",
+                "job_id": job_id,
+                "status": "queued",
+                "message": "OCR job queued",
+                "filename": filename,
+                "timestamp": datetime.now().isoformat()
+            })
+        except Exception as e:
+            logger.warning(f"⚠️ Could not publish queued event for job {job_id}: {e}")
+
         return {
             "success": True,
             "job_id": job_id,
@@ -55,6 +79,118 @@ class OCRJobService:
             "timestamp": datetime.now().isoformat()
         }
 
+    def _release(self, conn):
+        """Return a pooled connection (PostgreSQL tools); plain connections are closed"""
+        if hasattr(self.db_tools, "release_connection"):
+            self.db_tools.release_connection(conn)
+        else:
+            conn.close()
+
+    def enqueue_batch(self, files: List[Tuple[str, str]], uploader: Optional[str] = "unknown",
+                      user_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Enqueue many OCR jobs under one batch id with a single INSERT
+
+        Args:
+            files: [(filepath, filename)] already stored in the upload dir
+        """
+        if not self.db_tools:
+            raise Exception("Database not available")
+        if not files:
+            raise Exception("No files to enqueue")
+
+        batch_id = str(uuid.uuid4())
+        now = datetime.now()
+        jobs = [(str(uuid.uuid4()), filepath, filename) for filepath, filename in files]
+
+        conn = self.db_tools.connect()
+        if not conn:
+            raise Exception("Cannot connect to database")
+
+        try:
+            with conn.cursor() as cursor:
+                placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(jobs))
+                params = []
+                for job_id, filepath, filename in jobs:
+                    params.extend((job_id, batch_id, filepath, filename, 'queued', uploader, user_id, now, now))
+                cursor.execute(f"""
+                    INSERT INTO ocr_jobs (id, batch_id, filepath, filename, status, uploader, user_id, created_at, updated_at)
+                    VALUES {placeholders}
+                """, params)
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._release(conn)
+
+        logger.info(f"📦 OCR batch enqueued: {batch_id} ({len(jobs)} jobs)")
+
+        try:
+            get_notification_bus().publish(user_id or "anonymous", {
+                "type": "ocr_batch_progress",
+                "batch_id": batch_id,
+                "total": len(jobs),
+                "queued": len(jobs),
+                "processing": 0,
+                "done": 0,
+                "failed": 0,
+                "timestamp": datetime.now().isoformat()
+            })
+        except Exception as e:
+            logger.warning(f"⚠️ Could not publish batch event for {batch_id}: {e}")
+
+        return {
+            "success": True,
+            "batch_id": batch_id,
+            "status": "queued",
+            "total": len(jobs),
+            "jobs": [
+                {"job_id": job_id, "filename": filename}
+                for job_id, _, filename in jobs
+            ],
+            "message": f"{len(jobs)} OCR jobs queued",
+            "timestamp": datetime.now().isoformat()
+        }
+
+    def get_batch_status(self, batch_id: str) -> Dict[str, Any]:
+        """Aggregate status of a batch (job counts per status)"""
+        if not self.db_tools:
+            raise Exception("Database not available")
+
+        conn = self.db_tools.connect()
+        if not conn:
+            raise Exception("Cannot connect to database")
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT status, COUNT(*) AS count
+                    FROM ocr_jobs
+                    WHERE batch_id = %s
+                    GROUP BY status
+                """, (batch_id,))
+                rows = cursor.fetchall()
+        finally:
+            self._release(conn)
+
+        if not rows:
+            raise JobNotFound(f"Batch not found: {batch_id}")
+
+        counts = {"queued": 0, "processing": 0, "done": 0, "failed": 0}
+        for row in rows:
+            counts[row['status']] = counts.get(row['status'], 0) + row['count']
+        total = sum(counts.values())
+
+        return {
+            "success": True,
+            "batch_id": batch_id,
+            "total": total,
+            **counts,
+            "progress": round((counts["done"] + counts["failed"]) * 100 / total),
+            "timestamp": datetime.now().isoformat()
+        }
+
     def get_job_status(self, job_id: str) -> Dict[str, Any]:
         """Get status of an OCR job"""
         if not self.db_tools:
@@ -64,40 +200,70 @@ class OCRJobService:
         if not conn:
             raise Exception("Cannot connect to database")
 
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT id, filename, status, progress, invoice_id, error_message, created_at, updated_at
-                FROM ocr_jobs
-                WHERE id = %s
-            """, (job_id,))
-            result = cursor.fetchone()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT id, filename, status, progress, invoice_id, error_message, created_at, updated_at
+                    FROM ocr_jobs
+                    WHERE id = %s
+                """, (job_id,))
+                result = cursor.fetchone()
+        finally:
+            self._release(conn)
 
         if not result:
-            raise Exception(f"Job not found: {job_id}")
+            raise JobNotFound(f"Job not found: {job_id}")
 
-        job_id_db, filename, status, progress, invoice_id, error_msg, created_at, updated_at = result
+        status = result['status']
+        created_at = result['created_at']
+        updated_at = result['updated_at']
 
         logger.info(f"📊 Job status retrieved: {job_id} → {status}")
 
         return {
             "success": True,
-            "job_id": job_id_db,
-            "filename": filename,
+            "job_id": result['id'],
+            "filename": result['filename'],
             "status": status,
-            "progress": progress or 0,
-            "invoice_id": invoice_id,
-            "error_message": error_msg,
+            "progress": result['progress'] or 0,
+            "invoice_id": result['invoice_id'],
+            "error_message": result['error_message'],
             "created_at": created_at.isoformat() if hasattr(created_at, 'isoformat') else str(created_at),
             "updated_at": updated_at.isoformat() if hasattr(updated_at, 'isoformat') else str(updated_at),
             "timestamp": datetime.now().isoformat()
         }
 
+    def get_job_owners(self, job_ids: List[str]) -> Dict[str, str]:
+        """Map existing job ids to the user that enqueued them (unknown ids are left out)"""
+        if not self.db_tools:
+            raise Exception("Database not available")
+        if not job_ids:
+            return {}
+
+        conn = self.db_tools.connect()
+        if not conn:
+            raise Exception("Cannot connect to database")
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT id::text AS id, user_id
+                    FROM ocr_jobs
+                    WHERE id::text = ANY(%s)
+                """, (list(job_ids),))
+                rows = cursor.fetchall()
+        finally:
+            self._release(conn)
+
+        return {row['id']: row['user_id'] or 'anonymous' for row in rows}
+
     def update_job_status(self, job_id: str, status: str, progress: Optional[int] = None,
                          invoice_id: Optional[int] = None, error_message: Optional[str] = None) -> bool:
         """Update job status"""
         if not self.db_tools:
             return False
 
+        conn = None
         try:
             conn = self.db_tools.connect()
             if not conn:
@@ -123,13 +289,19 @@ class OCRJobService:
 
         except Exception as e:
             logger.error(f"❌ Error updating job {job_id}: {str(e)}")
+            if conn:
+                conn.rollback()
             return False
+        finally:
+            if conn:
+                self._release(conn)
 
     def get_pending_jobs(self, limit: int = 10) -> list:
         """Get pending jobs for processing"""
         if not self.db_tools:
             return []
 
+        conn = None
         try:
             conn = self.db_tools.connect()
             if not conn:
@@ -147,13 +319,13 @@ class OCRJobService:
 
             jobs = []
             for row in results:
-                job_id, filepath, filename, uploader, user_id, created_at = row
+                created_at = row['created_at']
                 jobs.append({
-                    'id': job_id,
-                    'filepath': filepath,
-                    'filename': filename,
-                    'uploader': uploader,
-                    'user_id': user_id,
+                    'id': row['id'],
+                    'filepath': row['filepath'],
+                    'filename': row['filename'],
+                    'uploader': row['uploader'],
+                    'user_id': row['user_id'],
                     'created_at': created_at.isoformat() if hasattr(created_at, 'isoformat') else str(created_at)
                 })
 
@@ -161,4 +333,7 @@ class OCRJobService:
 
         except Exception as e:
             logger.error(f"❌ Error getting pending jobs: {str(e)}")
-            return []
\ No newline at end of file
+            return []
+        finally:
+            if conn:
+                self._release(conn)
\ No newline at end of file
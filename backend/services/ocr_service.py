@@ -6,31 +6,55 @@ import json
 import tempfile
 import os
 from datetime import datetime
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Dict, Any, Optional
 from PIL import Image
 
 from utils.logger import get_logger
+from utils.tool_cache import invoice_data_version
+from utils.pdf_document import page_texts, render_page
+from utils.document_format import sniff_file, PDF, XML
+from utils.e_invoice_xml import parse_e_invoice
 
 logger = get_logger(__name__)
 
+# Worker processes for OCR requested inline (/api/upload?wait=true)
+OCR_PROCESS_WORKERS = int(os.getenv("OCR_PROCESS_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) - 1)))))
+# Pool workers are spawned, not forked: the server process runs threads (notification
+# bus listener, index builder, tool executor) whose locks a fork would inherit
+OCR_POOL_START_METHOD = os.getenv("OCR_POOL_START_METHOD", "spawn")
+
 
 class OCRService:
     """Service for handling OCR operations and invoice field extraction"""
 
     def __init__(self, db_tools=None):
         self.db_tools = db_tools
+        self._training_client = None
+        self._training_client_loaded = False
+
+    def _get_training_client(self):
+        """TrainingDataClient for dash pattern learning, created once per service (None if unavailable)"""
+        if not self._training_client_loaded:
+            self._training_client_loaded = True
+            try:
+                from utils.training_client import TrainingDataClient
+                self._training_client = TrainingDataClient()
+            except Exception as e:
+                logger.warning(f"Could not initialize training client: {e}")
+        return self._training_client
 
     def extract_invoice_fields(self, ocr_text: str, filename: str = "") -> dict:
         """
         Extract invoice fields from OCR text with enhanced dash amount recognition
         """
-        # Initialize training client for dash pattern learning
-        training_client = None
-        try:
-            from utils.training_client import TrainingDataClient
-            training_client = TrainingDataClient()
-        except Exception as e:
-            logger.warning(f"Could not initialize training client: {e}")
+        # Training client for dash pattern learning
+        training_client = self._get_training_client()
 
         data = {
             'invoice_code': 'INV-UNKNOWN',
@@ -732,16 +756,39 @@ class OCRService:
         Returns:
             Dict containing OCR results
         """
-        import tempfile
-        import os
-        from PIL import Image
-        from datetime import datetime
+        ocr_result = self.recognize_file(file_content, filename, confidence_threshold, use_mock)
+        return self.persist_ocr_result(ocr_result, filename, persist)
 
-        logger.info(f"📷 Processing OCR for file: {filename} ({len(file_content)} bytes)")
+    async def process_ocr_from_path_async(self, filepath: str, filename: str, confidence_threshold: float = 0.7,
+                                          use_mock: bool = False, persist: bool = True) -> Dict[str, Any]:
+        """
+        OCR a stored upload without blocking the event loop
 
-        ocr_text = ""
-        extracted_data = {}
-        final_confidence = 0.0
+        Tesseract and field extraction run in the OCR process pool (only the
+        path crosses the process boundary), the DB save runs in the default
+        thread executor.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            if sniff_file(filepath) in (PDF, XML):
+                # Text is read directly; scanned PDF pages are fanned out to the process pool
+                ocr_result = await loop.run_in_executor(
+                    None, self.recognize_path, filepath, filename, confidence_threshold, use_mock
+                )
+            else:
+                ocr_result = await loop.run_in_executor(
+                    get_ocr_process_pool(), recognize_path_in_process,
+                    filepath, filename, confidence_threshold, use_mock
+                )
+        except BrokenProcessPool:
+            reset_ocr_process_pool()
+            raise
+        return await loop.run_in_executor(None, self.persist_ocr_result, ocr_result, filename, persist)
+
+    def recognize_file(self, file_content: bytes, filename: str, confidence_threshold: float = 0.7,
+                       use_mock: bool = False) -> Dict[str, Any]:
+        """OCR + field extraction for one file (CPU only, no database access)"""
+        logger.info(f"📷 Processing OCR for file: {filename} ({len(file_content)} bytes)")
 
         # Save to temporary file and try OCR
         with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp:
@@ -749,46 +796,7 @@ class OCRService:
             tmp_path = tmp.name
 
         try:
-            image = Image.open(tmp_path)
-
-            # If caller explicitly requested mock, use fallback immediately
-            if use_mock:
-                logger.info(f"ℹ️ use_mock=True — generating fallback OCR for {filename}")
-                ocr_text = self.generate_ocr_fallback(filename, image)
-            else:
-                # Try Tesseract OCR if available. If it's not available or fails, return 503
-                try:
-                    import pytesseract
-                    from ocr_config import configure_tesseract
-                    if configure_tesseract():
-                        ocr_text = pytesseract.image_to_string(image, lang='vie+eng')
-                        logger.info(f"✅ Tesseract OCR extracted {len(ocr_text)} chars")
-                    else:
-                        raise Exception("Tesseract not configured properly")
-                except Exception as e:
-                    logger.warning(f"⚠️ Tesseract OCR failed, using mock data: {e}")
-                    ocr_text = self.generate_ocr_fallback(filename, image)
-                    logger.info(f"✅ Using mock OCR data ({len(ocr_text)} chars)")
-
-            # Extract structured data from OCR text
-            logger.info(f"📝 OCR Text preview (first 300 chars): {ocr_text[:300]}")
-            extracted_data = self.extract_invoice_fields(ocr_text, filename)
-            logger.info(f"📊 Extracted data: invoice_code={extracted_data.get('invoice_code')}, total={extracted_data.get('total_amount')}, seller={extracted_data.get('seller_name')}")
-
-            # Calculate confidence
-            text_confidence = min(len(ocr_text) / 500, 1.0)
-            pattern_confidence = self.calculate_pattern_confidence(extracted_data)
-            final_confidence = (text_confidence + pattern_confidence) / 2
-
-            ocr_result = {
-                "status": "success",
-                "filename": filename,
-                "extracted_data": extracted_data,
-                "confidence_score": max(confidence_threshold, final_confidence),
-                "raw_text": ocr_text[:1000],
-                "message": f"✅ Xử lý OCR thành công cho {filename}"
-            }
-
+            return self.recognize_path(tmp_path, filename, confidence_threshold, use_mock)
         finally:
             # Clean up temp file
             try:
@@ -797,6 +805,154 @@ class OCRService:
             except PermissionError:
                 logger.warning(f"⚠️ Could not delete temp file immediately: {tmp_path}")
 
+    def recognize_path(self, filepath: str, filename: str, confidence_threshold: float = 0.7,
+                       use_mock: bool = False) -> Dict[str, Any]:
+        """
+        OCR + field extraction for a file on disk (CPU only, no database access)
+
+        The format is sniffed from the content: e-invoice XML is parsed directly,
+        PDFs use their text layer, only raster input goes to Tesseract.
+        """
+        document_format = sniff_file(filepath)
+        if document_format == XML:
+            return self.recognize_e_invoice(filepath, filename)
+        if document_format == PDF:
+            return self.recognize_pdf(filepath, filename, confidence_threshold, use_mock)
+
+        with Image.open(filepath) as image:
+            ocr_text = self.image_to_text(image, filename, use_mock)
+        return self.build_ocr_result(ocr_text, filename, confidence_threshold)
+
+    def has_text_fast_path(self, filepath: str) -> bool:
+        """True when the file needs no Tesseract at all (e-invoice XML, fully text-layer PDF)"""
+        document_format = sniff_file(filepath)
+        if document_format == XML:
+            return True
+        if document_format == PDF:
+            try:
+                return all(text is not None for text in page_texts(filepath))
+            except Exception as e:
+                logger.warning(f"⚠️ Could not read PDF text layer: {e}")
+        return False
+
+    def recognize_e_invoice(self, filepath: str, filename: str) -> Dict[str, Any]:
+        """Fields of an e-invoice XML, read exactly (no OCR)"""
+        started = time.perf_counter()
+        with open(filepath, "rb") as f:
+            extracted_data, text = parse_e_invoice(f.read())
+        logger.info(f"🧾 E-invoice XML {filename}: {extracted_data['invoice_code']} "
+                    f"in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+        return {
+            "status": "success",
+            "filename": filename,
+            "extracted_data": extracted_data,
+            "confidence_score": 1.0,
+            "raw_text": text[:1000],
+            "source": "e_invoice_xml",
+            "message": f"✅ Đọc hóa đơn điện tử thành công cho {filename}"
+        }
+
+    def image_to_text(self, image, filename: str, use_mock: bool = False, strict: bool = False) -> str:
+        """
+        Tesseract on one image, falling back to mock text when Tesseract is unavailable
+
+        strict=True (queued jobs whose text is saved as an invoice) never falls
+        back: a Tesseract failure raises instead.
+        """
+        # If caller explicitly requested mock, use fallback immediately
+        if use_mock:
+            logger.info(f"ℹ️ use_mock=True — generating fallback OCR for {filename}")
+            return self.generate_ocr_fallback(filename, image)
+
+        # Try Tesseract OCR if available, otherwise use mock data
+        try:
+            import pytesseract
+            from ocr_config import configure_tesseract
+            if configure_tesseract():
+                ocr_text = pytesseract.image_to_string(image, lang='vie+eng')
+                logger.info(f"✅ Tesseract OCR extracted {len(ocr_text)} chars")
+                return ocr_text
+            raise Exception("Tesseract not configured properly")
+        except Exception as e:
+            if strict:
+                raise RuntimeError(f"Tesseract OCR failed for {filename}: {e}") from e
+            logger.warning(f"⚠️ Tesseract OCR failed, using mock data: {e}")
+            ocr_text = self.generate_ocr_fallback(filename, image)
+            logger.info(f"✅ Using mock OCR data ({len(ocr_text)} chars)")
+            return ocr_text
+
+    def recognize_pdf(self, filepath: str, filename: str, confidence_threshold: float = 0.7,
+                      use_mock: bool = False) -> Dict[str, Any]:
+        """
+        OCR + field extraction for a (multi-page) PDF
+
+        Pages with an embedded text layer are read directly; scanned pages are
+        rasterized and OCRed in parallel. Page texts are merged in order and
+        extracted as one invoice.
+        """
+        pages = self.extract_pdf_pages(filepath, filename, use_mock)
+        ocr_text = "\n\n".join(page["text"] for page in pages)
+        ocr_result = self.build_ocr_result(ocr_text, filename, confidence_threshold)
+        ocr_result["pages"] = len(pages)
+        ocr_result["text_layer_pages"] = sum(1 for page in pages if page["source"] == "text_layer")
+        ocr_result["source"] = "text_layer" if ocr_result["text_layer_pages"] == len(pages) else "ocr"
+        return ocr_result
+
+    def extract_pdf_pages(self, filepath: str, filename: str, use_mock: bool = False, strict: bool = False) -> list:
+        """
+        Text of every page of a PDF: [{"page", "source": "text_layer"|"ocr", "text"}]
+
+        Scanned pages go to the OCR process pool (sequentially when already
+        running inside a pool worker). With strict=True a page that cannot be
+        OCRed raises (see image_to_text) instead of yielding mock text.
+        """
+        started = time.perf_counter()
+        texts = page_texts(filepath)
+        missing = [index for index, text in enumerate(texts) if text is None]
+
+        if missing:
+            args = ([filepath] * len(missing), missing, [filename] * len(missing),
+                    [use_mock] * len(missing), [strict] * len(missing))
+            if not _in_ocr_pool and len(missing) > 1:
+                ocr_texts = list(get_ocr_process_pool().map(ocr_pdf_page_in_process, *args))
+            else:
+                ocr_texts = list(map(ocr_pdf_page_in_process, *args))
+            for index, text in zip(missing, ocr_texts):
+                texts[index] = text
+
+        logger.info(f"📄 PDF {filename}: {len(texts)} pages ({len(texts) - len(missing)} text layer, "
+                    f"{len(missing)} OCR) in {(time.perf_counter() - started) * 1000:.0f}ms")
+        return [
+            {"page": index + 1, "source": "ocr" if index in missing else "text_layer", "text": text or ""}
+            for index, text in enumerate(texts)
+        ]
+
+    def build_ocr_result(self, ocr_text: str, filename: str, confidence_threshold: float = 0.7) -> Dict[str, Any]:
+        """Extract invoice fields from recognized text and score them"""
+        # Extract structured data from OCR text
+        logger.info(f"📝 OCR Text preview (first 300 chars): {ocr_text[:300]}")
+        extracted_data = self.extract_invoice_fields(ocr_text, filename)
+        logger.info(f"📊 Extracted data: invoice_code={extracted_data.get('invoice_code')}, total={extracted_data.get('total_amount')}, seller={extracted_data.get('seller_name')}")
+
+        # Calculate confidence
+        text_confidence = min(len(ocr_text) / 500, 1.0)
+        pattern_confidence = self.calculate_pattern_confidence(extracted_data)
+        final_confidence = (text_confidence + pattern_confidence) / 2
+
+        return {
+            "status": "success",
+            "filename": filename,
+            "extracted_data": extracted_data,
+            "confidence_score": max(confidence_threshold, final_confidence),
+            "raw_text": ocr_text[:1000],
+            "message": f"✅ Xử lý OCR thành công cho {filename}"
+        }
+
+    def persist_ocr_result(self, ocr_result: Dict[str, Any], filename: str, persist: bool = True) -> Dict[str, Any]:
+        """Save a recognized invoice to the database (when persist) and return the result"""
+        extracted_data = ocr_result.get('extracted_data', {})
+
         # Save to database only if persist is True
         if persist and self.db_tools:
             try:
@@ -856,6 +1012,7 @@ class OCRService:
                             datetime.now()
                     ))
                     conn.commit()
+                    invoice_data_version.bump()
                     invoice_id = cursor.lastrowid
                     logger.info(f"✅ Invoice saved to DB with ID: {invoice_id}")
                     ocr_result['database_id'] = invoice_id
@@ -934,6 +1091,7 @@ class OCRService:
                     datetime.now()
             ))
             conn.commit()
+            invoice_data_version.bump()
             invoice_id = cursor.lastrowid
             logger.info(f"✅ Invoice saved to DB with ID: {invoice_id}")
             cursor.close()
@@ -941,4 +1099,65 @@ class OCRService:
 
         except Exception as db_err:
             logger.error(f"❌ Database error: {db_err}")
-            return None
\ No newline at end of file
+            return None
+
+
+_ocr_process_pool: Optional[ProcessPoolExecutor] = None
+_ocr_process_pool_lock = threading.Lock()
+# Set by the pool initializer: this process is an OCR pool worker
+_in_ocr_pool = False
+# One OCRService per process for the pool entry points (training client loaded once)
+_process_ocr_service: Optional[OCRService] = None
+
+
+def _init_ocr_pool_worker():
+    """Pool initializer: mark the process as a pool worker and create its OCRService"""
+    global _in_ocr_pool
+    _in_ocr_pool = True
+    _get_process_ocr_service()
+
+
+def _get_process_ocr_service() -> OCRService:
+    global _process_ocr_service
+    if _process_ocr_service is None:
+        _process_ocr_service = OCRService()
+    return _process_ocr_service
+
+
+def get_ocr_process_pool() -> ProcessPoolExecutor:
+    """Process pool for Tesseract runs, created on first use"""
+    global _ocr_process_pool
+    with _ocr_process_pool_lock:
+        if _ocr_process_pool is None:
+            _ocr_process_pool = ProcessPoolExecutor(
+                max_workers=OCR_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context(OCR_POOL_START_METHOD),
+                initializer=_init_ocr_pool_worker
+            )
+            logger.info(f"🧵 OCR process pool started ({OCR_PROCESS_WORKERS} {OCR_POOL_START_METHOD} workers)")
+        return _ocr_process_pool
+
+
+def reset_ocr_process_pool():
+    """Drop a broken pool (e.g. a worker was killed); the next call starts a new one"""
+    global _ocr_process_pool
+    with _ocr_process_pool_lock:
+        if _ocr_process_pool is not None:
+            _ocr_process_pool.shutdown(wait=False)
+            _ocr_process_pool = None
+
+
+def ocr_pdf_page_in_process(filepath: str, page_index: int, filename: str = "", use_mock: bool = False,
+                            strict: bool = False) -> str:
+    """Rasterize and OCR one PDF page (entry point run inside the OCR process pool)"""
+    image = render_page(filepath, page_index)
+    try:
+        return _get_process_ocr_service().image_to_text(image, f"{filename}#page{page_index + 1}", use_mock, strict)
+    finally:
+        image.close()
+
+
+def recognize_path_in_process(filepath: str, filename: str, confidence_threshold: float = 0.7,
+                              use_mock: bool = False) -> Dict[str, Any]:
+    """Entry point run inside the OCR process pool"""
+    return _get_process_ocr_service().recognize_path(filepath, filename, confidence_threshold, use_mock)
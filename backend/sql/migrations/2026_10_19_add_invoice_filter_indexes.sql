@@ -0,0 +1,6 @@
+-- Migration: indexes for chatbot date/type filters on invoices
+-- Backs DatabaseTools.get_invoices_by_date_range / get_invoices_by_type
+
+CREATE INDEX IF NOT EXISTS idx_invoices_created_at ON invoices (created_at DESC);
+
+CREATE INDEX IF NOT EXISTS idx_invoices_type_created_at ON invoices (invoice_type, created_at DESC);
@@ -0,0 +1,7 @@
+-- Migration: group OCR jobs uploaded together (POST /api/ocr/batch)
+-- Batch progress is aggregated from ocr_jobs by batch_id
+
+ALTER TABLE ocr_jobs ADD COLUMN IF NOT EXISTS batch_id UUID NULL;
+
+CREATE INDEX IF NOT EXISTS idx_ocr_jobs_batch_id ON ocr_jobs (batch_id, status)
+WHERE batch_id IS NOT NULL;
@@ -0,0 +1,10 @@
+-- Migration: heartbeat for claimed OCR jobs (worker.py)
+-- A worker refreshes heartbeat_at of the jobs it is processing; 'processing'
+-- jobs whose heartbeat is older than JOB_STALE_AFTER belong to a crashed
+-- worker and are re-queued (or failed once attempts reach the retry limit)
+
+ALTER TABLE ocr_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP NULL;
+ALTER TABLE ocr_jobs ADD COLUMN IF NOT EXISTS attempts INT DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_ocr_jobs_processing_heartbeat ON ocr_jobs (heartbeat_at)
+WHERE status = 'processing';
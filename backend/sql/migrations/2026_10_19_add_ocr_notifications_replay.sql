@@ -0,0 +1,11 @@
+-- Migration: ocr_notifications as the replayable OCR event log
+-- Backs NotificationBus.replay (resume by user or job id after a last-seen sequence = id)
+
+ALTER TABLE ocr_notifications ADD COLUMN IF NOT EXISTS user_id TEXT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_ocr_notifications_user_id_id ON ocr_notifications (user_id, id);
+
+CREATE INDEX IF NOT EXISTS idx_ocr_notifications_job_id_id ON ocr_notifications (job_id, id);
+
+-- Retention pruning
+CREATE INDEX IF NOT EXISTS idx_ocr_notifications_created_at ON ocr_notifications (created_at);
@@ -0,0 +1,143 @@
+"""ConversationService write-behind buffer: batched flush, bad rows, outages, history merge"""
+
+import atexit
+from datetime import datetime
+
+import psycopg2
+import pytest
+
+import utils.conversation_service as conversation_module
+from utils.conversation_service import ConversationService
+
+
+class FakeCursor:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, rows=()):
+        self.rows = rows
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self.rows)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FakeDatabaseTools:
+    def __init__(self):
+        self.table = []  # committed chat_history rows
+        self.rejected_users = set()
+        self.down = False
+        self.stored_rows = []
+        self.released = 0
+
+    def connect(self):
+        return FakeConnection(self.stored_rows)
+
+    def release_connection(self, conn):
+        self.released += 1
+
+
+@pytest.fixture
+def db(monkeypatch):
+    tools = FakeDatabaseTools()
+
+    def fake_execute_values(cursor, sql, rows, page_size=None):
+        if tools.down:
+            raise psycopg2.OperationalError("server closed the connection")
+        if any(row[0] in tools.rejected_users for row in rows):
+            raise psycopg2.IntegrityError("violates foreign key constraint")
+        tools.table.extend((row[0], row[3]) for row in rows)
+
+    monkeypatch.setattr(conversation_module, "get_database_tools", lambda: tools)
+    monkeypatch.setattr(conversation_module, "execute_values", fake_execute_values)
+    return tools
+
+
+@pytest.fixture
+def service(db):
+    service = ConversationService()
+    service._stopped = True  # no background flusher: tests call flush() themselves
+    yield service
+    atexit.unregister(service.shutdown)
+
+
+def test_flush_writes_queued_messages_in_order(service, db):
+    for i in range(3):
+        service.save_message(1, "s1", "user", f"m{i}")
+
+    assert service.flush() == 3
+    assert db.table == [(1, "m0"), (1, "m1"), (1, "m2")]
+    assert service._buffer == []
+    assert service.flush() == 0
+
+
+def test_rejected_row_is_dropped_without_blocking_the_rest(service, db):
+    db.rejected_users = {999}
+    service.save_message(1, "s1", "user", "first")
+    service.save_message(999, "s1", "user", "orphan")
+    service.save_message(2, "s1", "user", "second")
+
+    assert service.flush() == 2
+    assert db.table == [(1, "first"), (2, "second")]
+    assert service._buffer == []
+
+    service.save_message(3, "s1", "user", "later")
+    assert service.flush() == 1
+
+
+def test_outage_keeps_messages_queued(service, db):
+    db.down = True
+    service.save_message(1, "s1", "user", "hello")
+
+    assert service.flush() == 0
+    assert len(service._buffer) == 1
+
+    db.down = False
+    assert service.flush() == 1
+    assert db.table == [(1, "hello")]
+    assert db.released == 2
+
+
+def test_history_merges_queued_tail_without_duplicates(service, db):
+    created_at = datetime(2026, 1, 1, 10, 0, 0)
+    db.stored_rows = [
+        {"id": 1, "message_type": "user", "message_content": "stored",
+         "message_metadata": None, "created_at": created_at},
+    ]
+    service.save_message(1, "s1", "assistant", "queued")
+    service.save_message(1, "other-session", "user", "elsewhere")
+    # A message both flushed and still in the snapshot of the queue appears once
+    service._buffer.append({**service._buffer[0], "message_content": "stored", "created_at": created_at,
+                            "message_type": "user"})
+
+    history = service.get_conversation_history(1, "s1")
+    assert [m["message_content"] for m in history] == ["stored", "queued"]
+    assert history[0]["id"] == 1 and history[1]["id"] is None
+
+
+def test_history_limit_applies_after_merge(service, db):
+    for i in range(5):
+        service.save_message(1, "s1", "user", f"m{i}")
+    history = service.get_conversation_history(1, "s1", limit=2)
+    assert [m["message_content"] for m in history] == ["m3", "m4"]
@@ -0,0 +1,32 @@
+"""sniff_bytes/sniff_file: format by magic bytes, not by extension"""
+
+import pytest
+
+from utils.document_format import IMAGE, PDF, UNKNOWN, XML, sniff_bytes, sniff_file
+
+
+@pytest.mark.parametrize("head, expected", [
+    (b"%PDF-1.7\n", PDF),
+    (b"\xff\xd8\xff\xe0", IMAGE),
+    (b"\x89PNG\r\n\x1a\n", IMAGE),
+    (b"RIFF\x00\x00\x00\x00WEBPVP8 ", IMAGE),
+    (b"II*\x00", IMAGE),
+    (b'<?xml version="1.0"?><HDon/>', XML),
+    (b"\xef\xbb\xbf  \n<HDon/>", XML),
+    (b"<svg xmlns='http://www.w3.org/2000/svg'/>", UNKNOWN),
+    (b"<!DOCTYPE html><html></html>", UNKNOWN),
+    (b"PK\x03\x04", UNKNOWN),
+    (b"", UNKNOWN),
+])
+def test_sniff_bytes(head, expected):
+    assert sniff_bytes(head) == expected
+
+
+def test_sniff_file_ignores_extension(tmp_path):
+    disguised = tmp_path / "invoice.jpg"
+    disguised.write_bytes(b"%PDF-1.4 rest of file")
+    assert sniff_file(str(disguised)) == PDF
+
+
+def test_sniff_missing_file(tmp_path):
+    assert sniff_file(str(tmp_path / "missing.pdf")) is None
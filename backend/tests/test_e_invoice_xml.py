@@ -0,0 +1,75 @@
+"""parse_e_invoice: TT78 e-invoice fields, namespaces/envelopes, rejected documents"""
+
+import json
+
+import pytest
+
+from utils.e_invoice_xml import EInvoiceParseError, parse_e_invoice
+
+INVOICE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<HDon>
+  <DLHDon>
+    <TTChung>
+      <THDon>HÓA ĐƠN GIÁ TRỊ GIA TĂNG</THDon>
+      <KHMSHDon>1</KHMSHDon>
+      <KHHDon>C24TAA</KHHDon>
+      <SHDon>123</SHDon>
+      <NLap>2024-03-15</NLap>
+      <DVTTe>VND</DVTTe>
+      <HTTToan>TM/CK</HTTToan>
+    </TTChung>
+    <NDHDon>
+      <NBan><Ten>Công ty Bán</Ten><MST>0101234567</MST><DChi>Hà Nội</DChi><STKNHang>0011</STKNHang></NBan>
+      <NMua><Ten>Công ty Mua</Ten><MST>0309876543</MST><DChi>TP HCM</DChi></NMua>
+      <DSHHDVu>
+        <HHDVu><THHDVu>Giấy A4</THHDVu><DVTinh>Ram</DVTinh><SLuong>2</SLuong><DGia>50,000</DGia><ThTien>100000</ThTien><TSuat>10%</TSuat></HHDVu>
+      </DSHHDVu>
+      <TToan><TgTCThue>100000</TgTCThue><TgTThue>10000</TgTThue><TgTTTBSo>110000</TgTTTBSo></TToan>
+    </NDHDon>
+  </DLHDon>
+  <MCCQT>ABC123</MCCQT>
+</HDon>
+""".encode("utf-8")
+
+
+def test_parses_fields_and_text():
+    fields, text = parse_e_invoice(INVOICE_XML)
+
+    assert fields["invoice_code"] == "1C24TAA-123"
+    assert fields["date"] == "15/03/2024"
+    assert fields["seller_name"] == "Công ty Bán"
+    assert fields["buyer_tax_id"] == "0309876543"
+    assert fields["total_amount_value"] == 110000
+    assert fields["total_amount"] == "110,000 VND"
+    assert fields["tax_percentage"] == 10
+    assert fields["transaction_id"] == "ABC123"
+    assert fields["invoice_type"] == "e_invoice"
+    assert json.loads(fields["items"]) == [{
+        "description": "Giấy A4", "unit": "Ram", "quantity": 2, "unit_price": 50000, "amount": 100000
+    }]
+    assert "Tổng cộng thanh toán: 110,000 VND" in text
+
+
+def test_namespaced_invoice_in_envelope():
+    wrapped = INVOICE_XML.decode("utf-8").replace('<?xml version="1.0" encoding="UTF-8"?>', "")
+    wrapped = wrapped.replace("<HDon>", '<HDon xmlns="http://example.com/hdon">', 1)
+    envelope = f"<TDiep><DLieu>{wrapped}</DLieu></TDiep>".encode("utf-8")
+
+    fields, _ = parse_e_invoice(envelope)
+    assert fields["invoice_code"] == "1C24TAA-123"
+
+
+def test_total_falls_back_to_subtotal_plus_tax():
+    xml = INVOICE_XML.replace(b"<TgTTTBSo>110000</TgTTTBSo>", b"")
+    fields, _ = parse_e_invoice(xml)
+    assert fields["total_amount_value"] == 110000
+
+
+@pytest.mark.parametrize("content", [
+    b"<not-closed>",
+    b"<root><other/></root>",
+    b'<?xml version="1.0"?><!DOCTYPE HDon [<!ENTITY x "boom">]><HDon><DLHDon/></HDon>',
+])
+def test_rejects_malformed_non_invoice_and_doctype(content):
+    with pytest.raises(EInvoiceParseError):
+        parse_e_invoice(content)
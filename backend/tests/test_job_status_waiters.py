@@ -0,0 +1,57 @@
+"""JobStatusWaiters: long-poll wakeups from notification bus events"""
+
+import asyncio
+
+from utils.job_status_waiters import JobStatusWaiters
+
+
+def job_event(job_id, status, seq=None, event_type="ocr_job_update"):
+    return {"id": seq, "notification": {"type": event_type, "job_id": job_id, "status": status}}
+
+
+def test_wait_is_woken_by_event():
+    async def scenario():
+        waiters = JobStatusWaiters()
+        waiting = asyncio.create_task(waiters.wait("j1", timeout=5))
+        await asyncio.sleep(0)
+        waiters.publish(job_event("j1", "done", seq=7))
+        return waiters, await waiting
+
+    waiters, result = asyncio.run(scenario())
+    assert result == {"type": "ocr_job_update", "job_id": "j1", "status": "done", "seq": 7}
+    assert waiters.get_stats()["wakeups"] == 1
+    assert waiters.get_stats()["waiting_requests"] == 0
+
+
+def test_returns_latest_at_once_when_status_changed():
+    async def scenario():
+        waiters = JobStatusWaiters()
+        waiters.publish(job_event("j1", "processing"))
+        return await waiters.wait("j1", known_status="queued", timeout=5)
+
+    assert asyncio.run(scenario())["status"] == "processing"
+
+
+def test_timeout_returns_none():
+    async def scenario():
+        waiters = JobStatusWaiters()
+        waiters.publish(job_event("j1", "processing"))
+        result = await waiters.wait("j1", known_status="processing", timeout=0.01)
+        return waiters, result
+
+    waiters, result = asyncio.run(scenario())
+    assert result is None
+    assert waiters.get_stats()["timeouts"] == 1
+    assert waiters.get_stats()["waiting_requests"] == 0
+
+
+def test_ignores_other_events_and_bounds_tracked_jobs():
+    waiters = JobStatusWaiters(max_jobs=2)
+    waiters.publish(job_event("j0", "done", event_type="ocr_batch_progress"))
+    for job_id in ("j1", "j2", "j3"):
+        waiters.publish(job_event(job_id, "done"))
+
+    assert waiters.latest("j0") is None
+    assert waiters.latest("j1") is None
+    assert waiters.latest("j3")["status"] == "done"
+    assert waiters.get_stats()["tracked_jobs"] == 2
@@ -0,0 +1,60 @@
+"""ResponseCache: normalized keys, per-intent TTL, bypass of data-dependent intents"""
+
+import time
+
+from utils.response_cache import (
+    BYPASS_INTENTS, DEFAULT_INTENT_TTLS, GENERIC_INTENT_CLASSIFIER, ResponseCache, normalize_message
+)
+
+
+def test_normalize_message():
+    assert normalize_message("  Xin   CHÀO!!  ") == "xin chào"
+    assert normalize_message("") == ""
+
+
+def test_hit_on_normalized_message_returns_copy():
+    cache = ResponseCache()
+    cache.set("groq", "greeting", "Xin chào!", {"message": "hi", "timestamp": "old"})
+
+    hit = cache.get("groq", "greeting", "xin   chào")
+    assert hit["message"] == "hi" and hit["cached"] is True
+    assert hit["timestamp"] != "old"
+
+    hit["message"] = "changed"
+    assert cache.get("groq", "greeting", "xin chào")["message"] == "hi"
+    assert cache.get("other", "greeting", "xin chào") is None
+
+
+def test_data_dependent_intents_are_never_cached():
+    cache = ResponseCache()
+    for intent in ("list_invoices", "template_help", "general", None):
+        cache.set("groq", intent, "hello", {"message": "x"})
+        assert cache.get("groq", intent, "hello") is None
+    assert "template_help" not in DEFAULT_INTENT_TTLS
+    assert "template_help" in BYPASS_INTENTS
+
+
+def test_error_replies_are_not_cached():
+    cache = ResponseCache()
+    cache.set("groq", "help", "help", {"type": "error", "message": "boom"})
+    assert cache.get("groq", "help", "help") is None
+
+
+def test_per_intent_ttl():
+    cache = ResponseCache(intent_ttls={"greeting": 0.05, "help": 60})
+    cache.set("groq", "greeting", "hi", {"message": "hi"})
+    cache.set("groq", "help", "help", {"message": "help"})
+    time.sleep(0.1)
+    assert cache.get("groq", "greeting", "hi") is None
+    assert cache.get("groq", "help", "help") is not None
+
+
+def test_disabled_cache():
+    cache = ResponseCache(enabled=False)
+    cache.set("groq", "greeting", "hi", {"message": "hi"})
+    assert cache.get("groq", "greeting", "hi") is None
+
+
+def test_generic_intent_patterns_match_whole_messages():
+    assert GENERIC_INTENT_CLASSIFIER.classify(normalize_message("Xin chào bạn!")) == "greeting"
+    assert GENERIC_INTENT_CLASSIFIER.classify(normalize_message("xin chào, xem hóa đơn hôm nay")) is None
@@ -0,0 +1,70 @@
+"""SessionStore backends: per-user cap, idle expiry, LRU bound, shared SQLite table"""
+
+import threading
+
+import pytest
+
+from utils.session_store import InMemorySessionStore, SQLiteSessionStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemorySessionStore(max_sessions=3, idle_ttl=60, max_items=5)
+    return SQLiteSessionStore(str(tmp_path / "sessions.db"), evict_every=1, max_sessions=3, idle_ttl=60, max_items=5)
+
+
+def test_get_set_delete(store):
+    assert store.get("ns", "u1", default="missing") == "missing"
+    store.set("ns", "u1", {"a": 1})
+    assert store.get("ns", "u1") == {"a": 1}
+    assert store.get("other", "u1") is None
+    store.delete("ns", "u1")
+    assert store.get("ns", "u1") is None
+
+
+def test_append_keeps_last_items(store):
+    store.append("ns", "u1", 1, 2)
+    assert store.append("ns", "u1", 3, 4, max_items=3) == [2, 3, 4]
+    assert store.get_list("ns", "u1") == [2, 3, 4]
+
+
+def test_global_cap_bounds_caller_cap(store):
+    assert store.append("ns", "u1", *range(10), max_items=50) == [5, 6, 7, 8, 9]
+    store.set("ns", "u2", list(range(10)))
+    assert store.get("ns", "u2") == [5, 6, 7, 8, 9]
+
+
+def test_idle_sessions_expire(store):
+    store.set("ns", "u1", [1])
+    store.idle_ttl = -1
+    assert store.get("ns", "u1") is None
+    assert store.get_list("ns", "u1") == []
+    assert store.append("ns", "u1", 2) == [2]
+
+
+def test_lru_bound_on_sessions(store):
+    for user in ("u1", "u2", "u3", "u4"):
+        store.set("ns", user, user)
+    assert store.get("ns", "u1") is None
+    assert store.get("ns", "u4") == "u4"
+    assert store.stats()["sessions"] == 3
+
+
+def test_sqlite_store_is_shared_and_append_is_atomic(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    first = SQLiteSessionStore(path, max_items=1000)
+    second = SQLiteSessionStore(path, max_items=1000)
+
+    def append_many(store, offset):
+        for i in range(25):
+            store.append("ns", "u1", offset + i, max_items=1000)
+
+    threads = [threading.Thread(target=append_many, args=(s, n * 100)) for n, s in enumerate((first, second))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    values = second.get_list("ns", "u1")
+    assert sorted(values) == list(range(25)) + list(range(100, 125))
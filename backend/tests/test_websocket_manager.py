@@ -0,0 +1,147 @@
+"""WebSocketManager: bounded send queues, job subscriptions and replay"""
+
+import asyncio
+import json
+
+from websocket_manager import ClientConnection, WebSocketManager
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    async def send_json(self, message):
+        self.sent.append(message)
+
+    async def close(self, code=1000):
+        self.closed = code
+
+
+class FakeBus:
+    def __init__(self, events):
+        self.events = events
+        self.calls = []
+
+    def replay(self, user_id=None, job_ids=None, after_id=0):
+        self.calls.append((user_id, job_ids, after_id))
+        return [event for event in self.events if event["id"] > after_id]
+
+
+def drain(connection):
+    messages = []
+    while not connection.queue.empty():
+        messages.append(json.loads(connection.queue.get_nowait()))
+    return messages
+
+
+def test_enqueue_drop_oldest_when_full():
+    async def scenario():
+        manager = WebSocketManager(queue_size=2, slow_consumer_policy="drop_oldest")
+        connection = ClientConnection(FakeWebSocket(), "u1", queue_size=2)
+        for i in range(4):
+            manager._enqueue(connection, json.dumps({"n": i}))
+        return manager, connection
+
+    manager, connection = asyncio.run(scenario())
+    assert [m["n"] for m in drain(connection)] == [2, 3]
+    assert connection.dropped == 2 and manager.dropped_messages == 2
+
+
+def test_enqueue_disconnects_slow_consumer():
+    async def scenario():
+        manager = WebSocketManager(queue_size=1, slow_consumer_policy="disconnect")
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, "u1")  # welcome message fills the queue
+        connection = manager._get_connection(websocket, "u1")
+        connection.writer.cancel()
+        manager._enqueue(connection, json.dumps({"n": 1}))
+        await asyncio.sleep(0)
+        return manager, websocket
+
+    manager, websocket = asyncio.run(scenario())
+    assert manager.get_connection_count() == 0
+    assert manager.slow_disconnects == 1
+    assert websocket.closed == 1008
+
+
+def test_subscribe_only_to_owned_jobs():
+    async def scenario():
+        manager = WebSocketManager()
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, "alice")
+        denied = await manager.subscribe(websocket, "alice", ["j1"])  # no owner lookup: deny
+        manager.job_owner_lookup = lambda job_ids: {"j1": "alice", "j2": "bob"}
+        added = await manager.subscribe(websocket, "alice", ["j1", "j2", "j3", "j1"])
+        return manager, denied, added
+
+    manager, denied, added = asyncio.run(scenario())
+    assert denied == []
+    assert added == ["j1"]
+    assert set(manager.job_subscribers) == {"j1"}
+    assert manager.get_stats()["rejected_subscriptions"] == 3
+
+
+def test_replay_missed_events_then_marker():
+    async def scenario():
+        manager = WebSocketManager()
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, "alice")
+        connection = manager._get_connection(websocket, "alice")
+        connection.writer.cancel()
+        drain(connection)
+
+        manager.notification_bus = FakeBus([
+            {"id": 4, "notification": {"type": "ocr_job_update", "job_id": "j1", "status": "processing"}},
+            {"id": 5, "notification": {"type": "ocr_job_update", "job_id": "j1", "status": "done"}},
+        ])
+        count = await manager.replay(websocket, "alice", last_seq=4)
+        return manager, connection, count
+
+    manager, connection, count = asyncio.run(scenario())
+    assert count == 1
+    assert manager.notification_bus.calls == [("alice", None, 4)]
+    assert drain(connection) == [
+        {"type": "ocr_job_update", "job_id": "j1", "status": "done", "seq": 5},
+        {"type": "replay_complete", "last_seq": 5, "count": 1},
+    ]
+
+
+def test_replay_skips_jobs_not_subscribed():
+    async def scenario():
+        manager = WebSocketManager()
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, "alice")
+        manager.job_owner_lookup = lambda job_ids: {"j1": "alice"}
+        await manager.subscribe(websocket, "alice", ["j1"])
+        manager.notification_bus = FakeBus([])
+        await manager.replay(websocket, "alice", 0, job_ids=["j1", "bobs-job"], include_user=False)
+        return manager
+
+    manager = asyncio.run(scenario())
+    assert manager.notification_bus.calls == [(None, ["j1"], 0)]
+
+
+def test_bus_event_reaches_owner_and_job_subscribers():
+    async def scenario():
+        manager = WebSocketManager()
+        owner, watcher = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(owner, "alice")
+        await manager.connect(watcher, "alice-tablet")
+        manager.job_owner_lookup = lambda job_ids: {"j1": "alice-tablet"}
+        await manager.subscribe(watcher, "alice-tablet", ["j1"])
+        await manager._deliver_event({"id": 9, "user_id": "alice", "notification": {
+            "type": "ocr_job_update", "job_id": "j1", "status": "processing"
+        }})
+        await asyncio.sleep(0.01)  # let the writer tasks send
+        return owner, watcher
+
+    owner, watcher = asyncio.run(scenario())
+    assert owner.sent[-1] == {"type": "ocr_job_update", "job_id": "j1", "status": "processing", "seq": 9}
+    assert watcher.sent[-1] == owner.sent[-1]
@@ -3,80 +3,232 @@ Conversation Memory Service
 Manages chat history storage and retrieval for multi-turn conversations
 """
 
-from typing import List, Dict, Any, Optional
+import atexit
+import logging
+import os
+import threading
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, timedelta
+from psycopg2 import InterfaceError, OperationalError
+from psycopg2.extras import Json, execute_values
 from utils.database_tools import get_database_tools
 
+logger = logging.getLogger(__name__)
+
+# Write-behind buffer: flush every FLUSH_INTERVAL seconds or when BATCH_SIZE messages are queued
+FLUSH_INTERVAL = float(os.getenv("CHAT_HISTORY_FLUSH_MS", "200")) / 1000
+BATCH_SIZE = int(os.getenv("CHAT_HISTORY_BATCH_SIZE", "50"))
+# Upper bound on queued messages while the database is unreachable (oldest dropped)
+MAX_BUFFERED = int(os.getenv("CHAT_HISTORY_MAX_BUFFERED", "10000"))
+
+
 class ConversationService:
     """Service for managing conversation memory"""
 
     def __init__(self):
         self.db_tools = get_database_tools()
+        self._buffer: List[Dict[str, Any]] = []
+        self._dropped = 0  # overflow drops from the head of the buffer, ever
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one flush at a time keeps insert order
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._flusher: Optional[threading.Thread] = None
+        atexit.register(self.shutdown)
 
     def save_message(self, user_id: int, session_id: str, message_type: str,
-                    message_content: str, message_metadata: Optional[Dict[str, Any]] = None) -> int:
-        """Save a message to conversation history"""
-        conn = self.db_tools.connect()
-        if not conn:
-            raise Exception("Database connection failed")
-
-        try:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    INSERT INTO chat_history (user_id, session_id, message_type, message_content, message_metadata)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id
-                """, (
-                    user_id,
-                    session_id,
-                    message_type,
-                    message_content,
-                    message_metadata or {}
-                ))
-
-                message_id = cursor.fetchone()[0]
+                    message_content: str, message_metadata: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Queue a message for conversation history
+
+        The insert is write-behind: messages are batched and flushed by a
+        background thread, so the chat request path never waits on a commit.
+        Reads merge the queued tail (see get_conversation_history).
+        """
+        with self._lock:
+            self._buffer.append({
+                'user_id': user_id,
+                'session_id': session_id,
+                'message_type': message_type,
+                'message_content': message_content,
+                'message_metadata': message_metadata or {},
+                'created_at': datetime.now()  # local time, like the column's DB default
+            })
+            if len(self._buffer) > MAX_BUFFERED:
+                del self._buffer[0]
+                self._dropped += 1
+                logger.warning("⚠️ Chat history buffer full, dropped oldest queued message")
+            queued = len(self._buffer)
+            self._ensure_flusher()
+
+        if queued >= BATCH_SIZE:
+            self._wakeup.set()
+
+    def _ensure_flusher(self):
+        """Start the background flush thread on first use (caller holds self._lock)"""
+        if self._flusher is None and not self._stopped:
+            self._flusher = threading.Thread(target=self._flush_loop, name="chat-history-flush", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stopped:
+            self._wakeup.wait(FLUSH_INTERVAL)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Insert all queued messages in one batch; returns the number written
+
+        If the batch is rejected (e.g. a user_id that violates the users
+        foreign key), rows are retried one by one and the rejected ones are
+        dropped with a log entry, so one bad message cannot block everyone's
+        history. Connection errors keep the messages queued for the next flush.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = self._buffer[:]
+                dropped_before = self._dropped
+            if not batch:
+                return 0
+
+            conn = self.db_tools.connect()
+            if not conn:
+                logger.error(f"❌ Database connection failed, keeping {len(batch)} chat messages queued")
+                return 0
+
+            try:
+                self._insert(conn, batch)
                 conn.commit()
-                return message_id
-
-        except Exception as e:
+                handled = written = len(batch)
+            except (OperationalError, InterfaceError) as e:
+                self._rollback(conn)
+                logger.error(f"❌ Database unavailable, keeping {len(batch)} chat messages queued: {e}")
+                return 0
+            except Exception as e:
+                conn.rollback()
+                logger.warning(f"⚠️ Batch insert of {len(batch)} chat messages failed, retrying row by row: {e}")
+                handled, written = self._insert_rows(conn, batch)
+            finally:
+                self.db_tools.release_connection(conn)
+
+            # Only drop what was handled; messages queued meanwhile stay. Overflow
+            # during the insert already removed some of the batch from the head.
+            with self._lock:
+                del self._buffer[:max(0, handled - (self._dropped - dropped_before))]
+            return written
+
+    def _insert(self, conn, messages: List[Dict[str, Any]]):
+        with conn.cursor() as cursor:
+            execute_values(cursor, """
+                INSERT INTO chat_history (user_id, session_id, message_type, message_content, message_metadata, created_at)
+                VALUES %s
+            """, [
+                (m['user_id'], m['session_id'], m['message_type'], m['message_content'],
+                 Json(m['message_metadata']), m['created_at'])
+                for m in messages
+            ], page_size=BATCH_SIZE)
+
+    def _insert_rows(self, conn, batch: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """
+        Insert a rejected batch one message per transaction
+
+        Returns:
+            (messages handled = written or dropped, messages written); stops at
+            a connection error so the rest of the batch stays queued
+        """
+        written = 0
+        for index, message in enumerate(batch):
+            try:
+                self._insert(conn, [message])
+                conn.commit()
+                written += 1
+            except (OperationalError, InterfaceError) as e:
+                self._rollback(conn)
+                logger.error(f"❌ Database unavailable, keeping {len(batch) - index} chat messages queued: {e}")
+                return index, written
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"❌ Dropping chat message of user {message['user_id']} "
+                             f"(session {message['session_id']}) rejected by the database: {e}")
+        return len(batch), written
+
+    @staticmethod
+    def _rollback(conn):
+        try:
             conn.rollback()
-            raise e
+        except Exception:
+            pass
+
+    def shutdown(self):
+        """Stop the flush thread and write everything still queued"""
+        self._stopped = True
+        self._wakeup.set()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join(timeout=5)
+        written = self.flush()
+        if written:
+            logger.info(f"💾 Flushed {written} queued chat messages on shutdown")
+
+    def _buffered_messages(self, user_id: int, session_id: str) -> List[Dict[str, Any]]:
+        """Queued (not yet written) messages of a session, oldest first"""
+        with self._lock:
+            return [
+                {
+                    'id': None,
+                    'message_type': m['message_type'],
+                    'message_content': m['message_content'],
+                    'message_metadata': m['message_metadata'],
+                    'created_at': m['created_at'].isoformat()
+                }
+                for m in self._buffer
+                if m['user_id'] == user_id and m['session_id'] == session_id
+            ]
 
     def get_conversation_history(self, user_id: int, session_id: str,
                                limit: int = 50) -> List[Dict[str, Any]]:
-        """Get conversation history for a user session"""
-        conn = self.db_tools.connect()
-        if not conn:
-            return []
-
-        try:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT id, message_type, message_content, message_metadata, created_at
-                    FROM chat_history
-                    WHERE user_id = %s AND session_id = %s
-                    ORDER BY created_at ASC
-                    LIMIT %s
-                """, (user_id, session_id, limit))
+        """Get the latest `limit` messages of a user session (oldest first), including queued ones"""
+        # Snapshot the queue before reading the table: a concurrent flush may
+        # then show a message in both, which the de-duplication below drops
+        buffered = self._buffered_messages(user_id, session_id)
 
-                messages = []
-                for row in cursor.fetchall():
-                    messages.append({
-                        'id': row[0],
-                        'message_type': row[1],
-                        'message_content': row[2],
-                        'message_metadata': row[3] or {},
-                        'created_at': row[4].isoformat() if hasattr(row[4], 'isoformat') else str(row[4])
-                    })
-
-                return messages
-
-        except Exception as e:
-            print(f"Error getting conversation history: {e}")
-            return []
+        messages = []
+        conn = self.db_tools.connect()
+        if conn:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        SELECT id, message_type, message_content, message_metadata, created_at
+                        FROM chat_history
+                        WHERE user_id = %s AND session_id = %s
+                        ORDER BY created_at DESC, id DESC
+                        LIMIT %s
+                    """, (user_id, session_id, limit))
+
+                    for row in reversed(cursor.fetchall()):
+                        messages.append({
+                            'id': row['id'],
+                            'message_type': row['message_type'],
+                            'message_content': row['message_content'],
+                            'message_metadata': row['message_metadata'] or {},
+                            'created_at': row['created_at'].isoformat() if hasattr(row['created_at'], 'isoformat') else str(row['created_at'])
+                        })
+
+            except Exception as e:
+                logger.error(f"Error getting conversation history: {e}")
+            finally:
+                self.db_tools.release_connection(conn)
+
+        stored = {(m['created_at'], m['message_type'], m['message_content']) for m in messages}
+        messages.extend(
+            m for m in buffered
+            if (m['created_at'], m['message_type'], m['message_content']) not in stored
+        )
+        return messages[-limit:]
 
     def get_recent_conversations(self, user_id: int, days: int = 7) -> List[Dict[str, Any]]:
         """Get recent conversation sessions for a user"""
+        self.flush()  # include queued messages
         conn = self.db_tools.connect()
         if not conn:
             return []
@@ -97,9 +249,9 @@ class ConversationService:
                 sessions = []
                 for row in cursor.fetchall():
                     sessions.append({
-                        'session_id': row[0],
-                        'last_message_time': row[1].isoformat() if hasattr(row[1], 'isoformat') else str(row[1]),
-                        'message_count': row[2]
+                        'session_id': row['session_id'],
+                        'last_message_time': row['last_message_time'].isoformat() if hasattr(row['last_message_time'], 'isoformat') else str(row['last_message_time']),
+                        'message_count': row['message_count']
                     })
 
                 return sessions
@@ -107,6 +259,8 @@ class ConversationService:
         except Exception as e:
             print(f"Error getting recent conversations: {e}")
             return []
+        finally:
+            self.db_tools.release_connection(conn)
 
     def delete_old_messages(self, days_to_keep: int = 90) -> int:
         """Delete messages older than specified days"""
@@ -130,9 +284,12 @@ class ConversationService:
             conn.rollback()
             print(f"Error deleting old messages: {e}")
             return 0
+        finally:
+            self.db_tools.release_connection(conn)
 
     def get_conversation_stats(self, user_id: int) -> Dict[str, Any]:
         """Get conversation statistics for a user"""
+        self.flush()  # include queued messages
         conn = self.db_tools.connect()
         if not conn:
             return {}
@@ -141,9 +298,9 @@ class ConversationService:
             with conn.cursor() as cursor:
                 # Total messages
                 cursor.execute("""
-                    SELECT COUNT(*) FROM chat_history WHERE user_id = %s
+                    SELECT COUNT(*) as count FROM chat_history WHERE user_id = %s
                 """, (user_id,))
-                total_messages = cursor.fetchone()[0]
+                total_messages = cursor.fetchone()['count']
 
                 # Messages by type
                 cursor.execute("""
@@ -155,13 +312,13 @@ class ConversationService:
 
                 message_types = {}
                 for row in cursor.fetchall():
-                    message_types[row[0]] = row[1]
+                    message_types[row['message_type']] = row['count']
 
                 # Sessions count
                 cursor.execute("""
-                    SELECT COUNT(DISTINCT session_id) FROM chat_history WHERE user_id = %s
+                    SELECT COUNT(DISTINCT session_id) as count FROM chat_history WHERE user_id = %s
                 """, (user_id,))
-                total_sessions = cursor.fetchone()[0]
+                total_sessions = cursor.fetchone()['count']
 
                 return {
                     'total_messages': total_messages,
@@ -173,6 +330,8 @@ class ConversationService:
         except Exception as e:
             print(f"Error getting conversation stats: {e}")
             return {}
+        finally:
+            self.db_tools.release_connection(conn)
 
     def format_history_for_groq(self, messages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
         """Format conversation history for Groq API"""
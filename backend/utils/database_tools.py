@@ -5,8 +5,10 @@ Provides SQLite/PostgreSQL query functions for chatbot to access real invoice da
 
 import sqlite3
 import logging
+from psycopg2 import pool
+from psycopg2.extras import RealDictCursor
 from typing import Dict, List, Optional, Any
-from datetime import datetime
+from datetime import datetime, date, timedelta
 import time
 import os
 
@@ -32,9 +34,9 @@ class DatabaseTools:
         self._init_connection_pool()
     
     def _init_connection_pool(self):
-        """Initialize PostgreSQL connection pool"""
+        """Initialize PostgreSQL connection pool (thread-safe: tools run in worker threads)"""
         try:
-            self.connection_pool = pool.SimpleConnectionPool(
+            self.connection_pool = pool.ThreadedConnectionPool(
                 minconn=1,
                 maxconn=10,  # Maximum connections in pool
                 dsn=self.connection_string,
@@ -256,6 +258,141 @@ class DatabaseTools:
             if conn:
                 self.release_connection(conn)
     
+    def get_invoices_by_date_range(self, start_date: str, end_date: str, limit: int = 50) -> Dict[str, Any]:
+        """
+        Get invoices created between start_date and end_date (YYYY-MM-DD, inclusive)
+        
+        Returns:
+            {"count", "total_amount_sum", "invoices"} - aggregates cover all matches,
+            invoices is a compact projection of the newest `limit` rows
+        """
+        start = date.fromisoformat(start_date)
+        end_exclusive = date.fromisoformat(end_date) + timedelta(days=1)
+        return self._get_filtered_invoices(
+            "created_at >= %s AND created_at < %s", (start, end_exclusive), limit
+        )
+    
+    def get_invoices_by_type(self, invoice_type: str, limit: int = 50) -> Dict[str, Any]:
+        """
+        Get invoices of one type
+        
+        Returns:
+            {"count", "total_amount_sum", "invoices"} - see get_invoices_by_date_range
+        """
+        return self._get_filtered_invoices("invoice_type = %s", (invoice_type,), limit)
+    
+    def _get_filtered_invoices(self, where_clause: str, params: tuple, limit: int) -> Dict[str, Any]:
+        """
+        Run count/sum aggregates plus a compact row projection for a WHERE clause
+        
+        Raises on database errors so callers never report (or cache) a failure as 0 invoices
+        """
+        conn = None
+        try:
+            conn = self.connect()
+            if not conn:
+                raise Exception("Database not available")
+            
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT COUNT(*) as count,
+                           COALESCE(SUM(total_amount_value), 0) as total_amount_sum
+                    FROM invoices
+                    WHERE {where_clause}
+                """, params)
+                aggregates = cursor.fetchone()
+                
+                cursor.execute(f"""
+                    SELECT 
+                        id, invoice_code, invoice_type, buyer_name, seller_name,
+                        total_amount, invoice_date, created_at
+                    FROM invoices
+                    WHERE {where_clause}
+                    ORDER BY created_at DESC
+                    LIMIT %s
+                """, (*params, limit))
+                invoices = [dict(row) for row in cursor.fetchall()]
+            
+            logger.info(f"✅ Filtered invoices: {aggregates['count']} matches, returning {len(invoices)}")
+            return {
+                'count': aggregates['count'],
+                'total_amount_sum': float(aggregates['total_amount_sum'] or 0),
+                'invoices': invoices
+            }
+            
+        except Exception as e:
+            logger.error(f"❌ Error filtering invoices: {e}")
+            raise
+        finally:
+            if conn:
+                self.release_connection(conn)
+    
+    def get_invoice_snapshot(self, recent_limit: int = 10) -> Optional[Dict[str, Any]]:
+        """Aggregates for LLM context: total, count per type, created_at range and most recent rows"""
+        conn = None
+        try:
+            conn = self.connect()
+            if not conn:
+                return None
+            
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT COUNT(*) as total,
+                           MIN(created_at) as first_created_at,
+                           MAX(created_at) as last_created_at
+                    FROM invoices
+                """)
+                snapshot = dict(cursor.fetchone())
+                
+                cursor.execute("SELECT invoice_type, COUNT(*) as count FROM invoices GROUP BY invoice_type")
+                snapshot['by_type'] = {row['invoice_type'] or 'general': row['count'] for row in cursor.fetchall()}
+                
+                cursor.execute("""
+                    SELECT 
+                        id, invoice_code, invoice_type, buyer_name, seller_name,
+                        total_amount, invoice_date, created_at
+                    FROM invoices
+                    ORDER BY created_at DESC
+                    LIMIT %s
+                """, (recent_limit,))
+                snapshot['recent'] = [dict(row) for row in cursor.fetchall()]
+            
+            return snapshot
+            
+        except Exception as e:
+            logger.error(f"❌ Error getting invoice snapshot: {e}")
+            return None
+        finally:
+            if conn:
+                self.release_connection(conn)
+    
+    def get_invoices_for_index(self, after_id: int = 0, limit: int = 500) -> List[Dict]:
+        """Invoices with id > after_id (ascending) incl. raw_text, for incremental search indexing"""
+        conn = None
+        try:
+            conn = self.connect()
+            if not conn:
+                return []
+            
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT 
+                        id, invoice_code, invoice_type, buyer_name, seller_name,
+                        total_amount, invoice_date, created_at, raw_text
+                    FROM invoices
+                    WHERE id > %s
+                    ORDER BY id
+                    LIMIT %s
+                """, (after_id, limit))
+                return [dict(row) for row in cursor.fetchall()]
+            
+        except Exception as e:
+            logger.error(f"❌ Error getting invoices for index: {e}")
+            return []
+        finally:
+            if conn:
+                self.release_connection(conn)
+    
     def get_buyer_summary(self, buyer_name: str) -> Dict[str, Any]:
         """Get summary for specific buyer"""
         conn = None
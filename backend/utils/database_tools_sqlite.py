@@ -5,7 +5,7 @@ Simple SQLite Database Tools for ChatBotAI
 import sqlite3
 import logging
 from typing import Dict, List, Optional, Any
-from datetime import datetime
+from datetime import datetime, date, timedelta
 import os
 
 logger = logging.getLogger(__name__)
@@ -162,6 +162,120 @@ class DatabaseTools:
             logger.error(f"❌ Error searching invoices: {e}")
             return []
 
+    def get_invoices_by_date_range(self, start_date: str, end_date: str, limit: int = 50) -> Dict[str, Any]:
+        """Get invoices created between start_date and end_date (YYYY-MM-DD, inclusive) with count/sum"""
+        start = date.fromisoformat(start_date).isoformat()
+        end_exclusive = (date.fromisoformat(end_date) + timedelta(days=1)).isoformat()
+        return self._get_filtered_invoices("created_at >= ? AND created_at < ?", (start, end_exclusive), limit)
+
+    def get_invoices_by_type(self, invoice_type: str, limit: int = 50) -> Dict[str, Any]:
+        """Get invoices of one type with count/sum"""
+        return self._get_filtered_invoices("invoice_type = ?", (invoice_type,), limit)
+
+    def _get_filtered_invoices(self, where_clause: str, params: tuple, limit: int) -> Dict[str, Any]:
+        """
+        Run count/sum aggregates plus a compact row projection for a WHERE clause
+
+        Raises on database errors so callers never report (or cache) a failure as 0 invoices
+        """
+        try:
+            conn = self.connect()
+            if not conn:
+                raise Exception("Database not available")
+
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT COUNT(*), COALESCE(SUM(total_amount_value), 0)
+                FROM invoices
+                WHERE {where_clause}
+            """, params)
+            count, total_amount_sum = cursor.fetchone()
+
+            cursor.execute(f"""
+                SELECT 
+                    id, invoice_code, invoice_type, buyer_name, seller_name,
+                    total_amount, invoice_date, created_at
+                FROM invoices
+                WHERE {where_clause}
+                ORDER BY created_at DESC
+                LIMIT ?
+            """, (*params, limit))
+            invoices = [dict(row) for row in cursor.fetchall()]
+            conn.close()
+
+            logger.info(f"✅ Filtered invoices: {count} matches, returning {len(invoices)}")
+            return {
+                'count': count,
+                'total_amount_sum': float(total_amount_sum or 0),
+                'invoices': invoices
+            }
+
+        except Exception as e:
+            logger.error(f"❌ Error filtering invoices: {e}")
+            raise
+
+    def get_invoice_snapshot(self, recent_limit: int = 10) -> Optional[Dict[str, Any]]:
+        """Aggregates for LLM context: total, count per type, created_at range and most recent rows"""
+        try:
+            conn = self.connect()
+            if not conn:
+                return None
+
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*), MIN(created_at), MAX(created_at) FROM invoices")
+            total, first_created_at, last_created_at = cursor.fetchone()
+
+            cursor.execute("SELECT invoice_type, COUNT(*) FROM invoices GROUP BY invoice_type")
+            by_type = {row[0] or 'general': row[1] for row in cursor.fetchall()}
+
+            cursor.execute("""
+                SELECT 
+                    id, invoice_code, invoice_type, buyer_name, seller_name,
+                    total_amount, invoice_date, created_at
+                FROM invoices
+                ORDER BY created_at DESC
+                LIMIT ?
+            """, (recent_limit,))
+            recent = [dict(row) for row in cursor.fetchall()]
+            conn.close()
+
+            return {
+                'total': total,
+                'by_type': by_type,
+                'first_created_at': first_created_at,
+                'last_created_at': last_created_at,
+                'recent': recent
+            }
+
+        except Exception as e:
+            logger.error(f"❌ Error getting invoice snapshot: {e}")
+            return None
+
+    def get_invoices_for_index(self, after_id: int = 0, limit: int = 500) -> List[Dict]:
+        """Invoices with id > after_id (ascending) incl. raw_text, for incremental search indexing"""
+        try:
+            conn = self.connect()
+            if not conn:
+                return []
+
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT 
+                    id, invoice_code, invoice_type, buyer_name, seller_name,
+                    total_amount, invoice_date, created_at, raw_text
+                FROM invoices
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+            """, (after_id, limit))
+            invoices = [dict(row) for row in cursor.fetchall()]
+            conn.close()
+            return invoices
+
+        except Exception as e:
+            logger.error(f"❌ Error getting invoices for index: {e}")
+            return []
+
     def get_statistics(self) -> Dict[str, Any]:
         """Get database statistics (mock)"""
         return {
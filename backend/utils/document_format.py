@@ -0,0 +1,54 @@
+"""
+Document Format Sniffer
+Nhận diện loại file theo nội dung (magic bytes), không tin phần mở rộng:
+- pdf: có thể có text layer (hóa đơn điện tử) -> đọc text trực tiếp
+- xml: hóa đơn điện tử XML -> parse trực tiếp, không OCR
+- image: ảnh chụp/scan -> Tesseract
+"""
+
+from typing import Optional
+
+PDF = "pdf"
+XML = "xml"
+IMAGE = "image"
+UNKNOWN = "unknown"
+
+_IMAGE_SIGNATURES = (
+    b"\xff\xd8\xff",            # JPEG
+    b"\x89PNG\r\n\x1a\n",       # PNG
+    b"GIF87a", b"GIF89a",
+    b"BM",                      # BMP
+    b"II*\x00", b"MM\x00*",     # TIFF
+)
+_BOMS = (b"\xef\xbb\xbf", b"\xff\xfe", b"\xfe\xff")
+# Markup that starts with "<" but is never an e-invoice
+_NON_INVOICE_MARKUP = (b"<svg", b"<html", b"<!doctype html")
+
+
+def sniff_bytes(head: bytes) -> str:
+    """Format of a document from its first bytes"""
+    if head.startswith(b"%PDF-"):
+        return PDF
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        return IMAGE
+    if any(head.startswith(signature) for signature in _IMAGE_SIGNATURES):
+        return IMAGE
+
+    text = head
+    for bom in _BOMS:
+        if text.startswith(bom):
+            text = text[len(bom):]
+            break
+    text = text.lstrip()
+    if text.startswith(b"<") and not any(tag in text.lower() for tag in _NON_INVOICE_MARKUP):
+        return XML
+    return UNKNOWN
+
+
+def sniff_file(filepath: str, head_size: int = 512) -> Optional[str]:
+    """Format of a file on disk (None if it cannot be read)"""
+    try:
+        with open(filepath, "rb") as f:
+            return sniff_bytes(f.read(head_size))
+    except OSError:
+        return None
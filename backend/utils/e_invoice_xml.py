@@ -0,0 +1,154 @@
+"""
+E-Invoice XML Parser
+Đọc trực tiếp hóa đơn điện tử XML theo chuẩn Tổng cục Thuế (TT78/2021, NĐ123/2020):
+HDon/DLHDon/TTChung (ký hiệu, số, ngày lập), NDHDon/NBan, NMua, DSHHDVu, TToan.
+Dữ liệu là chính xác nên không cần OCR hay regex.
+"""
+
+import json
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class EInvoiceParseError(ValueError):
+    """Not a supported e-invoice XML document"""
+
+
+class _NoDoctypeTreeBuilder(ET.TreeBuilder):
+    """Tree builder that aborts the parse at a DOCTYPE (no DTDs, entity expansion or external fetches)"""
+
+    def doctype(self, name, pubid, system):
+        raise EInvoiceParseError("XML with DOCTYPE is not accepted")
+
+
+def _local(tag: str) -> str:
+    """Tag name without namespace"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _find(element: Optional[ET.Element], *path: str) -> Optional[ET.Element]:
+    """Follow a path of local tag names (namespace-agnostic)"""
+    for name in path:
+        if element is None:
+            return None
+        element = next((child for child in element if _local(child.tag) == name), None)
+    return element
+
+
+def _text(element: Optional[ET.Element], *path: str) -> str:
+    found = _find(element, *path)
+    return (found.text or "").strip() if found is not None else ""
+
+
+def _number(value: str) -> float:
+    try:
+        return float(value.replace(",", "")) if value else 0
+    except ValueError:
+        return 0
+
+
+def _percentage(value: str) -> float:
+    return _number(value.replace("%", "")) if value and value.rstrip("%").replace(".", "").isdigit() else 0
+
+
+def _date(value: str) -> str:
+    """yyyy-mm-dd (XML) -> dd/mm/yyyy (extract_invoice_fields format)"""
+    try:
+        return datetime.strptime(value[:10], "%Y-%m-%d").strftime("%d/%m/%Y")
+    except ValueError:
+        return value
+
+
+def parse_e_invoice(content: bytes) -> Tuple[Dict[str, Any], str]:
+    """
+    Parse a Vietnamese e-invoice XML
+
+    Returns:
+        (fields in the extract_invoice_fields format, readable text of the invoice)
+
+    Raises:
+        EInvoiceParseError: malformed XML, DTDs, or no HDon/DLHDon element
+    """
+    try:
+        root = ET.fromstring(content, parser=ET.XMLParser(target=_NoDoctypeTreeBuilder()))
+    except ET.ParseError as e:
+        raise EInvoiceParseError(f"Invalid XML: {e}")
+
+    # HDon may be the root or wrapped in a transmission envelope (TDiep/DLieu/HDon)
+    invoice = next((el for el in root.iter() if _local(el.tag) == "HDon"), None)
+    data_element = _find(invoice, "DLHDon")
+    if data_element is None:
+        raise EInvoiceParseError("No HDon/DLHDon element (not an e-invoice XML)")
+
+    general = _find(data_element, "TTChung")
+    body = _find(data_element, "NDHDon")
+    seller = _find(body, "NBan")
+    buyer = _find(body, "NMua")
+    totals = _find(body, "TToan")
+
+    symbol = _text(general, "KHMSHDon") + _text(general, "KHHDon")
+    number = _text(general, "SHDon")
+    currency = _text(general, "DVTTe") or "VND"
+
+    items: List[Dict[str, Any]] = []
+    tax_percentage = 0.0
+    item_list = _find(body, "DSHHDVu")
+    for item in (item_list if item_list is not None else []):
+        if _local(item.tag) != "HHDVu":
+            continue
+        items.append({
+            "description": _text(item, "THHDVu"),
+            "unit": _text(item, "DVTinh"),
+            "quantity": _number(_text(item, "SLuong")) or 1,
+            "unit_price": _number(_text(item, "DGia")),
+            "amount": _number(_text(item, "ThTien"))
+        })
+        tax_percentage = tax_percentage or _percentage(_text(item, "TSuat"))
+
+    subtotal = _number(_text(totals, "TgTCThue"))
+    tax_amount = _number(_text(totals, "TgTThue"))
+    total = _number(_text(totals, "TgTTTBSo")) or subtotal + tax_amount
+
+    fields = {
+        "invoice_code": f"{symbol}-{number}" if symbol and number else (number or "INV-UNKNOWN"),
+        "date": _date(_text(general, "NLap")) or datetime.now().strftime("%d/%m/%Y"),
+        "buyer_name": _text(buyer, "Ten") or _text(buyer, "HVTNMHang") or "Unknown",
+        "seller_name": _text(seller, "Ten") or "Unknown",
+        "total_amount": f"{total:,.0f} {currency}",
+        "total_amount_value": total,
+        "subtotal": subtotal,
+        "tax_amount": tax_amount,
+        "tax_percentage": tax_percentage,
+        "currency": currency,
+        "buyer_tax_id": _text(buyer, "MST"),
+        "seller_tax_id": _text(seller, "MST"),
+        "buyer_address": _text(buyer, "DChi"),
+        "seller_address": _text(seller, "DChi"),
+        "items": json.dumps(items, ensure_ascii=False),
+        "transaction_id": _text(invoice, "MCCQT"),
+        "payment_method": _text(general, "HTTToan"),
+        "payment_account": _text(seller, "STKNHang"),
+        "invoice_time": None,
+        "due_date": None,
+        "invoice_type": "e_invoice"
+    }
+
+    lines = [
+        _text(general, "THDon") or "HÓA ĐƠN ĐIỆN TỬ",
+        f"Ký hiệu: {symbol}  Số: {number}  Ngày lập: {fields['date']}",
+        f"Đơn vị bán hàng: {fields['seller_name']}  MST: {fields['seller_tax_id']}",
+        f"Địa chỉ: {fields['seller_address']}",
+        f"Người mua: {fields['buyer_name']}  MST: {fields['buyer_tax_id']}",
+        f"Địa chỉ: {fields['buyer_address']}",
+    ]
+    lines += [
+        f"{index}. {item['description']} {item['quantity']:g} {item['unit']} x {item['unit_price']:,.0f} = {item['amount']:,.0f}"
+        for index, item in enumerate(items, 1)
+    ]
+    lines += [
+        f"Cộng tiền hàng: {subtotal:,.0f}",
+        f"Tiền thuế GTGT ({tax_percentage:g}%): {tax_amount:,.0f}",
+        f"Tổng cộng thanh toán: {total:,.0f} {currency}",
+    ]
+    return fields, "\n".join(lines)
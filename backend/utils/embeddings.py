@@ -0,0 +1,58 @@
+"""
+Embedding Models
+Nạp model sentence-embedding (CPU) một lần cho mỗi process, dùng chung giữa
+semantic router và semantic search
+"""
+
+import os
+import threading
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Optional dependency - callers disable their feature when it is missing
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError as e:
+    logger.debug(f"sentence-transformers unavailable: {e}")
+    SentenceTransformer = None
+
+# Small multilingual model (Vietnamese + English), fast on CPU
+DEFAULT_EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+
+_models: Dict[str, object] = {}
+_models_lock = threading.Lock()
+
+
+def get_embedding_model(model_name: str = DEFAULT_EMBEDDING_MODEL):
+    """
+    Get a loaded SentenceTransformer, shared per model name
+
+    Returns:
+        The model, or None when sentence-transformers is missing or loading failed
+    """
+    if SentenceTransformer is None or not model_name:
+        return None
+    with _models_lock:
+        if model_name not in _models:
+            try:
+                _models[model_name] = SentenceTransformer(model_name, device="cpu")
+                logger.info(f"✅ Embedding model loaded: {model_name}")
+            except Exception as e:
+                logger.warning(f"⚠️ Could not load embedding model {model_name}: {e}")
+                _models[model_name] = None
+        return _models[model_name]
+
+
+def embed_texts(model, texts: List[str], batch_size: int = 32):
+    """Normalized float32 embeddings (one row per text), so dot product = cosine similarity"""
+    return model.encode(
+        texts, batch_size=batch_size, normalize_embeddings=True,
+        convert_to_numpy=True, show_progress_bar=False
+    ).astype("float32")
+
+
+def embedding_dimension(model) -> Optional[int]:
+    """Output dimension of the model"""
+    return model.get_sentence_embedding_dimension() if model is not None else None
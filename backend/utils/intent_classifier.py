@@ -0,0 +1,62 @@
+"""
+Intent Classifier
+Nhận diện intent bằng các rule đã compile sẵn (theo thứ tự ưu tiên) thay vì
+gọi re.search trên chuỗi regex thô cho từng pattern ở mỗi tin nhắn
+"""
+
+import re
+from typing import List, Optional, Sequence, Tuple
+
+# A pattern made only of plain words joined by "|" (optionally wrapped in one group)
+_LITERAL_ALTERNATION_RE = re.compile(r'^\(?([^\\.*+?\[\]{}()^$|]+(?:\|[^\\.*+?\[\]{}()^$|]+)*)\)?$')
+
+
+class IntentClassifier:
+    """
+    Priority-ordered intent classifier
+
+    Patterns are prepared once:
+    - pure literal alternations such as "(mở camera|bật camera)" become
+      substring checks (texts are expected lowercased)
+    - everything else is compiled once with the shared flags
+
+    classify() walks the rules in priority order and stops at the first hit,
+    which reproduces looping over the patterns dict and returning on the first
+    re.search match. A single combined alternation / lookahead regex was
+    measured slower with Python's backtracking `re` (no literal prefix
+    optimisation across alternatives), so rules stay separate.
+    """
+
+    def __init__(self, intents: Sequence[Tuple[str, List[str]]], flags: int = re.IGNORECASE):
+        """
+        Args:
+            intents: (intent, patterns) pairs, highest priority first. An intent may
+                appear more than once (e.g. a high-priority override and a regular entry).
+            flags: Regex flags shared by all patterns
+        """
+        self._rules: List[Tuple[str, Optional[Tuple[str, ...]], Optional[re.Pattern]]] = []
+        for intent, patterns in intents:
+            for pattern in patterns:
+                literal = _LITERAL_ALTERNATION_RE.match(pattern)
+                if literal:
+                    words = tuple(word.lower() for word in literal.group(1).split('|'))
+                    self._rules.append((intent, words, None))
+                else:
+                    self._rules.append((intent, None, re.compile(pattern, flags)))
+
+    def classify(self, *texts: str) -> Optional[str]:
+        """
+        Return the highest-priority intent matching any of the texts, or None
+
+        Args:
+            *texts: Lowercased variants of the message (e.g. normalized and raw);
+                a rule matches if it matches any variant.
+        """
+        texts = tuple(text for text in texts if text)
+        for intent, words, regex in self._rules:
+            if words is not None:
+                if any(word in text for word in words for text in texts):
+                    return intent
+            elif any(regex.search(text) for text in texts):
+                return intent
+        return None
@@ -0,0 +1,109 @@
+"""
+Job Status Waiters
+Long-poll / SSE theo dõi OCR job: request được "đỗ" trên một waiter in-memory
+theo job_id và được đánh thức bởi notification bus (cùng nguồn event với /ws/ocr),
+thay vì query ocr_jobs mỗi lần client poll.
+"""
+
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("done", "failed")
+# Latest event kept per job (so a poll that arrives after the event returns at once)
+MAX_TRACKED_JOBS = int(os.getenv("JOB_STATUS_MAX_TRACKED", "10000"))
+
+
+class JobStatusWaiters:
+    """Per-job asyncio waiters woken by OCR job status events"""
+
+    def __init__(self, max_jobs: int = MAX_TRACKED_JOBS):
+        self.max_jobs = max_jobs
+        self._latest: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._waiters: Dict[str, Set[asyncio.Future]] = {}
+        self.events = 0
+        self.wakeups = 0
+        self.timeouts = 0
+
+    def attach_notification_bus(self, bus, loop: asyncio.AbstractEventLoop):
+        """Receive job events from the notification bus on this event loop"""
+        def on_event(event: Dict[str, Any]):
+            loop.call_soon_threadsafe(self.publish, event)
+
+        bus.subscribe(on_event)
+        logger.info("📡 Job status waiters subscribed to notification bus")
+
+    def publish(self, event: Dict[str, Any]):
+        """Record a bus event and wake every request waiting on its job (event loop only)"""
+        notification = event.get("notification") or {}
+        job_id = notification.get("job_id")
+        if notification.get("type") != "ocr_job_update" or not job_id:
+            return
+
+        job_id = str(job_id)
+        if event.get("id") is not None:
+            notification = {**notification, "seq": event["id"]}
+        self._latest[job_id] = notification
+        self._latest.move_to_end(job_id)
+        while len(self._latest) > self.max_jobs:
+            self._latest.popitem(last=False)
+        self.events += 1
+
+        for future in self._waiters.pop(job_id, ()):
+            if not future.done():
+                future.set_result(notification)
+                self.wakeups += 1
+
+    def latest(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Last event seen for a job, if any"""
+        return self._latest.get(str(job_id))
+
+    async def wait(self, job_id: str, known_status: Optional[str] = None,
+                   timeout: float = 25.0) -> Optional[Dict[str, Any]]:
+        """
+        Wait for the next status change of a job
+
+        Args:
+            job_id: OCR job id
+            known_status: Status the client already has; if the latest event
+                differs, it is returned immediately
+            timeout: Max seconds to wait
+
+        Returns:
+            The job event, or None on timeout
+        """
+        job_id = str(job_id)
+        latest = self._latest.get(job_id)
+        if latest is not None and known_status is not None and latest.get("status") != known_status:
+            return latest
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(job_id, set()).add(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return None
+        finally:
+            waiters = self._waiters.get(job_id)
+            if waiters is not None:
+                waiters.discard(future)
+                if not waiters:
+                    del self._waiters[job_id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "tracked_jobs": len(self._latest),
+            "waiting_requests": sum(len(waiters) for waiters in self._waiters.values()),
+            "events": self.events,
+            "wakeups": self.wakeups,
+            "timeouts": self.timeouts
+        }
+
+
+# Global instance (one per API process, fed by the notification bus)
+job_status_waiters = JobStatusWaiters()
@@ -0,0 +1,365 @@
+"""
+Notification Bus
+Cầu nối pub/sub giữa các process: worker.py publish trạng thái OCR job, mọi
+uvicorn worker subscribe và đẩy xuống các websocket đang kết nối.
+
+Backends:
+- postgres: ghi event vào bảng ocr_notifications rồi NOTIFY trong cùng
+  transaction; subscriber LISTEN trên một connection riêng
+- sqlite: bảng notification_events dùng chung trên cùng máy, subscriber poll theo id
+  (dùng khi chạy local không có PostgreSQL)
+
+Chọn backend bằng NOTIFICATION_BUS_BACKEND=postgres|sqlite
+(mặc định: postgres nếu DATABASE_URL là PostgreSQL, ngược lại sqlite)
+"""
+
+import json
+import os
+import select
+import sqlite3
+import threading
+import time
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import psycopg2
+    from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+except ImportError:
+    psycopg2 = None
+
+CHANNEL = os.getenv("NOTIFICATION_BUS_CHANNEL", "ocr_events")
+# PostgreSQL NOTIFY payloads must stay below 8000 bytes
+MAX_NOTIFY_PAYLOAD = 7900
+RECONNECT_DELAY = 2.0
+# Event log is bounded: events older than this are pruned (seconds)
+EVENT_RETENTION = float(os.getenv("NOTIFICATION_EVENT_RETENTION", "86400"))
+PRUNE_EVERY = 200
+# Max events returned by one replay
+REPLAY_LIMIT = int(os.getenv("NOTIFICATION_REPLAY_LIMIT", "200"))
+
+# Event delivered to subscribers: {"id": <sequence or None>, "user_id": str, "notification": dict}
+EventCallback = Callable[[Dict[str, Any]], None]
+
+
+class NotificationBus(ABC):
+    """Base class for notification buses"""
+
+    def __init__(self):
+        self._callbacks = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @abstractmethod
+    def publish(self, user_id: str, notification: Dict[str, Any]) -> Optional[int]:
+        """
+        Publish a notification for a user to every subscribed process
+
+        Returns:
+            Event sequence id when the backend assigns one
+        """
+
+    @abstractmethod
+    def replay(self, user_id: Optional[str] = None, job_ids: Optional[List[str]] = None,
+               after_id: int = 0, limit: int = REPLAY_LIMIT) -> List[Dict[str, Any]]:
+        """
+        Stored events of a user and/or jobs with id > after_id, oldest first
+
+        Used to resume a client that reconnects with its last-seen sequence.
+        """
+
+    def subscribe(self, callback: EventCallback):
+        """
+        Register a callback and start the listener thread
+
+        The callback runs in the listener thread; hand events over to the
+        event loop with loop.call_soon_threadsafe / run_coroutine_threadsafe.
+        """
+        self._callbacks.append(callback)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._listen, name="notification-bus", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Stop the listener thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    @abstractmethod
+    def _listen(self):
+        """Listener thread body: deliver events to _dispatch until _stop is set"""
+
+    def _dispatch(self, event: Dict[str, Any]):
+        for callback in self._callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error(f"❌ Notification callback failed: {e}")
+
+
+class PostgresNotificationBus(NotificationBus):
+    """LISTEN/NOTIFY bus; events are also kept in ocr_notifications (id = sequence)"""
+
+    def __init__(self, dsn: str):
+        if psycopg2 is None:
+            raise RuntimeError("psycopg2 is required for the postgres notification bus")
+        super().__init__()
+        self.dsn = dsn
+        self._publish_conn = None
+        self._publish_lock = threading.Lock()
+
+    def publish(self, user_id: str, notification: Dict[str, Any]) -> Optional[int]:
+        event = {"user_id": user_id, "notification": notification}
+        message = json.dumps(event, ensure_ascii=False, default=str)
+        job_id = notification.get("job_id")
+
+        with self._publish_lock:
+            for attempt in range(2):
+                try:
+                    if self._publish_conn is None or self._publish_conn.closed:
+                        self._publish_conn = psycopg2.connect(self.dsn)
+                    with self._publish_conn.cursor() as cursor:
+                        event_id = None
+                        if job_id:
+                            cursor.execute("""
+                                INSERT INTO ocr_notifications (job_id, user_id, event_type, message)
+                                VALUES (%s, %s, %s, %s)
+                                RETURNING id
+                            """, (job_id, user_id, notification.get("status") or notification.get("type"), message))
+                            event_id = cursor.fetchone()[0]
+                            if event_id % PRUNE_EVERY == 0:
+                                cursor.execute(
+                                    "DELETE FROM ocr_notifications WHERE created_at < now() - make_interval(secs => %s)",
+                                    (EVENT_RETENTION,)
+                                )
+
+                        payload = json.dumps({"id": event_id, **event}, ensure_ascii=False, default=str)
+                        if len(payload.encode("utf-8")) > MAX_NOTIFY_PAYLOAD and event_id is not None:
+                            # Too large for NOTIFY: subscribers read the stored row
+                            payload = json.dumps({"id": event_id, "user_id": user_id})
+                        cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, payload))
+                    # NOTIFY is delivered on commit, together with the stored row
+                    self._publish_conn.commit()
+                    return event_id
+                except Exception as e:
+                    logger.warning(f"⚠️ Notification publish failed (attempt {attempt + 1}): {e}")
+                    self._reset_publish_conn()
+        logger.error(f"❌ Could not publish notification for {user_id}")
+        return None
+
+    def replay(self, user_id: Optional[str] = None, job_ids: Optional[List[str]] = None,
+               after_id: int = 0, limit: int = REPLAY_LIMIT) -> List[Dict[str, Any]]:
+        conditions, params = [], []
+        if user_id:
+            conditions.append("user_id = %s")
+            params.append(user_id)
+        if job_ids:
+            conditions.append("job_id::text = ANY(%s)")
+            params.append(list(job_ids))
+        if not conditions:
+            return []
+
+        conn = None
+        try:
+            conn = psycopg2.connect(self.dsn)
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT id, message FROM ocr_notifications
+                    WHERE id > %s AND ({" OR ".join(conditions)})
+                    ORDER BY id
+                    LIMIT %s
+                """, (after_id, *params, limit))
+                return [{"id": row[0], **json.loads(row[1])} for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"❌ Notification replay failed: {e}")
+            return []
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _reset_publish_conn(self):
+        try:
+            if self._publish_conn is not None:
+                self._publish_conn.close()
+        except Exception:
+            pass
+        self._publish_conn = None
+
+    def _listen(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL}")
+                logger.info(f"👂 Listening for notifications on channel '{CHANNEL}'")
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._handle_payload(conn, conn.notifies.pop(0).payload)
+            except Exception as e:
+                logger.error(f"❌ Notification listener error: {e}")
+                self._stop.wait(RECONNECT_DELAY)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _handle_payload(self, conn, payload: str):
+        event = json.loads(payload)
+        if "notification" not in event and event.get("id") is not None:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT message FROM ocr_notifications WHERE id = %s", (event["id"],))
+                row = cursor.fetchone()
+            if row is None:
+                return
+            event = {"id": event["id"], **json.loads(row[0])}
+        self._dispatch(event)
+
+
+class SQLiteNotificationBus(NotificationBus):
+    """Polling bus over a shared SQLite table (single host, no PostgreSQL)"""
+
+    def __init__(self, db_path: str, poll_interval: float = 0.25, retention: float = EVENT_RETENTION):
+        super().__init__()
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._publishes = 0
+        self._init_table()
+        logger.info(f"Using SQLite notification bus: {self.db_path}")
+
+    def connect(self):
+        """Get SQLite connection"""
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _init_table(self):
+        conn = self.connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS notification_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    job_id TEXT,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_notification_events_user_id ON notification_events (user_id, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_notification_events_job_id ON notification_events (job_id, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_notification_events_created_at ON notification_events (created_at)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def publish(self, user_id: str, notification: Dict[str, Any]) -> Optional[int]:
+        try:
+            conn = self.connect()
+            try:
+                cursor = conn.execute(
+                    "INSERT INTO notification_events (user_id, job_id, payload, created_at) VALUES (?, ?, ?, ?)",
+                    (user_id, notification.get("job_id"),
+                     json.dumps(notification, ensure_ascii=False, default=str), time.time())
+                )
+                event_id = cursor.lastrowid
+                self._publishes += 1
+                if self._publishes % PRUNE_EVERY == 0:
+                    conn.execute("DELETE FROM notification_events WHERE created_at < ?", (time.time() - self.retention,))
+                conn.commit()
+                return event_id
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"❌ Could not publish notification for {user_id}: {e}")
+            return None
+
+    def replay(self, user_id: Optional[str] = None, job_ids: Optional[List[str]] = None,
+               after_id: int = 0, limit: int = REPLAY_LIMIT) -> List[Dict[str, Any]]:
+        conditions, params = [], []
+        if user_id:
+            conditions.append("user_id = ?")
+            params.append(user_id)
+        if job_ids:
+            conditions.append(f"job_id IN ({', '.join('?' for _ in job_ids)})")
+            params.extend(job_ids)
+        if not conditions:
+            return []
+
+        try:
+            conn = self.connect()
+            try:
+                rows = conn.execute(f"""
+                    SELECT id, user_id, payload FROM notification_events
+                    WHERE id > ? AND ({" OR ".join(conditions)})
+                    ORDER BY id
+                    LIMIT ?
+                """, (after_id, *params, limit)).fetchall()
+            finally:
+                conn.close()
+            return [
+                {"id": event_id, "user_id": event_user_id, "notification": json.loads(payload)}
+                for event_id, event_user_id, payload in rows
+            ]
+        except Exception as e:
+            logger.error(f"❌ Notification replay failed: {e}")
+            return []
+
+    def _listen(self):
+        last_id = None
+        while not self._stop.is_set():
+            try:
+                conn = self.connect()
+                try:
+                    if last_id is None:
+                        # Only deliver events published after subscribing
+                        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM notification_events").fetchone()[0]
+                    rows = conn.execute(
+                        "SELECT id, user_id, payload FROM notification_events WHERE id > ? ORDER BY id",
+                        (last_id,)
+                    ).fetchall()
+                finally:
+                    conn.close()
+                for event_id, user_id, payload in rows:
+                    last_id = event_id
+                    self._dispatch({"id": event_id, "user_id": user_id, "notification": json.loads(payload)})
+            except Exception as e:
+                logger.error(f"❌ Notification poll error: {e}")
+            self._stop.wait(self.poll_interval)
+
+
+_notification_bus: Optional[NotificationBus] = None
+_notification_bus_lock = threading.Lock()
+
+
+def get_notification_bus() -> NotificationBus:
+    """Get the process-wide notification bus (backend from NOTIFICATION_BUS_BACKEND)"""
+    global _notification_bus
+    if _notification_bus is None:
+        with _notification_bus_lock:
+            if _notification_bus is None:
+                database_url = os.getenv("DATABASE_URL", "")
+                default_backend = "postgres" if database_url.startswith("postgres") else "sqlite"
+                backend = os.getenv("NOTIFICATION_BUS_BACKEND", default_backend).lower()
+                if backend == "postgres":
+                    try:
+                        _notification_bus = PostgresNotificationBus(database_url)
+                    except Exception as e:
+                        logger.error(f"❌ Postgres notification bus unavailable, using SQLite: {e}")
+                if _notification_bus is None:
+                    db_path = os.getenv("NOTIFICATION_BUS_PATH", "chatbot.db")
+                    _notification_bus = SQLiteNotificationBus(
+                        db_path, poll_interval=float(os.getenv("NOTIFICATION_BUS_POLL_MS", "250")) / 1000
+                    )
+    return _notification_bus
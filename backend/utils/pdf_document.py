@@ -0,0 +1,63 @@
+"""
+PDF Document
+Đọc hóa đơn PDF nhiều trang bằng PyMuPDF: lấy text layer có sẵn của từng trang,
+render các trang không có text (bản scan) ra ảnh ở PDF_OCR_DPI để OCR.
+"""
+
+import os
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", "300"))
+# A page whose text layer has fewer characters is treated as scanned and OCRed
+TEXT_LAYER_MIN_CHARS = int(os.getenv("PDF_TEXT_LAYER_MIN_CHARS", "30"))
+MAX_PDF_PAGES = int(os.getenv("PDF_MAX_PAGES", "50"))
+
+
+def is_pdf(filepath: str) -> bool:
+    """Check the %PDF- signature (extensions of uploads are not trusted)"""
+    try:
+        with open(filepath, "rb") as f:
+            return f.read(5) == b"%PDF-"
+    except OSError:
+        return False
+
+
+def _open(filepath: str):
+    if fitz is None:
+        raise RuntimeError("PDF support requires PyMuPDF (pip install PyMuPDF)")
+    return fitz.open(filepath)
+
+
+def page_texts(filepath: str, max_pages: int = MAX_PDF_PAGES) -> List[Optional[str]]:
+    """
+    Text layer of each page
+
+    Returns:
+        One entry per page (up to max_pages): the embedded text, or None when
+        the page has no usable text layer and must be OCRed
+    """
+    with _open(filepath) as document:
+        if document.page_count > max_pages:
+            logger.warning(f"⚠️ PDF has {document.page_count} pages, only the first {max_pages} are read")
+        texts = []
+        for page in document.pages(0, min(document.page_count, max_pages)):
+            text = page.get_text("text") or ""
+            texts.append(text if len(text.strip()) >= TEXT_LAYER_MIN_CHARS else None)
+        return texts
+
+
+def render_page(filepath: str, page_index: int, dpi: int = PDF_OCR_DPI):
+    """Rasterize one page to a grayscale PIL image for Tesseract"""
+    from PIL import Image
+
+    with _open(filepath) as document:
+        pixmap = document[page_index].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+        return Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
@@ -0,0 +1,129 @@
+"""
+Chat Response Cache
+Cache câu trả lời cho các intent tĩnh/gần tĩnh (chào hỏi, trợ giúp, hướng dẫn...)
+theo tin nhắn đã chuẩn hóa, với TTL riêng cho từng intent. Intent phụ thuộc dữ
+liệu (danh sách/chi tiết hóa đơn, file, câu hỏi chung) luôn bỏ qua cache.
+"""
+
+import copy
+import os
+import re
+import unicodedata
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from utils.intent_classifier import IntentClassifier
+from utils.tool_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# TTL (seconds) per cacheable intent; override with RESPONSE_CACHE_TTL_<INTENT>
+DEFAULT_INTENT_TTLS = {
+    'greeting': 3600,
+    'goodbye': 3600,
+    'help': 3600,
+    'upload_image': 1800,
+    'camera_control': 1800,
+}
+
+# Answers built from invoice data, uploaded files or the conversation - never cached
+# (template_help is answered by the AI model from the user's context)
+BYPASS_INTENTS = frozenset({
+    'list_invoices', 'invoice_detail', 'invoice_query', 'data_query',
+    'invoice_analysis', 'file_analysis', 'template_help', 'general'
+})
+
+# Whole-message patterns for generic questions (matched on normalized text).
+# Used by handlers without their own intent detection, e.g. the Groq handler.
+GENERIC_INTENT_PATTERNS = [
+    ('greeting', [
+        r'^(xin )?(chào|chao|hello|hi|hey|alo)( bạn| ban| bot| em| anh| chị)?$',
+        r'^(good (morning|afternoon|evening)|chào buổi (sáng|chiều|tối))$',
+    ]),
+    ('goodbye', [
+        r'^(tạm biệt|bye|goodbye|hẹn gặp lại)( bạn)?$',
+        r'^(cảm ơn|cám ơn|thanks|thank you)( bạn)?( nhiều)?$',
+    ]),
+    ('help', [
+        r'^(help|trợ giúp|hướng dẫn|hướng dẫn sử dụng|giúp tôi|giúp tôi với)$',
+        r'^(bạn )?(có thể làm gì|làm được gì|làm gì được|giúp gì được)( cho tôi)?$',
+        r'^what can you do$',
+    ]),
+]
+GENERIC_INTENT_CLASSIFIER = IntentClassifier(GENERIC_INTENT_PATTERNS)
+
+
+def normalize_message(message: str) -> str:
+    """Chuẩn hóa tin nhắn làm cache key: NFC, chữ thường, bỏ dấu câu và khoảng trắng thừa"""
+    if not message:
+        return ""
+    text = unicodedata.normalize('NFC', message).lower()
+    text = _PUNCTUATION_RE.sub(' ', text)
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+class ResponseCache:
+    """
+    Normalized-message response cache with per-intent TTLs
+
+    Keys are (namespace, intent, normalized message); each handler uses its own
+    namespace since reply formats differ. Responses are copied on the way in
+    and out, so callers may add per-request fields (sentiment, timestamps).
+    """
+
+    def __init__(self, intent_ttls: Dict[str, float] = None, maxsize: int = 1024, enabled: bool = True):
+        self.intent_ttls = dict(intent_ttls or DEFAULT_INTENT_TTLS)
+        self.enabled = enabled
+        self._cache = TTLCache(maxsize=maxsize, ttl=max(self.intent_ttls.values(), default=60))
+
+    def cacheable(self, intent: Optional[str]) -> bool:
+        """Whether responses for this intent may be cached"""
+        return self.enabled and intent in self.intent_ttls and intent not in BYPASS_INTENTS
+
+    def get(self, namespace: str, intent: Optional[str], message: str) -> Optional[Dict[str, Any]]:
+        """Cached response for the message, or None"""
+        if not self.cacheable(intent):
+            return None
+        response = self._cache.get((namespace, intent, normalize_message(message)))
+        if response is None:
+            return None
+        logger.debug(f"Response cache hit: {namespace}/{intent}")
+        response = copy.deepcopy(response)
+        response['cached'] = True
+        if 'timestamp' in response:
+            response['timestamp'] = datetime.now().isoformat()
+        return response
+
+    def set(self, namespace: str, intent: Optional[str], message: str, response: Dict[str, Any]):
+        """Store a response (ignored for non-cacheable intents and error replies)"""
+        if not self.cacheable(intent) or not response or response.get('type') == 'error':
+            return
+        key = (namespace, intent, normalize_message(message))
+        self._cache.set(key, copy.deepcopy(response), ttl=self.intent_ttls[intent])
+
+    def clear(self):
+        """Drop all cached responses"""
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters"""
+        return {**self._cache.stats(), "enabled": self.enabled, "intent_ttls": self.intent_ttls}
+
+
+def _intent_ttls_from_env() -> Dict[str, float]:
+    return {
+        intent: float(os.getenv(f"RESPONSE_CACHE_TTL_{intent.upper()}", str(ttl)))
+        for intent, ttl in DEFAULT_INTENT_TTLS.items()
+    }
+
+
+# Global instance
+response_cache = ResponseCache(
+    intent_ttls=_intent_ttls_from_env(),
+    maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "1024")),
+    enabled=os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+)
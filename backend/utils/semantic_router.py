@@ -0,0 +1,196 @@
+"""
+Semantic Intent Router
+Định tuyến intent bằng embedding câu (chạy local trên CPU) + index vector nhỏ
+gồm các câu ví dụ đã gán nhãn. Intent chắc chắn được trả lời ngay tại chỗ,
+câu mơ hồ trả về None để chuyển tiếp cho LLM.
+
+Model được nạp trong thread nền (vài giây lần đầu) nên không chặn startup;
+trong lúc đó router chưa available và mọi câu đều chuyển cho LLM.
+Đo latency: python scripts/benchmark_semantic_router.py
+"""
+
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from utils.embeddings import get_embedding_model, embed_texts, DEFAULT_EMBEDDING_MODEL
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = os.getenv("SEMANTIC_ROUTER_MODEL", DEFAULT_EMBEDDING_MODEL)
+# Minimum cosine similarity of the best example, and minimum lead over the next intent
+DEFAULT_THRESHOLD = float(os.getenv("SEMANTIC_ROUTER_THRESHOLD", "0.80"))
+DEFAULT_MARGIN = float(os.getenv("SEMANTIC_ROUTER_MARGIN", "0.05"))
+
+# Labeled example utterances per intent (intents without a local answer, e.g.
+# export_to_excel, still need examples so they are not mistaken for another one)
+INTENT_EXAMPLES: Dict[str, List[str]] = {
+    "greeting": [
+        "xin chào", "chào bạn", "chào", "hello", "hi", "hey", "alo",
+        "chào buổi sáng", "chào buổi tối", "good morning",
+    ],
+    "goodbye": [
+        "tạm biệt", "bye", "goodbye", "hẹn gặp lại", "cảm ơn bạn", "cảm ơn nhiều", "thanks", "thank you",
+    ],
+    "help": [
+        "bạn có thể làm gì", "bạn làm được gì", "hướng dẫn sử dụng", "giúp tôi với",
+        "tôi cần hỗ trợ", "what can you do", "help",
+    ],
+    "list_invoices": [
+        "danh sách hóa đơn", "xem danh sách hóa đơn", "cho tôi xem các hóa đơn",
+        "liệt kê hóa đơn đã lưu", "hóa đơn đã lưu", "xem tất cả hóa đơn",
+        "show all invoices", "list invoices",
+    ],
+    "get_statistics": [
+        "thống kê hóa đơn", "báo cáo tổng quan", "có bao nhiêu hóa đơn", "tổng số hóa đơn",
+        "thống kê", "invoice statistics",
+    ],
+    "export_to_excel": [
+        "xuất excel", "xuất file excel", "export excel", "tải file excel hóa đơn",
+        "xuất hóa đơn ra excel", "export invoices to excel",
+    ],
+}
+
+
+@dataclass
+class RouteResult:
+    """Routing decision"""
+    intent: str
+    score: float
+    margin: float
+    elapsed_ms: float
+
+
+class SemanticIntentRouter:
+    """
+    Nearest-example intent router
+
+    Example utterances are embedded once into a normalized matrix; a message
+    is routed by dot product (cosine similarity) against it. A route is only
+    returned when the best example clears `threshold` and beats the best
+    example of any other intent by `margin` - otherwise None (escalate).
+
+    The model and example matrix load in a background thread unless
+    background=False; the router is unavailable until loading finishes.
+    """
+
+    def __init__(self, examples: Dict[str, List[str]] = None, model_name: str = DEFAULT_MODEL,
+                 threshold: float = DEFAULT_THRESHOLD, margin: float = DEFAULT_MARGIN,
+                 cache_size: int = 512, background: bool = True):
+        self.examples = examples or INTENT_EXAMPLES
+        self.model_name = model_name
+        self.threshold = threshold
+        self.margin = margin
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Optional[RouteResult]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._matrix = None
+        self._labels: List[str] = []
+        self.model = None
+        self.load_seconds: Optional[float] = None
+        self._ready = threading.Event()
+
+        if background:
+            threading.Thread(target=self._load, name="semantic-router-load", daemon=True).start()
+        else:
+            self._load()
+
+    def _load(self):
+        """Load the model and embed the examples; the router becomes available at the end"""
+        started = time.perf_counter()
+        try:
+            model = get_embedding_model(self.model_name)
+            if model is None:
+                logger.info("ℹ️ Embedding model unavailable - semantic router disabled")
+                return
+
+            texts, labels = [], []
+            for intent, utterances in self.examples.items():
+                for utterance in utterances:
+                    texts.append(utterance)
+                    labels.append(intent)
+            self._labels = labels
+            self._matrix = embed_texts(model, texts)
+            self.model = model  # set last: route() needs the matrix
+            self.load_seconds = time.perf_counter() - started
+            logger.info(f"✅ Semantic router ready: {len(texts)} examples, {len(self.examples)} intents "
+                        f"({self.load_seconds:.1f}s)")
+        except Exception as e:
+            logger.warning(f"⚠️ Semantic router disabled: {e}")
+        finally:
+            self._ready.set()
+
+    @property
+    def available(self) -> bool:
+        return self.model is not None
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """Block until background loading finished; returns whether the router is available"""
+        self._ready.wait(timeout)
+        return self.available
+
+    def _embed(self, texts: List[str]):
+        return embed_texts(self.model, texts)
+
+    def route(self, message: str) -> Optional[RouteResult]:
+        """
+        Route a message to an intent
+
+        Returns:
+            RouteResult for a confident match, None when ambiguous or unavailable
+        """
+        if not self.available or not message:
+            return None
+
+        key = message.strip().lower()
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        started = time.perf_counter()
+        scores = self._matrix @ self._embed([key])[0]
+
+        # Best score per intent
+        best: Dict[str, float] = {}
+        for label, score in zip(self._labels, scores):
+            if score > best.get(label, -1.0):
+                best[label] = float(score)
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        intent, score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else -1.0
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        result = None
+        if score >= self.threshold and score - runner_up >= self.margin:
+            result = RouteResult(intent=intent, score=score, margin=score - runner_up, elapsed_ms=elapsed_ms)
+        logger.debug(f"Semantic route '{key[:50]}': {intent} {score:.2f} (+{score - runner_up:.2f}) "
+                     f"{'local' if result else 'escalate'} in {elapsed_ms:.1f}ms")
+
+        with self._cache_lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+
+_semantic_router: Optional[SemanticIntentRouter] = None
+_semantic_router_lock = threading.Lock()
+
+
+def get_semantic_router() -> SemanticIntentRouter:
+    """Get the process-wide router (model loads once, in the background; SEMANTIC_ROUTER_ENABLED=false disables it)"""
+    global _semantic_router
+    if _semantic_router is None:
+        with _semantic_router_lock:
+            if _semantic_router is None:
+                if os.getenv("SEMANTIC_ROUTER_ENABLED", "true").lower() == "true":
+                    _semantic_router = SemanticIntentRouter()
+                else:
+                    _semantic_router = SemanticIntentRouter(model_name="", background=False)
+    return _semantic_router
@@ -0,0 +1,351 @@
+"""
+Session Store
+Bộ nhớ hội thoại/phiên dùng chung cho các chat handlers, có giới hạn:
+- số item tối đa mỗi user (per-user cap)
+- xóa phiên không hoạt động sau idle TTL
+- LRU bound trên tổng số phiên
+
+Backends:
+- memory: trong process (mặc định)
+- sqlite: bảng chat_sessions dùng chung giữa các uvicorn workers trên cùng máy
+
+Chọn backend bằng SESSION_STORE_BACKEND=memory|sqlite
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SESSIONS = int(os.getenv("SESSION_STORE_MAX_SESSIONS", "1000"))
+DEFAULT_IDLE_TTL = float(os.getenv("SESSION_STORE_IDLE_TTL", "3600"))
+# Hard upper bound on list length, on top of the cap each handler passes
+DEFAULT_MAX_ITEMS = int(os.getenv("SESSION_STORE_MAX_ITEMS", "100"))
+
+
+class SessionStore(ABC):
+    """
+    Base class for session stores
+
+    Values are stored per (namespace, user_id); each handler uses its own
+    namespace (e.g. "groq_history", "groq_ocr"). Values must be JSON-serializable
+    so they can live in a shared backend.
+    """
+
+    def __init__(self, max_sessions: int = DEFAULT_MAX_SESSIONS, idle_ttl: float = DEFAULT_IDLE_TTL,
+                 max_items: int = DEFAULT_MAX_ITEMS):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_items = max_items
+
+    @abstractmethod
+    def get(self, namespace: str, user_id: str, default: Any = None) -> Any:
+        """Get a session value, or default if missing/expired"""
+
+    @abstractmethod
+    def set(self, namespace: str, user_id: str, value: Any):
+        """Store a session value"""
+
+    @abstractmethod
+    def delete(self, namespace: str, user_id: str):
+        """Drop a session"""
+
+    @abstractmethod
+    def append(self, namespace: str, user_id: str, *items: Any, max_items: Optional[int] = None) -> List[Any]:
+        """
+        Atomically append items to a list session, keeping only the last max_items
+
+        Returns:
+            The updated list
+        """
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Size and limits of the store"""
+
+    def get_list(self, namespace: str, user_id: str) -> List[Any]:
+        """Get a list session value (empty list if missing)"""
+        value = self.get(namespace, user_id)
+        return list(value) if isinstance(value, list) else []
+
+    def _cap(self, max_items: Optional[int]) -> int:
+        """Effective list cap: the caller's, bounded by the global per-user cap"""
+        return min(max_items or self.max_items, self.max_items)
+
+    def _trim(self, value: Any) -> Any:
+        """Apply the global per-user cap to list values"""
+        if isinstance(value, list) and len(value) > self.max_items:
+            return value[-self.max_items:]
+        return value
+
+
+class InMemorySessionStore(SessionStore):
+    """Per-process store: OrderedDict LRU with idle expiry"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._data: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, namespace: str, user_id: str, default: Any = None) -> Any:
+        key = (namespace, str(user_id))
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+
+            last_access, value = entry
+            now = time.monotonic()
+            if now - last_access > self.idle_ttl:
+                del self._data[key]
+                self.evictions += 1
+                return default
+
+            self._data[key] = (now, value)
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, namespace: str, user_id: str, value: Any):
+        key = (namespace, str(user_id))
+        with self._lock:
+            self._data[key] = (time.monotonic(), self._trim(value))
+            self._data.move_to_end(key)
+            self._evict_locked()
+
+    def delete(self, namespace: str, user_id: str):
+        with self._lock:
+            self._data.pop((namespace, str(user_id)), None)
+
+    def append(self, namespace: str, user_id: str, *items: Any, max_items: Optional[int] = None) -> List[Any]:
+        key = (namespace, str(user_id))
+        with self._lock:
+            now = time.monotonic()
+            entry = self._data.get(key)
+            current = []
+            if entry is not None and now - entry[0] <= self.idle_ttl and isinstance(entry[1], list):
+                current = entry[1]
+            values = (current + list(items))[-self._cap(max_items):]
+            self._data[key] = (now, values)
+            self._data.move_to_end(key)
+            self._evict_locked()
+            return values
+
+    def _evict_locked(self):
+        """Drop idle sessions from the LRU end, then enforce max_sessions"""
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._data:
+            key, (last_access, _) = next(iter(self._data.items()))
+            if last_access >= cutoff and len(self._data) <= self.max_sessions:
+                break
+            del self._data[key]
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "sessions": len(self._data),
+            "max_sessions": self.max_sessions,
+            "idle_ttl": self.idle_ttl,
+            "max_items": self.max_items,
+            "evictions": self.evictions
+        }
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Shared store backed by a SQLite table
+
+    Every uvicorn worker on the host sees the same sessions. Reads do not
+    write: updated_at (idle expiry and LRU order) moves on set/append only.
+    Idle/LRU eviction runs every `evict_every` writes.
+    """
+
+    def __init__(self, db_path: str, evict_every: int = 50, **kwargs):
+        super().__init__(**kwargs)
+        self.db_path = db_path
+        self.evict_every = evict_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._init_table()
+        logger.info(f"Using SQLite session store: {self.db_path}")
+
+    def connect(self):
+        """Get SQLite connection"""
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _init_table(self):
+        conn = self.connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chat_sessions (
+                    namespace TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, user_id)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated_at ON chat_sessions (updated_at)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get(self, namespace: str, user_id: str, default: Any = None) -> Any:
+        try:
+            conn = self.connect()
+            try:
+                row = self._select_row(conn, namespace, user_id)
+                return default if row is None else json.loads(row[0])
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"❌ Session store read failed: {e}")
+            return default
+
+    def set(self, namespace: str, user_id: str, value: Any):
+        try:
+            conn = self.connect()
+            try:
+                self._upsert(conn, namespace, user_id, value)
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"❌ Session store write failed: {e}")
+            return
+        self._count_write()
+
+    def append(self, namespace: str, user_id: str, *items: Any, max_items: Optional[int] = None) -> List[Any]:
+        values = list(items)[-self._cap(max_items):]
+        try:
+            conn = self.connect()
+            try:
+                # Read-modify-write in one IMMEDIATE transaction (write lock taken
+                # before the read), so concurrent workers never lose an append
+                conn.isolation_level = None
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self._select_row(conn, namespace, user_id)
+                    current = json.loads(row[0]) if row is not None else []
+                    if isinstance(current, list):
+                        values = (current + list(items))[-self._cap(max_items):]
+                    self._upsert(conn, namespace, user_id, values)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"❌ Session store append failed: {e}")
+            return values
+        self._count_write()
+        return values
+
+    def _select_row(self, conn, namespace: str, user_id: str):
+        """Row (data,) of a live session on the caller's connection, or None if missing/idle-expired"""
+        return conn.execute(
+            "SELECT data FROM chat_sessions WHERE namespace = ? AND user_id = ? AND updated_at >= ?",
+            (namespace, str(user_id), time.time() - self.idle_ttl)
+        ).fetchone()
+
+    def _upsert(self, conn, namespace: str, user_id: str, value: Any):
+        data = json.dumps(self._trim(value), ensure_ascii=False, default=str)
+        conn.execute("""
+            INSERT INTO chat_sessions (namespace, user_id, data, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(namespace, user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+        """, (namespace, str(user_id), data, time.time()))
+
+    def _count_write(self):
+        """Run eviction every evict_every writes"""
+        with self._lock:
+            self._writes += 1
+            due = self._writes % self.evict_every == 0
+        if due:
+            self.evict()
+
+    def delete(self, namespace: str, user_id: str):
+        try:
+            conn = self.connect()
+            try:
+                conn.execute("DELETE FROM chat_sessions WHERE namespace = ? AND user_id = ?", (namespace, str(user_id)))
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"❌ Session store delete failed: {e}")
+
+    def evict(self) -> int:
+        """Delete idle sessions and the least recently used beyond max_sessions"""
+        try:
+            conn = self.connect()
+            try:
+                cursor = conn.execute("DELETE FROM chat_sessions WHERE updated_at < ?", (time.time() - self.idle_ttl,))
+                deleted = cursor.rowcount
+                cursor = conn.execute("""
+                    DELETE FROM chat_sessions WHERE rowid IN (
+                        SELECT rowid FROM chat_sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_sessions,))
+                deleted += cursor.rowcount
+                conn.commit()
+                if deleted:
+                    logger.info(f"🧹 Evicted {deleted} chat sessions")
+                return deleted
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"❌ Session store eviction failed: {e}")
+            return 0
+
+    def stats(self) -> Dict[str, Any]:
+        sessions = 0
+        try:
+            conn = self.connect()
+            try:
+                sessions = conn.execute("SELECT COUNT(*) FROM chat_sessions").fetchone()[0]
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"❌ Session store stats failed: {e}")
+        return {
+            "backend": "sqlite",
+            "sessions": sessions,
+            "max_sessions": self.max_sessions,
+            "idle_ttl": self.idle_ttl,
+            "max_items": self.max_items
+        }
+
+
+_session_store: Optional[SessionStore] = None
+_session_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """Get the process-wide session store (backend from SESSION_STORE_BACKEND)"""
+    global _session_store
+    if _session_store is None:
+        with _session_store_lock:
+            if _session_store is None:
+                backend = os.getenv("SESSION_STORE_BACKEND", "memory").lower()
+                if backend == "sqlite":
+                    db_path = os.getenv("SESSION_STORE_PATH", "chatbot.db")
+                    try:
+                        _session_store = SQLiteSessionStore(db_path)
+                    except Exception as e:
+                        logger.error(f"❌ SQLite session store unavailable, using memory: {e}")
+                        _session_store = InMemorySessionStore()
+                else:
+                    _session_store = InMemorySessionStore()
+    return _session_store
@@ -2,6 +2,10 @@ import re
 import unicodedata
 from typing import List, Dict, Any
 
+# Precompiled regexes for normalize() (called on every chat message)
+_WHITESPACE_RE = re.compile(r'\s+')
+_SPECIAL_CHARS_RE = re.compile(r'[^\w\sàáạảãâầấậẩẫăằắặẳẵèéẹẻẽêềếệểễìíịỉĩòóọỏõôồốộổỗơờớợởỡùúụủũưừứựửữỳýỵỷỹđ]')
+
 class TextProcessor:
     def __init__(self):
         # Vietnamese stopwords
@@ -20,6 +24,8 @@ class TextProcessor:
             'tnhh': 'trách nhiệm hữu hạn',
             'cp': 'cổ phần'
         }
+        # All abbreviations expanded in one pass
+        self._abbreviation_re = re.compile(r'\b(' + '|'.join(map(re.escape, self.abbreviations)) + r')\b')
     
     def normalize(self, text: str) -> str:
         """Chuẩn hóa text đầu vào"""
@@ -27,20 +33,19 @@ class TextProcessor:
             return ""
         
         # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text.strip())
+        text = _WHITESPACE_RE.sub(' ', text.strip())
         
         # Convert to lowercase for processing (but keep original case)
         normalized = text.lower()
         
         # Expand abbreviations
-        for abbr, full in self.abbreviations.items():
-            normalized = re.sub(r'\b' + abbr + r'\b', full, normalized)
+        normalized = self._abbreviation_re.sub(lambda m: self.abbreviations[m.group(1)], normalized)
         
         # Remove special characters but keep Vietnamese characters
-        normalized = re.sub(r'[^\w\sàáạảãâầấậẩẫăằắặẳẵèéẹẻẽêềếệểễìíịỉĩòóọỏõôồốộổỗơờớợởỡùúụủũưừứựửữỳýỵỷỹđ]', ' ', normalized)
+        normalized = _SPECIAL_CHARS_RE.sub(' ', normalized)
         
         # Remove extra spaces again
-        normalized = re.sub(r'\s+', ' ', normalized).strip()
+        normalized = _WHITESPACE_RE.sub(' ', normalized).strip()
         
         return normalized
     
@@ -0,0 +1,39 @@
+"""
+Token Counter
+Đếm token cho prompt gửi tới LLM (dùng để log và giới hạn kích thước prompt)
+"""
+
+import logging
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# tiktoken is optional - fall back to a byte-length heuristic when missing
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception as e:
+    logger.debug(f"tiktoken not available, using heuristic token count: {e}")
+    _encoding = None
+
+# Per-message overhead (role + separators) in chat formats
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count tokens in a string
+
+    Uses tiktoken when installed, otherwise ~4 UTF-8 bytes per token
+    (Vietnamese diacritics take 2-3 bytes, so bytes track tokens better than chars)
+    """
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return max(1, len(text.encode('utf-8')) // 4)
+
+
+def count_message_tokens(messages: List[Dict]) -> int:
+    """Count tokens for a list of chat messages ({"role", "content"})"""
+    return sum(count_tokens(msg.get('content') or '') + MESSAGE_OVERHEAD_TOKENS for msg in messages)
@@ -0,0 +1,103 @@
+"""
+Tool Result Cache
+LRU + TTL cache cho kết quả tools (đã serialize), gắn với version của bảng invoices
+"""
+
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class InvoiceDataVersion:
+    """
+    Monotonic version of the invoices table
+
+    Bumped after every invoice insert/update made through this process.
+    Cache keys include the version, so a bump invalidates every cached
+    result derived from invoice data.
+    """
+
+    def __init__(self):
+        self._version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def current(self) -> int:
+        """Current version"""
+        return self._version
+
+    def bump(self) -> int:
+        """Mark invoice data as changed, returns the new version"""
+        with self._lock:
+            self._version += 1
+            logger.debug(f"Invoice data version -> {self._version}")
+            return self._version
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ttl seconds"""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value, or default if missing/expired"""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value, evicting the least recently used entry when full"""
+        with self._lock:
+            self._data[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters"""
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+# Global instances
+invoice_data_version = InvoiceDataVersion()
+
+tool_result_cache = TTLCache(
+    maxsize=int(os.getenv("TOOL_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("TOOL_CACHE_TTL", "60"))
+)
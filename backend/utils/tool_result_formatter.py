@@ -0,0 +1,117 @@
+"""
+Tool Result Formatter
+Rút gọn kết quả tools trước khi đưa lại cho LLM: chỉ giữ các cột cần thiết,
+mã hóa danh sách hóa đơn dạng bảng và cắt theo ngân sách token (JSON luôn hợp lệ)
+"""
+
+import json
+import logging
+from typing import Any, Dict, List, Optional, Type
+
+from utils.token_counter import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Columns sent to the LLM for invoice lists (raw_text, items, addresses... are dropped)
+INVOICE_LIST_COLUMNS = [
+    "id", "invoice_code", "invoice_type", "buyer_name", "seller_name",
+    "total_amount", "invoice_date", "created_at"
+]
+
+# Fields never sent for a single invoice (large or UI-only duplicates)
+INVOICE_DETAIL_EXCLUDE = {
+    "raw_text", "filename", "confidence", "processed_at", "date", "image_path"
+}
+
+# Keys of tool results holding a list of invoices
+INVOICE_LIST_KEYS = ("invoices", "results")
+
+# Long string values are shortened to this many characters
+MAX_FIELD_CHARS = 120
+
+
+def _shorten(value: Any, max_chars: int = MAX_FIELD_CHARS) -> Any:
+    """Shorten long strings, leave other values untouched"""
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[:max_chars] + "…"
+    return value
+
+
+def _to_table(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Encode a list of invoice dicts as {"columns": [...], "rows": [[...], ...]}"""
+    columns = [col for col in INVOICE_LIST_COLUMNS if any(col in row for row in rows)]
+    return {
+        "columns": columns,
+        "rows": [[_shorten(row.get(col)) for col in columns] for row in rows]
+    }
+
+
+def _dumps(payload: Dict[str, Any], encoder: Type[json.JSONEncoder]) -> str:
+    """Compact JSON; ensure_ascii=False keeps Vietnamese text at its real token cost"""
+    return json.dumps(payload, cls=encoder, ensure_ascii=False, separators=(",", ":"))
+
+
+def compact_tool_result(result: Dict[str, Any], max_tokens: int,
+                        encoder: Optional[Type[json.JSONEncoder]] = None) -> str:
+    """
+    Serialize a tool result for the LLM within a token budget
+
+    - Invoice lists become a column/row table with only INVOICE_LIST_COLUMNS
+    - A single invoice drops INVOICE_DETAIL_EXCLUDE fields and long strings are shortened
+    - When over budget, trailing rows are dropped and "omitted" records how many
+
+    Args:
+        result: Tool result dict ({"success": ..., ...})
+        max_tokens: Token budget for the serialized result
+        encoder: JSON encoder class for Decimal/datetime values
+
+    Returns:
+        Well-formed JSON string
+    """
+    encoder = encoder or json.JSONEncoder
+    if not isinstance(result, dict):
+        return _dumps({"result": result}, encoder)
+
+    payload: Dict[str, Any] = {}
+    list_key = None
+    rows: List[Dict[str, Any]] = []
+    for key, value in result.items():
+        if key in INVOICE_LIST_KEYS and isinstance(value, list):
+            list_key = key
+            rows = [row for row in value if isinstance(row, dict)]
+        elif key == "invoice" and isinstance(value, dict):
+            payload[key] = {k: _shorten(v) for k, v in value.items() if k not in INVOICE_DETAIL_EXCLUDE}
+        else:
+            payload[key] = _shorten(value)
+
+    if list_key is None:
+        serialized = _dumps(payload, encoder)
+        if count_tokens(serialized) <= max_tokens:
+            return serialized
+        # No rows to drop - keep scalar fields only
+        scalars = {k: v for k, v in payload.items() if not isinstance(v, (dict, list))}
+        scalars["truncated"] = True
+        return _dumps(scalars, encoder)
+
+    def build(n: int) -> str:
+        body = dict(payload)
+        body[list_key] = _to_table(rows[:n])
+        if n < len(rows):
+            body["omitted"] = len(rows) - n
+        return _dumps(body, encoder)
+
+    serialized = build(len(rows))
+    if count_tokens(serialized) <= max_tokens:
+        return serialized
+
+    # Largest number of rows that still fits the budget
+    low, high = 0, len(rows) - 1
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(build(mid)) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+
+    logger.debug(f"Tool result trimmed to {low}/{len(rows)} rows for a {max_tokens}-token budget")
+    return build(low)
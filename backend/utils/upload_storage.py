@@ -0,0 +1,171 @@
+"""
+Upload Storage
+Ghi file upload xuống UPLOAD_DIR theo từng chunk (không đọc cả file vào RAM),
+tính SHA-256 và kiểm tra MAX_UPLOAD_SIZE ngay trong lúc ghi,
+giải nén zip hóa đơn thành từng file riêng cho OCR worker.
+"""
+
+import hashlib
+import os
+import shutil
+import uuid
+import zipfile
+import logging
+from typing import AsyncIterator, BinaryIO, List, NamedTuple, Optional, Tuple
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+# Per-file limit in bytes (settings.MAX_UPLOAD_SIZE is in MB)
+MAX_UPLOAD_SIZE = settings.MAX_UPLOAD_SIZE * 1024 * 1024
+ALLOWED_EXTENSIONS = ("jpg", "jpeg", "png", "pdf", "xml", "webp", "bmp", "tif", "tiff")
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadError(ValueError):
+    """Rejected upload (bad type, too large, corrupt archive)"""
+
+
+class UploadTooLarge(UploadError):
+    """Upload exceeds the size limit (HTTP 413)"""
+
+
+class StoredUpload(NamedTuple):
+    """File written to the upload store"""
+    path: str
+    size: int
+    sha256: str
+
+
+def file_extension(filename: str) -> str:
+    return os.path.splitext(filename or "")[1].lower().lstrip(".")
+
+
+def is_allowed_file(filename: str) -> bool:
+    return file_extension(filename) in ALLOWED_EXTENSIONS
+
+
+def is_zip_file(filename: str) -> bool:
+    return file_extension(filename) == "zip"
+
+
+def new_upload_path(filename: str, upload_dir: str = UPLOAD_DIR) -> str:
+    """Unique path in the upload dir, keeping the original extension"""
+    os.makedirs(upload_dir, exist_ok=True)
+    extension = file_extension(filename)
+    return os.path.join(upload_dir, f"{uuid.uuid4().hex}.{extension}" if extension else uuid.uuid4().hex)
+
+
+async def save_stream(chunks: AsyncIterator[bytes], filename: str, max_bytes: int = MAX_UPLOAD_SIZE,
+                      upload_dir: str = UPLOAD_DIR) -> StoredUpload:
+    """
+    Write an async stream of chunks to the upload dir
+
+    The SHA-256 and the size limit are computed while writing, so at most one
+    chunk is held in memory. Data goes to a .part file that is renamed once
+    complete; on any error the partial file is removed.
+
+    Raises:
+        UploadTooLarge: more than max_bytes received
+        UploadError: empty upload
+    """
+    filepath = new_upload_path(filename, upload_dir)
+    partial_path = filepath + ".part"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(partial_path, "wb") as out:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"{filename}: file exceeds {max_bytes // (1024 * 1024)}MB")
+                digest.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise UploadError(f"{filename}: file is empty")
+        os.replace(partial_path, filepath)
+    except BaseException:
+        remove_file(partial_path)
+        raise
+    return StoredUpload(filepath, size, digest.hexdigest())
+
+
+async def iter_upload_file(file, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Read an UploadFile in fixed-size chunks"""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def save_upload(file, max_bytes: int = MAX_UPLOAD_SIZE, upload_dir: str = UPLOAD_DIR) -> StoredUpload:
+    """
+    Stream an UploadFile to the upload dir (see save_stream)
+
+    A declared size above max_bytes is rejected before reading anything.
+    """
+    declared_size = getattr(file, "size", None)
+    if declared_size is not None and declared_size > max_bytes:
+        raise UploadTooLarge(f"{file.filename}: file exceeds {max_bytes // (1024 * 1024)}MB")
+    return await save_stream(iter_upload_file(file), file.filename, max_bytes, upload_dir)
+
+
+def extract_zip(fileobj: BinaryIO, max_files: int, max_bytes: int = MAX_UPLOAD_SIZE,
+                upload_dir: str = UPLOAD_DIR) -> Tuple[List[Tuple[str, str]], List[str]]:
+    """
+    Extract the invoice files of a zip archive into the upload dir
+
+    Members with unsupported extensions, directories and members larger than
+    max_bytes are skipped; nested paths are flattened to their base name.
+
+    Returns:
+        ([(filepath, filename)], [skipped member names])
+
+    Raises:
+        UploadError: not a zip file, or more than max_files invoice files
+    """
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile as e:
+        raise UploadError(f"Invalid zip archive: {e}")
+
+    saved: List[Tuple[str, str]] = []
+    skipped: List[str] = []
+    with archive:
+        members = [info for info in archive.infolist() if not info.is_dir()]
+        for info in members:
+            filename = os.path.basename(info.filename)
+            if not filename or filename.startswith(".") or not is_allowed_file(filename):
+                skipped.append(info.filename)
+                continue
+            if info.file_size > max_bytes or info.file_size == 0:
+                skipped.append(info.filename)
+                continue
+            if len(saved) >= max_files:
+                for filepath, _ in saved:
+                    remove_file(filepath)
+                raise UploadError(f"Archive contains more than {max_files} invoice files")
+
+            filepath = new_upload_path(filename, upload_dir)
+            with archive.open(info) as source, open(filepath, "wb") as out:
+                shutil.copyfileobj(source, out, CHUNK_SIZE)
+            saved.append((filepath, filename))
+
+    if skipped:
+        logger.info(f"📦 Zip: extracted {len(saved)} files, skipped {len(skipped)}")
+    return saved, skipped
+
+
+def remove_file(filepath: Optional[str]):
+    """Delete a stored upload, ignoring missing files"""
+    if not filepath:
+        return
+    try:
+        os.remove(filepath)
+    except OSError:
+        pass
@@ -0,0 +1,97 @@
+"""
+Vector Index
+Index vector (inner product trên embedding đã chuẩn hóa = cosine) có id, hỗ trợ
+thêm/xóa từng phần. Dùng FAISS nếu có, nếu không thì ma trận NumPy.
+"""
+
+import logging
+from typing import List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+
+class VectorIndex:
+    """
+    Exact top-k search over normalized vectors keyed by integer ids
+
+    Backends:
+    - faiss: IndexIDMap over IndexFlatIP
+    - numpy: contiguous matrix + one matrix-vector product per query
+      (a few ms for tens of thousands of 384-d vectors)
+    """
+
+    def __init__(self, dimension: int):
+        if np is None:
+            raise RuntimeError("numpy is required for the vector index")
+        self.dimension = dimension
+        self.backend = "faiss" if faiss is not None else "numpy"
+        self._ids = set()
+        if faiss is not None:
+            self._index = faiss.IndexIDMap(faiss.IndexFlatIP(dimension))
+        else:
+            self._matrix = np.zeros((0, dimension), dtype="float32")
+            self._row_ids = np.zeros(0, dtype="int64")
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._ids
+
+    def add(self, ids: Sequence[int], vectors):
+        """Add (or replace) vectors; `vectors` is a (len(ids), dimension) float32 array"""
+        if not len(ids):
+            return
+        ids_array = np.asarray(ids, dtype="int64")
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        self.remove([i for i in ids if i in self._ids])
+
+        if faiss is not None:
+            self._index.add_with_ids(vectors, ids_array)
+        else:
+            self._matrix = np.vstack([self._matrix, vectors])
+            self._row_ids = np.concatenate([self._row_ids, ids_array])
+        self._ids.update(int(i) for i in ids)
+
+    def remove(self, ids: Sequence[int]):
+        """Drop vectors by id (unknown ids are ignored)"""
+        ids = [int(i) for i in ids if int(i) in self._ids]
+        if not ids:
+            return
+        ids_array = np.asarray(ids, dtype="int64")
+        if faiss is not None:
+            self._index.remove_ids(ids_array)
+        else:
+            keep = ~np.isin(self._row_ids, ids_array)
+            self._matrix = self._matrix[keep]
+            self._row_ids = self._row_ids[keep]
+        self._ids.difference_update(ids)
+
+    def search(self, vector, top_k: int = 5) -> List[Tuple[int, float]]:
+        """Top-k (id, score) pairs, best first"""
+        if not self._ids or top_k <= 0:
+            return []
+        top_k = min(top_k, len(self._ids))
+        query = np.ascontiguousarray(vector, dtype="float32").reshape(1, -1)
+
+        if faiss is not None:
+            scores, ids = self._index.search(query, top_k)
+            return [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i != -1]
+
+        scores = self._matrix @ query[0]
+        if top_k < len(scores):
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return [(int(self._row_ids[i]), float(scores[i])) for i in top]
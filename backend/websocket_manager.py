@@ -1,75 +1,464 @@
 """
 WebSocket Manager for Real-time OCR Notifications
+
+Each connection has a bounded send queue drained by its own writer task, so a
+slow client never delays delivery to the others. Messages are serialized once
+per fan-out and the same encoded text is queued for every target socket.
+
+Client protocol (JSON text frames):
+- {"type": "subscribe", "job_ids": [...], "last_seq": N}: also receive updates
+  for these jobs; events with seq > last_seq are replayed first. Only jobs
+  enqueued by the connection's user are accepted (see job_owner_lookup)
+- {"type": "unsubscribe", "job_ids": [...]}
+- {"type": "resume", "last_seq": N}: replay the user's events missed since N
+- {"type": "pong"} / {"type": "ping"}: heartbeat
+Bus events carry "seq" (the event log id); a replay ends with
+{"type": "replay_complete", "last_seq": N}. Clients dedupe by seq.
 """
 
-from typing import Dict, List
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
 from fastapi import WebSocket
+from collections import deque
+import asyncio
 import json
 import logging
+import os
+import time
 from datetime import datetime
 
+from utils.tool_cache import invoice_data_version
+
 logger = logging.getLogger(__name__)
 
+# Max queued messages per connection before the slow-consumer policy applies
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "100"))
+# Seconds a single send may take before the client is considered stuck
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+# "drop_oldest": discard the oldest queued message; "disconnect": close the slow client
+SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest").lower()
+# Connection limits: oldest connection of a user is evicted past the per-user cap,
+# new connections are rejected past the global cap
+MAX_CONNECTIONS_PER_USER = int(os.getenv("WS_MAX_CONNECTIONS_PER_USER", "5"))
+MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "10000"))
+# Application heartbeat: a {"type": "ping"} every interval; clients that send
+# nothing (pong or any message) for WS_IDLE_TIMEOUT seconds are reaped
+HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "25"))
+IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "75"))
+# Connection/user count samples kept for the metrics view (one per heartbeat)
+METRICS_HISTORY = int(os.getenv("WS_METRICS_HISTORY", "360"))
+
+
+def encode_message(message: dict) -> str:
+    """Serialize a message once for every target socket (same format as send_json)"""
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+class ClientConnection:
+    """One WebSocket with its bounded send queue and writer task"""
+
+    def __init__(self, websocket: WebSocket, user_id: str, queue_size: int = SEND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.sent = 0
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+        self.job_ids: Set[str] = set()
+
+
 class WebSocketManager:
     """Manage WebSocket connections for real-time notifications"""
 
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+    def __init__(self, queue_size: int = SEND_QUEUE_SIZE, send_timeout: float = SEND_TIMEOUT,
+                 slow_consumer_policy: str = SLOW_CONSUMER_POLICY):
+        self.active_connections: Dict[str, Dict[WebSocket, ClientConnection]] = {}
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.slow_consumer_policy = slow_consumer_policy
+        self.dropped_messages = 0
+        self.slow_disconnects = 0
+        self.max_connections_per_user = MAX_CONNECTIONS_PER_USER
+        self.max_connections = MAX_CONNECTIONS
+        self.heartbeat_interval = HEARTBEAT_INTERVAL
+        self.idle_timeout = IDLE_TIMEOUT
+        self.rejected_connections = 0
+        self.evicted_connections = 0
+        self.reaped_connections = 0
+        self.metrics_history: deque = deque(maxlen=METRICS_HISTORY)
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        # job_id -> connections subscribed to that job (in addition to its owner)
+        self.job_subscribers: Dict[str, Set[ClientConnection]] = {}
+        self.notification_bus = None
+        self.replayed_events = 0
+        # job_ids -> {job_id: owner user_id} (OCRJobService.get_job_owners); without it
+        # no job can be subscribed, since nothing proves the connection owns it
+        self.job_owner_lookup: Optional[Callable[[List[str]], Dict[str, str]]] = None
+        self.rejected_subscriptions = 0
+
+    async def connect(self, websocket: WebSocket, user_id: str = "anonymous") -> bool:
+        """
+        Connect a WebSocket client
+
+        Returns:
+            False if the connection was rejected (global limit reached)
+        """
+        if self.get_connection_count() >= self.max_connections:
+            self.rejected_connections += 1
+            logger.warning(f"⚠️ WebSocket limit reached ({self.max_connections}), rejecting {user_id}")
+            await self._close(websocket, code=1013)  # Try again later
+            return False
 
-    async def connect(self, websocket: WebSocket, user_id: str = "anonymous"):
-        """Connect a WebSocket client"""
         await websocket.accept()
 
-        if user_id not in self.active_connections:
-            self.active_connections[user_id] = []
+        # Per-user cap: drop the oldest connection (typically a dead mobile socket)
+        user_connections = self.active_connections.get(user_id, {})
+        while len(user_connections) >= self.max_connections_per_user:
+            oldest = next(iter(user_connections.values()))
+            self.evicted_connections += 1
+            logger.info(f"WebSocket per-user limit reached for {user_id}, closing oldest connection")
+            self.disconnect(oldest.websocket, user_id)
+            asyncio.ensure_future(self._close(oldest.websocket, code=1008))
+            user_connections = self.active_connections.get(user_id, {})
 
-        self.active_connections[user_id].append(websocket)
+        connection = ClientConnection(websocket, user_id, self.queue_size)
+        connection.writer = asyncio.create_task(self._writer(connection))
+        self.active_connections.setdefault(user_id, {})[websocket] = connection
         logger.info(f"WebSocket connected: {user_id} (total: {len(self.active_connections[user_id])})")
+        self._ensure_heartbeat()
 
         # Send welcome message
-        await self.send_to_client(websocket, {
+        self._enqueue(connection, encode_message({
             "type": "connected",
             "message": "Connected to OCR notification service",
             "timestamp": datetime.now().isoformat()
-        })
+        }))
+        return True
+
+    def touch(self, websocket: WebSocket, user_id: str = "anonymous"):
+        """Record client activity (any received message, including pong)"""
+        connection = self.active_connections.get(user_id, {}).get(websocket)
+        if connection:
+            connection.last_seen = time.monotonic()
 
     def disconnect(self, websocket: WebSocket, user_id: str = "anonymous"):
         """Disconnect a WebSocket client"""
-        if user_id in self.active_connections:
-            if websocket in self.active_connections[user_id]:
-                self.active_connections[user_id].remove(websocket)
-                logger.info(f"WebSocket disconnected: {user_id} (remaining: {len(self.active_connections[user_id])})")
+        connections = self.active_connections.get(user_id)
+        if not connections or websocket not in connections:
+            return
+
+        connection = connections.pop(websocket)
+        for job_id in connection.job_ids:
+            self._remove_job_subscriber(job_id, connection)
+        connection.job_ids.clear()
+        if connection.writer and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+        logger.info(f"WebSocket disconnected: {user_id} (remaining: {len(connections)})")
 
-                # Clean up empty user lists
-                if not self.active_connections[user_id]:
-                    del self.active_connections[user_id]
+        # Clean up empty user lists
+        if not connections:
+            del self.active_connections[user_id]
+
+    def _get_connection(self, websocket: WebSocket, user_id: str) -> Optional[ClientConnection]:
+        return self.active_connections.get(user_id, {}).get(websocket)
+
+    async def subscribe(self, websocket: WebSocket, user_id: str, job_ids: Iterable[str]) -> List[str]:
+        """Subscribe a connection to updates of OCR jobs owned by user_id (others are ignored)"""
+        connection = self._get_connection(websocket, user_id)
+        if not connection:
+            return []
+        requested = []
+        for job_id in job_ids:
+            job_id = str(job_id).strip()
+            if job_id and job_id not in connection.job_ids and job_id not in requested:
+                requested.append(job_id)
+
+        added = []
+        for job_id in await self._owned_job_ids(user_id, requested):
+            connection.job_ids.add(job_id)
+            self.job_subscribers.setdefault(job_id, set()).add(connection)
+            added.append(job_id)
+        return added
+
+    async def _owned_job_ids(self, user_id: str, job_ids: List[str]) -> List[str]:
+        """Keep the job ids whose ocr_jobs.user_id is user_id"""
+        if not job_ids:
+            return []
+        owners = {}
+        if self.job_owner_lookup is not None:
+            loop = asyncio.get_running_loop()
+            try:
+                owners = await loop.run_in_executor(None, self.job_owner_lookup, job_ids)
+            except Exception as e:
+                logger.error(f"❌ Job owner lookup failed for {user_id}: {e}")
+        owned = [job_id for job_id in job_ids if owners.get(job_id) == user_id]
+        if len(owned) < len(job_ids):
+            self.rejected_subscriptions += len(job_ids) - len(owned)
+            logger.warning(f"⚠️ {user_id} tried to subscribe to {len(job_ids) - len(owned)} jobs it does not own")
+        return owned
+
+    def unsubscribe(self, websocket: WebSocket, user_id: str, job_ids: Iterable[str]):
+        """Remove job subscriptions of a connection"""
+        connection = self._get_connection(websocket, user_id)
+        if not connection:
+            return
+        for job_id in job_ids:
+            job_id = str(job_id).strip()
+            if job_id in connection.job_ids:
+                connection.job_ids.discard(job_id)
+                self._remove_job_subscriber(job_id, connection)
+
+    def _remove_job_subscriber(self, job_id: str, connection: ClientConnection):
+        subscribers = self.job_subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self.job_subscribers[job_id]
+
+    async def replay(self, websocket: WebSocket, user_id: str, last_seq: int = 0,
+                     job_ids: Optional[List[str]] = None, include_user: bool = True) -> int:
+        """
+        Queue stored events missed since last_seq, then a replay_complete marker
+
+        Args:
+            last_seq: Last seq the client has seen (0 = everything still retained)
+            job_ids: Jobs to replay (in addition to the user's own events); only
+                jobs this connection is subscribed to are replayed
+            include_user: Replay every event addressed to user_id
+
+        Returns:
+            Number of replayed events
+        """
+        connection = self._get_connection(websocket, user_id)
+        if not connection:
+            return 0
+        if job_ids is not None:
+            # Subscriptions are ownership-checked; never replay another user's job
+            job_ids = [job_id for job_id in job_ids if job_id in connection.job_ids]
+
+        events = []
+        if self.notification_bus is not None:
+            loop = asyncio.get_running_loop()
+            try:
+                events = await loop.run_in_executor(
+                    None,
+                    lambda: self.notification_bus.replay(
+                        user_id=user_id if include_user else None,
+                        job_ids=job_ids,
+                        after_id=last_seq
+                    )
+                )
+            except NotImplementedError:
+                events = []
+            except Exception as e:
+                logger.error(f"❌ WebSocket replay failed for {user_id}: {e}")
+
+        seq = last_seq
+        for event in events:
+            self._enqueue(connection, encode_message({**(event.get("notification") or {}), "seq": event["id"]}))
+            seq = max(seq, event["id"])
+        self._enqueue(connection, encode_message({"type": "replay_complete", "last_seq": seq, "count": len(events)}))
+        self.replayed_events += len(events)
+        if events:
+            logger.info(f"🔁 Replayed {len(events)} events to {user_id} (after seq {last_seq})")
+        return len(events)
+
+    async def handle_client_message(self, websocket: WebSocket, user_id: str, data: str):
+        """Handle one text frame of the client protocol (see module docstring)"""
+        try:
+            message = json.loads(data)
+        except ValueError:
+            message = None
+        if not isinstance(message, dict):
+            if data == "ping":
+                await self.send_to_client(websocket, {"type": "pong"})
+            return
+
+        message_type = message.get("type")
+        try:
+            last_seq = int(message.get("last_seq") or 0)
+        except (TypeError, ValueError):
+            last_seq = 0
+        job_ids = message.get("job_ids") or []
+        if isinstance(job_ids, str):
+            job_ids = [job_ids]
+
+        if message_type == "subscribe":
+            added = await self.subscribe(websocket, user_id, job_ids)
+            await self.send_to_client(websocket, {"type": "subscribed", "job_ids": added})
+            if added and message.get("last_seq") is not None:
+                await self.replay(websocket, user_id, last_seq, job_ids=added, include_user=False)
+        elif message_type == "unsubscribe":
+            self.unsubscribe(websocket, user_id, job_ids)
+            await self.send_to_client(websocket, {"type": "unsubscribed", "job_ids": job_ids})
+        elif message_type == "resume":
+            connection = self._get_connection(websocket, user_id)
+            await self.replay(websocket, user_id, last_seq,
+                              job_ids=sorted(connection.job_ids) if connection else None)
+        elif message_type == "ping":
+            await self.send_to_client(websocket, {"type": "pong"})
+        elif message_type != "pong":
+            logger.debug(f"Unknown WebSocket message from {user_id}: {message_type}")
 
     async def send_to_user(self, user_id: str, message: dict):
-        """Send message to all connections of a specific user"""
-        if user_id in self.active_connections:
-            disconnected = []
-            for websocket in self.active_connections[user_id]:
-                try:
-                    await websocket.send_json(message)
-                except Exception as e:
-                    logger.error(f"Failed to send to {user_id}: {e}")
-                    disconnected.append(websocket)
-
-            # Remove disconnected clients
-            for websocket in disconnected:
-                self.disconnect(websocket, user_id)
+        """Queue a message for all connections of a specific user"""
+        connections = self.active_connections.get(user_id)
+        if connections:
+            self._fan_out(list(connections.values()), encode_message(message))
 
     async def send_to_client(self, websocket: WebSocket, message: dict):
         """Send message to a specific WebSocket client"""
+        for connections in self.active_connections.values():
+            connection = connections.get(websocket)
+            if connection:
+                self._enqueue(connection, encode_message(message))
+                return
         try:
             await websocket.send_json(message)
         except Exception as e:
             logger.error(f"Failed to send to client: {e}")
 
     async def broadcast(self, message: dict):
-        """Send message to all connected clients"""
-        for user_id, connections in self.active_connections.items():
-            await self.send_to_user(user_id, message)
+        """Queue a message for all connected clients"""
+        self._fan_out(self._all_connections(), encode_message(message))
+
+    def _fan_out(self, connections: Iterable[ClientConnection], text: str):
+        """Queue pre-encoded text on every connection (never awaits a socket)"""
+        for connection in connections:
+            self._enqueue(connection, text)
+
+    def _enqueue(self, connection: ClientConnection, text: str):
+        """Queue text for one connection, applying the slow-consumer policy when full"""
+        try:
+            connection.queue.put_nowait(text)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        if self.slow_consumer_policy == "disconnect":
+            self.slow_disconnects += 1
+            logger.warning(f"⚠️ Disconnecting slow WebSocket client: {connection.user_id}")
+            self.disconnect(connection.websocket, connection.user_id)
+            asyncio.ensure_future(self._close(connection.websocket, code=1008))
+            return
+
+        # drop_oldest: the newest status update matters more than stale ones
+        connection.queue.get_nowait()
+        connection.queue.put_nowait(text)
+        connection.dropped += 1
+        self.dropped_messages += 1
+        if connection.dropped == 1 or connection.dropped % 100 == 0:
+            logger.warning(f"⚠️ Slow WebSocket client {connection.user_id}: {connection.dropped} messages dropped")
+
+    async def _writer(self, connection: ClientConnection):
+        """Drain one connection's queue; a failed or stuck send disconnects the client"""
+        try:
+            while True:
+                text = await connection.queue.get()
+                await self._send_with_timeout(connection.websocket, text)
+                connection.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to send to {connection.user_id}: {e}")
+            self.disconnect(connection.websocket, connection.user_id)
+            await self._close(connection.websocket)
+
+    async def _send_with_timeout(self, websocket: WebSocket, text: str):
+        """
+        send_text bounded by send_timeout
+
+        Not asyncio.wait_for: before Python 3.12 it swallows a cancel() that
+        arrives as the send completes, leaving a disconnected client's writer
+        parked on its queue forever.
+        """
+        send = asyncio.ensure_future(websocket.send_text(text))
+        try:
+            done, _ = await asyncio.wait((send,), timeout=self.send_timeout)
+        finally:
+            if not send.done():
+                send.cancel()
+        if not done:
+            raise asyncio.TimeoutError(f"send took longer than {self.send_timeout}s")
+        send.result()
+
+    @staticmethod
+    async def _close(websocket: WebSocket, code: int = 1011):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    def _ensure_heartbeat(self):
+        """Start the heartbeat/reaper task on the running loop (once)"""
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def _heartbeat(self):
+        """Ping live clients, reap idle ones and sample connection metrics"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                self.reap_idle()
+                ping = encode_message({"type": "ping", "timestamp": datetime.now().isoformat()})
+                self._fan_out(self._all_connections(), ping)
+                self.metrics_history.append({
+                    "timestamp": datetime.now().isoformat(),
+                    "connections": self.get_connection_count(),
+                    "users": self.get_user_count()
+                })
+            except Exception as e:
+                logger.error(f"❌ WebSocket heartbeat error: {e}")
+
+    def reap_idle(self) -> int:
+        """Close connections without client activity for idle_timeout seconds"""
+        cutoff = time.monotonic() - self.idle_timeout
+        idle = [connection for connection in self._all_connections() if connection.last_seen < cutoff]
+        for connection in idle:
+            self.disconnect(connection.websocket, connection.user_id)
+            asyncio.ensure_future(self._close(connection.websocket, code=1001))
+        if idle:
+            self.reaped_connections += len(idle)
+            logger.info(f"🧹 Reaped {len(idle)} idle WebSocket connections")
+        return len(idle)
+
+    def _all_connections(self) -> List[ClientConnection]:
+        return [
+            connection for user_connections in self.active_connections.values()
+            for connection in user_connections.values()
+        ]
+
+    def attach_notification_bus(self, bus, loop: asyncio.AbstractEventLoop):
+        """
+        Subscribe to the cross-process notification bus
+
+        Events published by other processes (e.g. worker.py) are handed to
+        this event loop and fanned out to the user's connections here.
+        """
+        def on_event(event: Dict[str, Any]):
+            asyncio.run_coroutine_threadsafe(self._deliver_event(event), loop)
+
+        self.notification_bus = bus
+        bus.subscribe(on_event)
+        logger.info("📡 WebSocket manager subscribed to notification bus")
+
+    async def _deliver_event(self, event: Dict[str, Any]):
+        """Fan out one bus event to its user's connections and the job's subscribers"""
+        notification = event.get("notification") or {}
+        if notification.get("type") == "ocr_job_update" and notification.get("status") == "done":
+            # Another process saved an invoice: drop caches built on invoice data
+            invoice_data_version.bump()
+
+        targets = set(self.active_connections.get(event.get("user_id", "anonymous"), {}).values())
+        job_id = notification.get("job_id")
+        if job_id:
+            targets |= self.job_subscribers.get(str(job_id), set())
+        if not targets:
+            return
+        if event.get("id") is not None:
+            notification = {**notification, "seq": event["id"]}
+        self._fan_out(targets, encode_message(notification))
 
     def get_connection_count(self) -> int:
         """Get total number of active connections"""
@@ -79,5 +468,28 @@ class WebSocketManager:
         """Get number of unique users connected"""
         return len(self.active_connections)
 
+    def get_stats(self) -> Dict[str, Any]:
+        """Connection, limit and backpressure counters"""
+        connections = self._all_connections()
+        return {
+            "connections": len(connections),
+            "users": len(self.active_connections),
+            "queued_messages": sum(connection.queue.qsize() for connection in connections),
+            "dropped_messages": self.dropped_messages,
+            "slow_disconnects": self.slow_disconnects,
+            "slow_consumer_policy": self.slow_consumer_policy,
+            "queue_size": self.queue_size,
+            "max_connections": self.max_connections,
+            "max_connections_per_user": self.max_connections_per_user,
+            "rejected_connections": self.rejected_connections,
+            "evicted_connections": self.evicted_connections,
+            "reaped_connections": self.reaped_connections,
+            "heartbeat_interval": self.heartbeat_interval,
+            "idle_timeout": self.idle_timeout,
+            "job_subscriptions": sum(len(subscribers) for subscribers in self.job_subscribers.values()),
+            "rejected_subscriptions": self.rejected_subscriptions,
+            "replayed_events": self.replayed_events
+        }
+
 # Global WebSocket manager instance
-websocket_manager = WebSocketManager()
\ No newline at end of file
+websocket_manager = WebSocketManager()
@@ -9,7 +9,14 @@ Polls the ocr_jobs table and processes queued jobs:
 3. Extract fields (regex)
 4. Save invoice to DB
 5. Update job status
-6. (Future) emit WebSocket notification
+6. Publish job status on the notification bus (API processes push it to WebSockets)
+   plus aggregate progress for jobs that belong to a batch upload
+
+Jobs are claimed atomically (FOR UPDATE SKIP LOCKED), so several workers and
+the WORKER_CONCURRENCY threads of one worker drain the queue in parallel.
+While a job runs, a heartbeat thread refreshes its heartbeat_at; 'processing'
+jobs whose heartbeat is older than JOB_STALE_AFTER (their worker crashed or
+was killed) are re-queued by the next worker that polls.
 
 Usage:
     python backend/worker.py
@@ -17,6 +24,9 @@ Usage:
 Environment variables:
     POLL_INTERVAL: seconds between polls (default: 5)
     MAX_JOBS_PER_POLL: max jobs to process per poll (default: 3)
+    WORKER_CONCURRENCY: jobs processed in parallel (default: 4)
+    JOB_HEARTBEAT_INTERVAL: seconds between heartbeats of running jobs (default: 30)
+    JOB_STALE_AFTER: seconds without heartbeat before a job is re-queued (default: 300)
     TESSERACT_PATH: path to tesseract executable (optional, auto-detect)
 """
 
@@ -25,8 +35,8 @@ import os
 import time
 import logging
 import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
-import asyncio
 
 # Setup logging
 logging.basicConfig(
@@ -50,27 +60,38 @@ except Exception as e:
 # Add backend path for WebSocket manager
 sys.path.insert(0, os.path.dirname(__file__))
 from main import extract_invoice_fields, calculate_pattern_confidence
+from services.ocr_service import OCRService
+from utils.document_format import sniff_file, PDF, XML
+from utils.e_invoice_xml import parse_e_invoice
 
-# Import WebSocket manager for real-time notifications
+# Notification bus: websockets live in the API processes, which subscribe to it
 try:
-    from websocket_manager import websocket_manager
-    logger.info("✅ WebSocket manager initialized")
+    from utils.notification_bus import get_notification_bus
+    notification_bus = get_notification_bus()
+    logger.info("✅ Notification bus initialized")
 except Exception as e:
-    logger.warning(f"⚠️ WebSocket manager not available: {e}")
-    websocket_manager = None
+    logger.warning(f"⚠️ Notification bus not available: {e}")
+    notification_bus = None
 
 # Configuration
 POLL_INTERVAL = int(os.getenv('POLL_INTERVAL', '5'))
 MAX_JOBS_PER_POLL = int(os.getenv('MAX_JOBS_PER_POLL', '3'))
+WORKER_CONCURRENCY = max(1, int(os.getenv('WORKER_CONCURRENCY', '4')))
 MAX_RETRIES = 3
+JOB_HEARTBEAT_INTERVAL = float(os.getenv('JOB_HEARTBEAT_INTERVAL', '30'))
+JOB_STALE_AFTER = float(os.getenv('JOB_STALE_AFTER', '300'))
+
+# Jobs this worker is processing right now (their heartbeat is kept fresh)
+_running_jobs = set()
+_running_jobs_lock = threading.Lock()
 
 
-async def send_ocr_notification(job_id: str, status: str, user_id: str = "anonymous", invoice_data: dict = None, error: str = None):
+def send_ocr_notification(job_id: str, status: str, user_id: str = "anonymous", invoice_data: dict = None, error: str = None):
     """
-    Send WebSocket notification for OCR job status update
+    Publish an OCR job status update; API processes forward it to the user's WebSockets
     """
-    if not websocket_manager:
-        logger.debug("WebSocket manager not available, skipping notification")
+    if not notification_bus:
+        logger.debug("Notification bus not available, skipping notification")
         return
 
     try:
@@ -96,12 +117,54 @@ async def send_ocr_notification(job_id: str, status: str, user_id: str = "anonym
                 "message": "OCR processing started"
             })
 
-        # Send to specific user
-        await websocket_manager.send_to_user(user_id, notification)
-        logger.info(f"📡 WebSocket notification sent to {user_id}: {status}")
+        # Publish for the specific user
+        notification_bus.publish(user_id, notification)
+        logger.info(f"📡 Notification published for {user_id}: {status}")
+
+    except Exception as e:
+        logger.error(f"❌ Failed to publish notification: {e}")
+
+
+def send_batch_progress(batch_id: str, user_id: str = "anonymous"):
+    """Publish aggregate progress (job counts per status) of a batch upload"""
+    if not notification_bus:
+        return
 
+    conn = None
+    try:
+        conn = db_tools.connect()
+        if not conn:
+            return
+        conn.rollback()  # Ensure clean state
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT status, COUNT(*) AS count
+                FROM ocr_jobs
+                WHERE batch_id = %s
+                GROUP BY status
+            """, (batch_id,))
+            rows = cursor.fetchall()
+
+        counts = {"queued": 0, "processing": 0, "done": 0, "failed": 0}
+        for row in rows:
+            counts[row['status']] = counts.get(row['status'], 0) + row['count']
+        total = sum(counts.values())
+        notification_bus.publish(user_id, {
+            "type": "ocr_batch_progress",
+            "batch_id": str(batch_id),
+            "total": total,
+            **counts,
+            "progress": round((counts["done"] + counts["failed"]) * 100 / total) if total else 0,
+            "timestamp": datetime.now().isoformat()
+        })
     except Exception as e:
-        logger.error(f"❌ Failed to send WebSocket notification: {e}")
+        logger.error(f"❌ Failed to publish batch progress for {batch_id}: {e}")
+    finally:
+        if conn:
+            try:
+                db_tools.release_connection(conn)
+            except:
+                pass
 
 
 def run_ocr_on_file(filepath: str, filename: str) -> tuple:
@@ -110,22 +173,37 @@ def run_ocr_on_file(filepath: str, filename: str) -> tuple:
     Returns: (success: bool, ocr_text: str, extracted_data: dict, error: str)
     """
     try:
-        from PIL import Image
-        import pytesseract
-        import tempfile
-        
         if not os.path.exists(filepath):
             return False, "", {}, f"File not found: {filepath}"
         
-        # Open image and run Tesseract
-        image = Image.open(filepath)
-        
-        # Configure pytesseract
+        document_format = sniff_file(filepath)
+        if document_format == XML:
+            # E-invoice XML: exact fields, no OCR
+            with open(filepath, "rb") as f:
+                extracted_data, ocr_text = parse_e_invoice(f.read())
+            logger.info(f"✅ E-invoice XML parsed for {filename}: {extracted_data['invoice_code']}")
+            return True, ocr_text, extracted_data, None
+
+        from PIL import Image
+        import pytesseract
         from ocr_config import configure_tesseract
-        if configure_tesseract():
-            ocr_text = pytesseract.image_to_string(image, lang='vie+eng')
+        if document_format == PDF:
+            # Multi-page PDF: text layer where present, scanned pages OCRed in parallel.
+            # Strict: a page Tesseract cannot read fails the job (no mock text is saved)
+            ocr_service = OCRService()
+            if not ocr_service.has_text_fast_path(filepath) and not configure_tesseract():
+                raise Exception("Tesseract not configured properly")
+            pages = ocr_service.extract_pdf_pages(filepath, filename, strict=True)
+            ocr_text = "\n\n".join(page["text"] for page in pages)
         else:
-            raise Exception("Tesseract not configured properly")
+            # Open image and run Tesseract
+            image = Image.open(filepath)
+            
+            # Configure pytesseract
+            if configure_tesseract():
+                ocr_text = pytesseract.image_to_string(image, lang='vie+eng')
+            else:
+                raise Exception("Tesseract not configured properly")
         
         if not ocr_text or len(ocr_text.strip()) == 0:
             return False, "", {}, "OCR produced no text (image may be blank)"
@@ -168,7 +246,7 @@ def process_job(job_id: str, filepath: str, filename: str, user_id: str = "anony
             conn.commit()
 
         # Send WebSocket notification for processing start
-        asyncio.run(send_ocr_notification(job_id, "processing", user_id))
+        send_ocr_notification(job_id, "processing", user_id)
         
         # Run OCR
         success, ocr_text, extracted_data, error = run_ocr_on_file(filepath, filename)
@@ -185,7 +263,7 @@ def process_job(job_id: str, filepath: str, filename: str, user_id: str = "anony
                 conn.commit()
 
             # Send WebSocket notification for failure
-            asyncio.run(send_ocr_notification(job_id, "failed", user_id, error=error))
+            send_ocr_notification(job_id, "failed", user_id, error=error)
 
             logger.error(f"❌ Job {job_id} failed: {error}")
             return False        # OCR succeeded - save invoice to DB
@@ -213,7 +291,7 @@ def process_job(job_id: str, filepath: str, filename: str, user_id: str = "anony
                     datetime.now()
                 ))
                 result = cursor.fetchone()
-                invoice_id = result[0] if result else None
+                invoice_id = result['id'] if result else None
                 conn.commit()
             
             # Update job to 'done' with invoice_id
@@ -235,7 +313,7 @@ def process_job(job_id: str, filepath: str, filename: str, user_id: str = "anony
                 "total_amount": extracted_data.get('total_amount', 'N/A'),
                 "confidence_score": confidence
             }
-            asyncio.run(send_ocr_notification(job_id, "done", user_id, invoice_data=invoice_notification_data))
+            send_ocr_notification(job_id, "done", user_id, invoice_data=invoice_notification_data)
 
             logger.info(f"✅ Job {job_id} completed successfully (invoice_id: {invoice_id})")
             return True
@@ -263,13 +341,18 @@ def process_job(job_id: str, filepath: str, filename: str, user_id: str = "anony
     finally:
         if conn:
             try:
-                conn.close()
+                db_tools.release_connection(conn)
             except:
                 pass
 
 
 def fetch_queued_jobs(limit: int = 5) -> list:
-    """Fetch queued jobs from DB that haven't exceeded max retries"""
+    """
+    Claim queued jobs that haven't exceeded max retries
+
+    Claimed rows are switched to 'processing' in the same statement; SKIP LOCKED
+    lets concurrent workers claim disjoint jobs.
+    """
     conn = None
     try:
         conn = db_tools.connect()
@@ -279,13 +362,19 @@ def fetch_queued_jobs(limit: int = 5) -> list:
         conn.rollback()  # Ensure clean state
         with conn.cursor() as cursor:
             cursor.execute("""
-                SELECT id, filepath, filename, user_id
-                FROM ocr_jobs
-                WHERE status = %s AND attempts < %s
-                ORDER BY created_at ASC
-                LIMIT %s
+                UPDATE ocr_jobs
+                SET status = 'processing', started_at = now(), heartbeat_at = now(), updated_at = now()
+                WHERE id IN (
+                    SELECT id FROM ocr_jobs
+                    WHERE status = %s AND attempts < %s
+                    ORDER BY created_at ASC
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, filepath, filename, user_id, batch_id
             """, ('queued', MAX_RETRIES, limit))
             results = cursor.fetchall()
+            conn.commit()
         
         # Debug: log what we got
         if results:
@@ -301,38 +390,162 @@ def fetch_queued_jobs(limit: int = 5) -> list:
     finally:
         if conn:
             try:
-                conn.close()
+                db_tools.release_connection(conn)
             except:
                 pass
 
 
+def send_heartbeats():
+    """Refresh heartbeat_at of the jobs this worker is processing"""
+    with _running_jobs_lock:
+        job_ids = list(_running_jobs)
+    if not job_ids:
+        return
+
+    conn = None
+    try:
+        conn = db_tools.connect()
+        if not conn:
+            return
+        conn.rollback()  # Ensure clean state
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE ocr_jobs
+                SET heartbeat_at = now()
+                WHERE id::text = ANY(%s) AND status = 'processing'
+            """, (job_ids,))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"❌ Failed to send job heartbeats: {e}")
+        if conn:
+            try:
+                conn.rollback()
+            except:
+                pass
+    finally:
+        if conn:
+            try:
+                db_tools.release_connection(conn)
+            except:
+                pass
+
+
+def heartbeat_loop(stop: threading.Event):
+    """Heartbeat thread body: keep running jobs from being reaped as stale"""
+    while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+        send_heartbeats()
+
+
+def requeue_stale_jobs() -> int:
+    """
+    Re-queue 'processing' jobs whose worker stopped sending heartbeats
+
+    Each reap counts as an attempt; a job that reached MAX_RETRIES is marked
+    failed instead, so a file that crashes the worker is not retried forever.
+    """
+    conn = None
+    try:
+        conn = db_tools.connect()
+        if not conn:
+            return 0
+
+        conn.rollback()  # Ensure clean state
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE ocr_jobs
+                SET status = CASE WHEN attempts + 1 >= %s THEN 'failed' ELSE 'queued' END,
+                    attempts = attempts + 1,
+                    error_message = %s,
+                    heartbeat_at = NULL,
+                    updated_at = now()
+                WHERE id IN (
+                    SELECT id FROM ocr_jobs
+                    WHERE status = 'processing'
+                      AND COALESCE(heartbeat_at, started_at, updated_at) < now() - %s * interval '1 second'
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, status, user_id, batch_id
+            """, (MAX_RETRIES, "Worker stopped while processing (no heartbeat)", JOB_STALE_AFTER))
+            results = cursor.fetchall()
+            conn.commit()
+    except Exception as e:
+        logger.error(f"❌ Error re-queueing stale jobs: {e}")
+        if conn:
+            try:
+                conn.rollback()
+            except:
+                pass
+        return 0
+    finally:
+        if conn:
+            try:
+                db_tools.release_connection(conn)
+            except:
+                pass
+
+    for row in results:
+        user_id = row['user_id'] or "anonymous"
+        logger.warning(f"⚠️ Stale job {row['id']} (no heartbeat for {JOB_STALE_AFTER:.0f}s) → {row['status']}")
+        if row['status'] == 'failed':
+            send_ocr_notification(str(row['id']), "failed", user_id, error="Worker stopped while processing")
+        else:
+            send_ocr_notification(str(row['id']), "queued", user_id)
+        if row['batch_id']:
+            send_batch_progress(row['batch_id'], user_id)
+    return len(results)
+
+
+def run_job(job_row) -> bool:
+    """Process one claimed job, then publish batch progress if it belongs to a batch"""
+    user_id = job_row['user_id'] or "anonymous"
+    job_id = str(job_row['id'])
+    with _running_jobs_lock:
+        _running_jobs.add(job_id)
+    try:
+        return process_job(job_row['id'], job_row['filepath'], job_row['filename'], user_id)
+    finally:
+        with _running_jobs_lock:
+            _running_jobs.discard(job_id)
+        if job_row['batch_id']:
+            send_batch_progress(job_row['batch_id'], user_id)
+
+
 def poll_and_process():
     """Main polling loop"""
-    logger.info(f"🔄 Worker started - polling every {POLL_INTERVAL}s for up to {MAX_JOBS_PER_POLL} jobs")
-    
+    batch_size = max(MAX_JOBS_PER_POLL, WORKER_CONCURRENCY)
+    logger.info(f"🔄 Worker started - polling every {POLL_INTERVAL}s for up to {batch_size} jobs, "
+                f"{WORKER_CONCURRENCY} in parallel")
+
+    executor = ThreadPoolExecutor(max_workers=WORKER_CONCURRENCY, thread_name_prefix="ocr-job")
+    stop_heartbeat = threading.Event()
+    threading.Thread(target=heartbeat_loop, args=(stop_heartbeat,), name="ocr-job-heartbeat", daemon=True).start()
+    next_stale_check = 0.0
     while True:
         try:
-            # Fetch queued jobs
-            jobs = fetch_queued_jobs(limit=MAX_JOBS_PER_POLL)
-            
+            # Jobs of crashed workers go back to the queue
+            if time.monotonic() >= next_stale_check:
+                requeue_stale_jobs()
+                next_stale_check = time.monotonic() + JOB_HEARTBEAT_INTERVAL
+
+            # Claim queued jobs
+            jobs = fetch_queued_jobs(limit=batch_size)
+
             if jobs:
-                logger.info(f"📋 Found {len(jobs)} queued job(s)")
-                
-                for job_row in jobs:
-                    job_id, filepath, filename, user_id = job_row
-                    # Process each job
-                    process_job(job_id, filepath, filename, user_id or "anonymous")
-                    # Small delay between jobs to avoid overwhelming the system
-                    time.sleep(0.5)
-            else:
-                # No jobs - log less frequently
-                logger.debug("⏳ No queued jobs at this moment")
-            
+                logger.info(f"📋 Claimed {len(jobs)} queued job(s)")
+                wait([executor.submit(run_job, job_row) for job_row in jobs])
+                # Keep draining while there is a backlog (e.g. a batch upload)
+                continue
+
+            # No jobs - log less frequently
+            logger.debug("⏳ No queued jobs at this moment")
+
             # Wait before polling again
             time.sleep(POLL_INTERVAL)
         
         except KeyboardInterrupt:
             logger.info("🛑 Worker interrupted by user")
+            executor.shutdown(wait=True)
+            stop_heartbeat.set()
             break
         except Exception as e:
             logger.error(f"❌ Unexpected error in polling loop: {e}")
@@ -150,7 +150,8 @@ class APIService {
     const timeoutId = setTimeout(() => controller.abort(), this.timeout);
 
     try {
-      const response = await fetch(`${this.baseURL}/api/upload`, {
+      // wait=true: the chat renders the extracted fields right away (OCR runs in the server's process pool)
+      const response = await fetch(`${this.baseURL}/api/upload?wait=true`, {
         method: 'POST',
         headers: {
           ...(token && { Authorization: `Bearer ${token}` }),
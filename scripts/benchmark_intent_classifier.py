@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark ChatHandler intent detection: legacy per-pattern loop vs precompiled classifier
+Chạy: python scripts/benchmark_intent_classifier.py [--iterations 2000]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+# Add backend to path
+backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+sys.path.insert(0, backend_dir)
+
+from handlers.chat_handler import INTENT_CLASSIFIER, INTENT_PATTERNS  # noqa: E402
+from utils.text_processor import TextProcessor  # noqa: E402
+
+MESSAGES = [
+    "xin chào",
+    "mở camera giúp tôi",
+    "cho tôi xem danh sách hóa đơn đã lưu",
+    "hóa đơn hôm nay có bao nhiêu",
+    "xem chi tiết hóa đơn mã HD001",
+    "thống kê doanh thu tháng này",
+    "phân tích file mau-hoa-don-01.jpg",
+    "làm sao để tạo hóa đơn VAT",
+    "tôi muốn upload ảnh",
+    "cảm ơn bạn nhiều",
+    "thời tiết hôm nay thế nào",
+    "mst của cty tnhh abc là gì",
+]
+
+
+def legacy_detect_intent(text_processor: TextProcessor, message: str) -> str:
+    """Previous ChatHandler.detect_intent logic (without its INFO logging)"""
+    message_clean = text_processor.normalize(message.lower())
+    message_lower = message.lower()
+
+    if re.search(r'[a-zA-Z0-9\-_\.]+\.(jpg|jpeg|png|pdf|gif)', message_lower, re.IGNORECASE):
+        return 'file_analysis'
+    file_keywords = ['mau-hoa-don', 'template', 'đọc dữ liệu từ ảnh', 'phân tích ảnh', 'xem ảnh', 'đọc ảnh', 'trả ảnh', 'xem file']
+    if any(keyword in message_lower for keyword in file_keywords):
+        return 'file_analysis'
+    if 'xem dữ liệu từ ảnh' in message_lower or 'dữ liệu từ ảnh' in message_lower or 'trả ảnh' in message_lower:
+        return 'file_analysis'
+
+    for intent, patterns in INTENT_PATTERNS.items():
+        for pattern in patterns:
+            if re.search(pattern, message_clean, re.IGNORECASE):
+                return intent
+            elif re.search(pattern, message.lower(), re.IGNORECASE):
+                return intent
+    return 'general'
+
+
+def compiled_detect_intent(text_processor: TextProcessor, message: str) -> str:
+    """Current ChatHandler.detect_intent logic"""
+    message_lower = message.lower()
+    message_clean = text_processor.normalize(message_lower)
+    return INTENT_CLASSIFIER.classify(message_clean, message_lower) or 'general'
+
+
+def run(detect, text_processor: TextProcessor, iterations: int) -> float:
+    """Return messages per second"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for message in MESSAGES:
+            detect(text_processor, message)
+    elapsed = time.perf_counter() - start
+    return iterations * len(MESSAGES) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    text_processor = TextProcessor()
+
+    mismatches = [
+        (message, legacy_detect_intent(text_processor, message), compiled_detect_intent(text_processor, message))
+        for message in MESSAGES
+        if legacy_detect_intent(text_processor, message) != compiled_detect_intent(text_processor, message)
+    ]
+    for message, legacy, compiled in mismatches:
+        print(f"[!] '{message}': legacy={legacy} compiled={compiled}")
+
+    legacy_rate = run(legacy_detect_intent, text_processor, args.iterations)
+    compiled_rate = run(compiled_detect_intent, text_processor, args.iterations)
+
+    print(f"Legacy loop:          {legacy_rate:>10,.0f} messages/s")
+    print(f"Precompiled rules:    {compiled_rate:>10,.0f} messages/s")
+    print(f"Speedup:              {compiled_rate / legacy_rate:>10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
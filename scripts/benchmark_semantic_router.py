@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Benchmark SemanticIntentRouter: startup cost, background model load and per-message routing latency
+Chạy: python scripts/benchmark_semantic_router.py [--iterations 200]
+
+Cần sentence-transformers (model tải về lần đầu). Mục tiêu: route() < 10ms cho
+câu chưa có trong cache trên CPU.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+# Add backend to path
+backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+sys.path.insert(0, backend_dir)
+
+from utils.semantic_router import SemanticIntentRouter  # noqa: E402
+
+MESSAGES = [
+    "xin chào",
+    "chào bạn nhé",
+    "cảm ơn bạn nhiều",
+    "bạn giúp được gì cho tôi",
+    "cho tôi xem danh sách hóa đơn",
+    "liệt kê các hóa đơn đã lưu",
+    "có tổng cộng bao nhiêu hóa đơn",
+    "xuất hóa đơn tháng này ra excel",
+    "hóa đơn tiền điện tháng 3 bao nhiêu",
+    "mst của cty tnhh abc là gì",
+]
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    router = SemanticIntentRouter()
+    constructor_ms = (time.perf_counter() - started) * 1000
+    if not router.wait_until_ready():
+        print("[!] Embedding model unavailable (pip install sentence-transformers)")
+        sys.exit(1)
+
+    # Uncached: a unique suffix defeats the router's message cache
+    uncached = []
+    for i in range(args.iterations):
+        message = f"{MESSAGES[i % len(MESSAGES)]} {i}"
+        t = time.perf_counter()
+        router.route(message)
+        uncached.append((time.perf_counter() - t) * 1000)
+
+    cached = []
+    for i in range(args.iterations):
+        t = time.perf_counter()
+        router.route(MESSAGES[i % len(MESSAGES)])
+        cached.append((time.perf_counter() - t) * 1000)
+
+    for message in MESSAGES:
+        result = router.route(message)
+        print(f"  {message:<40} -> {result.intent + f' ({result.score:.2f})' if result else 'escalate'}")
+
+    print(f"Constructor (non-blocking): {constructor_ms:>8.2f} ms")
+    print(f"Background model load:      {router.load_seconds * 1000:>8.0f} ms")
+    print(f"route() uncached p50/p95:   {statistics.median(uncached):>8.2f} / {percentile(uncached, 0.95):.2f} ms")
+    print(f"route() cached p50:         {statistics.median(cached):>8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark WebSocket fan-out: legacy sequential send_json vs queued writer tasks
+Chạy: python scripts/benchmark_websocket_broadcast.py [--sockets 1000] [--slow 10] [--messages 20]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+# Add backend to path
+backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+sys.path.insert(0, backend_dir)
+
+from websocket_manager import WebSocketManager  # noqa: E402
+
+MESSAGE = {
+    "type": "ocr_job_update",
+    "job_id": "7d5f1c7e-2b1a-4c8e-9a55-3f0c2f8a9b10",
+    "status": "done",
+    "message": "OCR processing completed successfully",
+    "invoice_data": {"invoice_id": 42, "invoice_code": "HD001", "buyer_name": "Công ty ABC", "total_amount": "300,000 VND"}
+}
+
+
+class SimulatedSocket:
+    """Socket whose sends take `latency` seconds; counts delivered messages"""
+
+    def __init__(self, latency: float, stats: dict):
+        self.latency = latency
+        self.stats = stats
+
+    async def accept(self):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+    async def send_text(self, text: str):
+        await asyncio.sleep(self.latency)
+        if self.latency == 0:
+            self.stats["fast_received"] += 1
+
+    async def send_json(self, message: dict):
+        await self.send_text(json.dumps(message, ensure_ascii=False, separators=(",", ":")))
+
+
+def make_sockets(count: int, slow: int, slow_latency: float, stats: dict):
+    return [SimulatedSocket(slow_latency if i < slow else 0, stats) for i in range(count)]
+
+
+async def legacy_broadcast(connections: dict, message: dict):
+    """Previous WebSocketManager.broadcast: one awaited send_json per socket"""
+    for sockets in connections.values():
+        for websocket in sockets:
+            await websocket.send_json(message)
+
+
+async def run_legacy(args) -> float:
+    stats = {"fast_received": 0}
+    sockets = make_sockets(args.sockets, args.slow, args.slow_latency, stats)
+    connections = {f"user{i}": [ws] for i, ws in enumerate(sockets)}
+    start = time.perf_counter()
+    for _ in range(args.messages):
+        await legacy_broadcast(connections, MESSAGE)
+    return time.perf_counter() - start
+
+
+async def run_queued(args) -> tuple:
+    stats = {"fast_received": 0}
+    manager = WebSocketManager(queue_size=args.queue_size)
+    sockets = make_sockets(args.sockets, args.slow, args.slow_latency, stats)
+    for i, ws in enumerate(sockets):
+        await manager.connect(ws, f"user{i}")
+    await asyncio.sleep(0.05)  # let welcome messages drain
+    stats["fast_received"] = 0
+
+    expected = (args.sockets - args.slow) * args.messages
+    start = time.perf_counter()
+    for _ in range(args.messages):
+        await manager.broadcast(MESSAGE)
+    while stats["fast_received"] < expected:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    result = manager.get_stats()
+    for i, ws in enumerate(sockets):
+        manager.disconnect(ws, f"user{i}")
+    return elapsed, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sockets", type=int, default=1000)
+    parser.add_argument("--slow", type=int, default=10, help="Number of slow clients")
+    parser.add_argument("--slow-latency", type=float, default=0.02, help="Seconds per send for slow clients")
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--queue-size", type=int, default=100)
+    args = parser.parse_args()
+
+    legacy = asyncio.run(run_legacy(args))
+    queued, stats = asyncio.run(run_queued(args))
+
+    print(f"{args.sockets} sockets ({args.slow} slow @ {args.slow_latency * 1000:.0f}ms/send), {args.messages} broadcasts")
+    print(f"Legacy sequential send_json:     {legacy * 1000:>10.1f} ms until all clients served")
+    print(f"Queued writers, encode once:     {queued * 1000:>10.1f} ms until all fast clients served")
+    print(f"Speedup for fast clients:        {legacy / queued:>10.1f}x")
+    print(f"Dropped for slow clients:        {stats['dropped_messages']:>10}")
+
+
+if __name__ == "__main__":
+    main()